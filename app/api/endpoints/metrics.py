@@ -0,0 +1,27 @@
+# app/api/endpoints/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.services.admission import memory_status
+from app.services.metrics import record_memory, registry, render_prometheus
+
+router = APIRouter()
+
+# Prometheus文本格式的内容类型
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _collect_metrics() -> str:
+    record_memory(memory_status())
+    registry.flush()
+    return render_prometheus(registry.collect())
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    以Prometheus文本格式返回渲染各阶段的耗时直方图、计数器与内存用量，汇总同一主机上所有服务进程的数据。
+    """
+    content = await run_in_threadpool(_collect_metrics)
+    return PlainTextResponse(content, media_type=PROMETHEUS_MEDIA_TYPE)
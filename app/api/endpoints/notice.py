@@ -1,138 +1,932 @@
 # app/api/endpoints/notice.py
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Body, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+from python_multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 
+import asyncio
+import io
+import json
 import os
+import shutil
 import tempfile
 import time
 import logging
 import uuid
-from app.models.notice import RenderRequest
-from app.services.excel_renderer import render_excel_template
+import zipfile
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
+from urllib.parse import quote
+from app.config import (
+    BATCH_MAX_ITEMS,
+    OUTPUT_CHUNK_SIZE,
+    OUTPUT_SPOOL_MAX_SIZE,
+    RENDER_POOL_SIZE,
+    TEMPLATE_DIR,
+    TEMPLATE_MAP,
+)
+from app.api.endpoints.profiles import require_profile_token
+from app.logging_config import DETAIL, log_summary
+from app.models.notice import (
+    ProjectRowError,
+    RenderRequest,
+    decode_render_request,
+    validate_render_request,
+)
+from app.services.admission import (
+    AdmissionRejectedError,
+    admit_render,
+    render_admission,
+)
+from app.services.metrics import RenderStats, record_render, record_validation
+from app.services.profiling import profile_headers, profile_limiter, save_profile
+from app.services.output_cache import (
+    etag_matches,
+    make_cache_key,
+    make_etag,
+    output_cache,
+)
+from app.services.render_pool import (
+    RenderCancelledError,
+    RenderTimeoutError,
+    get_sheet_limits,
+    render_in_pool,
+    render_stream_to_buffer,
+    run_stream_in_pool,
+    select_stream_engine,
+)
+from app.services.zip_writer import ZipWriter, compress_entry, resolve_compresslevel
+from app.services.project_upload import UploadError, read_project_upload
+from app.services.render_jobs import (
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_SUCCEEDED,
+    JobQueueFullError,
+    RenderJob,
+    job_queue,
+    new_job_id,
+)
+from app.services.template_cache import get_template_version
 
 # 配置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# 模板类型到文件名的映射
-TEMPLATE_MAP = {
-    "横向": "template_横向.xlsx",
-    "纵向": "template_纵向.xlsx",
-    "协同创新专项": "template_协同创新专项.xlsx",
-    "协同创新专项精品": "template_协同创新专项精品.xlsx",
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# 批量渲染zip中的逐项结果报告
+BATCH_REPORT_NAME = "report.json"
+
+
+def _content_disposition(filename: str) -> str:
+    """生成附件下载头，非ASCII文件名按RFC 5987编码"""
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return f"attachment; filename*=utf-8''{quoted_filename}"
+    return f'attachment; filename="{filename}"'
+
+
+def _iter_buffer(buffer, chunk_size: int = OUTPUT_CHUNK_SIZE):
+    """分块读取缓冲区内容，读取结束或连接中断时关闭缓冲区"""
+    try:
+        while chunk := buffer.read(chunk_size):
+            yield chunk
+    finally:
+        buffer.close()
+
+
+def _resolve_template(template_type: str, request_id: str) -> str:
+    """根据模板类型查找模板文件路径，找不到时抛出404"""
+    template_filename = TEMPLATE_MAP.get(template_type)
+    if not template_filename:
+        logger.error("[%s] 模板类型 '%s' 未找到", request_id, template_type)
+        logger.info("[%s] 可用模板类型: %s", request_id, list(TEMPLATE_MAP.keys()))
+        raise HTTPException(
+            status_code=404, detail=f"模板类型 '{template_type}' 未找到。"
+        )
+
+    logger.log(DETAIL, "[%s] 找到模板文件: %s", request_id, template_filename)
+
+    template_path = os.path.join(TEMPLATE_DIR, template_filename)
+    if not os.path.exists(template_path):
+        logger.error("[%s] 模板文件不存在: %s", request_id, template_path)
+        raise HTTPException(
+            status_code=404, detail=f"模板文件 '{template_path}' 不存在。"
+        )
+    return template_path
+
+
+def _notice_filename(template_type: str, notice_no: str) -> str:
+    """生成通知单的下载文件名"""
+    return f"{template_type}_通知单_{notice_no}.xlsx"
+
+
+async def _run_cache(func, *args):
+    """访问渲染结果缓存，启用磁盘层时在线程池中执行以免阻塞事件循环"""
+    if output_cache.has_disk_tier:
+        return await run_in_threadpool(func, *args)
+    return func(*args)
+
+
+def _inline_schema(model) -> dict:
+    """生成模型的JSON Schema，并将$defs中的引用展开，便于直接嵌入OpenAPI文档"""
+    schema = model.model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if ref is not None:
+                return resolve(definitions[ref.rsplit("/", 1)[-1]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(item) for item in node]
+        return node
+
+    return resolve(schema)
+
+
+def _request_validation_error(
+    error: ValidationError, loc: tuple = ("body",)
+) -> RequestValidationError:
+    """将快速解码的校验错误转换为FastAPI的请求校验错误，响应格式与模型参数一致"""
+    return RequestValidationError(
+        [
+            {**detail, "loc": (*loc, *detail["loc"])}
+            for detail in error.errors(include_url=False)
+        ]
+    )
+
+
+# /render 与 /jobs 自行解码请求体，在文档中声明与RenderRequest相同的请求体
+_RENDER_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": _inline_schema(RenderRequest)}},
+    }
 }
-TEMPLATE_DIR = "app/templates"
 
 
-@router.post("/render")
-async def render_notice(request: RenderRequest):
+@router.post("/render", openapi_extra=_RENDER_REQUEST_BODY)
+async def render_notice(
+    http_request: Request,
+    compresslevel: Optional[int] = Query(
+        None,
+        ge=0,
+        le=9,
+        description="输出文件的压缩级别：0为不压缩，1-9越大文件越小、越耗CPU，默认使用服务配置",
+    ),
+    profile: bool = Query(
+        False,
+        description="对本次渲染进行调用栈采样与内存跟踪（也可使用X-Profile: 1请求头），"
+        "须在X-Profile-Token头中提供令牌",
+    ),
+):
     """
     接收渲染请求，生成Excel文件并返回。
+    请求性能分析时跳过渲染结果缓存，响应头给出热点函数与内存峰值，
+    完整结果通过X-Profile-Url查询。
     """
     # 生成请求唯一标识符
     request_id = str(uuid.uuid4())
     start_time = time.time()
 
+    # 请求体直接校验为字典，不经过模型实例与model_dump()；大请求的校验不阻塞事件循环
+    body = await http_request.body()
+    try:
+        request = await run_in_threadpool(decode_render_request, body)
+    except ValidationError as e:
+        raise _request_validation_error(e)
+    template_type = request["template_type"]
+    context = request["data"]
+
+    # 请求结束时记录一条摘要，处理过程中逐步补充字段
+    summary = {
+        "request_id": request_id,
+        "template_type": template_type,
+        "notice_no": context["notice_no"],
+        "projects": len(context["projects"]),
+        "status": 500,
+    }
+    stats = RenderStats()
+    profiling = profile or http_request.headers.get("x-profile", "") in ("1", "true")
+    profile_acquired = False
+    try:
+        if profiling:
+            _acquire_profiling(http_request)
+            profile_acquired = True
+            summary["profile"] = True
+        response = await _render_notice(
+            template_type,
+            context,
+            http_request,
+            request_id,
+            summary,
+            stats,
+            resolve_compresslevel(compresslevel),
+            profile_id=request_id if profiling else None,
+        )
+        summary["status"] = response.status_code
+        return response
+    except HTTPException as e:
+        summary["status"] = e.status_code
+        raise
+    finally:
+        if profile_acquired:
+            profile_limiter.release()
+        duration = time.time() - start_time
+        summary["duration_ms"] = round(duration * 1000, 1)
+        log_summary(logger, **summary)
+        record_render(
+            template_type,
+            summary["projects"],
+            summary["status"],
+            duration,
+            cache=summary.get("cache"),
+            stats=stats if stats.stages else None,
+        )
+
+
+def _acquire_profiling(http_request: Request) -> None:
+    """校验性能分析的令牌并获取限流许可，失败时抛出403或429"""
+    require_profile_token(http_request)
+    retry_after = profile_limiter.acquire()
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="性能分析请求过于频繁，请稍后重试",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+async def _render_notice(
+    template_type: str,
+    context: dict,
+    http_request: Request,
+    request_id: str,
+    summary: dict,
+    stats: RenderStats,
+    compresslevel: int,
+    profile_id: Optional[str] = None,
+):
+    """
+    渲染单个通知单，处理结果写入summary，渲染统计写入stats。
+    传入profile_id时在性能分析下渲染，不使用缓存的渲染结果。
+    """
     # 记录请求开始日志
-    logger.info(f"[{request_id}] 开始处理Excel渲染请求")
-    logger.info(f"[{request_id}] 模板类型: {request.template_type}")
-    logger.info(
-        f"[{request_id}] 通知编号: {request.data.notice_no if hasattr(request.data, 'notice_no') else '未提供'}"
+    logger.log(DETAIL, "[%s] 开始处理Excel渲染请求", request_id)
+    logger.log(DETAIL, "[%s] 模板类型: %s", request_id, template_type)
+    logger.log(DETAIL, "[%s] 通知编号: %s", request_id, context["notice_no"])
+
+    template_path = _resolve_template(template_type, request_id)
+    logger.log(DETAIL, "[%s] 模板文件验证通过", request_id)
+
+    # 记录项目数据摘要
+    projects = context["projects"]
+    if projects:
+        logger.log(DETAIL, "[%s] 项目列表包含 %d 个项目", request_id, len(projects))
+        if logger.isEnabledFor(DETAIL):
+            for i, project in enumerate(projects[:3]):  # 只记录前3个项目
+                logger.log(
+                    DETAIL,
+                    "[%s] 项目 %d: %s - %s",
+                    request_id,
+                    i + 1,
+                    project.get("project_code", "N/A"),
+                    project.get("project_name", "N/A"),
+                )
+        if len(projects) > 3:
+            logger.log(DETAIL, "[%s] ... 还有 %d 个项目", request_id, len(projects) - 3)
+    else:
+        logger.warning("[%s] 未找到项目数据", request_id)
+
+    sheet_limits = get_sheet_limits(template_type)
+    cache_key = await _output_cache_key(
+        template_type, template_path, context, sheet_limits, compresslevel
     )
+    etag = make_etag(cache_key)
+    filename = _notice_filename(template_type, context["notice_no"])
+    logger.log(DETAIL, "[%s] 生成文件名: %s", request_id, filename)
 
-    template_filename = TEMPLATE_MAP.get(request.template_type)
-    if not template_filename:
-        logger.error(f"[{request_id}] 模板类型 '{request.template_type}' 未找到")
-        logger.info(f"[{request_id}] 可用模板类型: {list(TEMPLATE_MAP.keys())}")
-        raise HTTPException(
-            status_code=404, detail=f"模板类型 '{request.template_type}' 未找到。"
+    if_none_match = http_request.headers.get("if-none-match")
+    # "*"只在该请求已有缓存的渲染结果时视为匹配
+    exists = (
+        if_none_match is not None
+        and if_none_match.strip() == "*"
+        and await _run_cache(output_cache.get, cache_key) is not None
+    )
+    if profile_id is None and etag_matches(if_none_match, etag, exists):
+        logger.log(DETAIL, "[%s] 客户端已持有相同的渲染结果，返回304", request_id)
+        summary["cache"] = "not_modified"
+        return Response(status_code=304, headers={"ETag": etag})
+
+    buffer = await _render_output(
+        template_path,
+        context,
+        request_id,
+        summary,
+        stats,
+        compresslevel,
+        sheet_limits,
+        cache_key,
+        is_disconnected=http_request.is_disconnected,
+        profile_id=profile_id,
+    )
+
+    headers = {}
+    if stats.profile is not None:
+        try:
+            await run_in_threadpool(
+                save_profile,
+                profile_id,
+                stats.profile,
+                {
+                    "template_type": template_type,
+                    "notice_no": context["notice_no"],
+                    "projects": len(projects),
+                    "engine": stats.engine,
+                    "stages": stats.stages,
+                },
+            )
+        except Exception:
+            buffer.close()
+            raise
+        headers = profile_headers(
+            profile_id,
+            stats.profile,
+            http_request.url_for("get_profile", request_id=profile_id).path,
+        )
+        logger.info(
+            "[%s] 性能分析完成，采样%d次，内存峰值: %d字节",
+            request_id,
+            stats.profile.samples,
+            stats.profile.peak_memory,
         )
 
-    logger.info(f"[{request_id}] 找到模板文件: {template_filename}")
+    # 以流的形式返回文件，发送完成后关闭缓冲区并删除可能溢出的临时文件
+    response = StreamingResponse(
+        _iter_buffer(buffer),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": _content_disposition(filename),
+            "Content-Length": str(summary["size"]),
+            "ETag": etag,
+            "X-Cache": "HIT" if summary["cache"] == "hit" else "MISS",
+            **headers,
+        },
+        background=BackgroundTask(buffer.close),
+    )
 
-    template_path = os.path.join(TEMPLATE_DIR, template_filename)
-    if not os.path.exists(template_path):
-        logger.error(f"[{request_id}] 模板文件不存在: {template_path}")
-        raise HTTPException(
-            status_code=404, detail=f"模板文件 '{template_path}' 不存在。"
+    logger.log(DETAIL, "[%s] 开始发送响应文件", request_id)
+    return response
+
+
+async def _output_cache_key(
+    template_type: str,
+    template_path: str,
+    context: dict,
+    sheet_limits: tuple,
+    compresslevel: int,
+) -> str:
+    """
+    渲染结果的缓存键，由模板类型、模板文件版本、规范化后的数据、分表限制与压缩级别决定，
+    同时作为响应的ETag
+    """
+    return await run_in_threadpool(
+        make_cache_key,
+        template_type,
+        get_template_version(template_path),
+        context,
+        {"sheet_limits": sheet_limits, "compresslevel": compresslevel},
+    )
+
+
+async def _render_output(
+    template_path: str,
+    context: dict,
+    request_id: str,
+    summary: dict,
+    stats: RenderStats,
+    compresslevel: int,
+    sheet_limits: tuple,
+    cache_key: str,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    profile_id: Optional[str] = None,
+):
+    """
+    /render 与 /render/batch 共用的渲染步骤：先查渲染结果缓存，未命中时获取内存准入后
+    在渲染池中渲染，结果写入缓存。返回定位到开头的可读缓冲区，大小与缓存情况写入summary，
+    所用引擎、各阶段耗时与性能分析结果写入stats。渲染失败时抛出HTTPException。
+    传入profile_id时在性能分析下渲染，不使用缓存的渲染结果。
+    """
+    template_type = summary["template_type"]
+    cached_content = (
+        await _run_cache(output_cache.get, cache_key) if profile_id is None else None
+    )
+    if cached_content is not None:
+        logger.log(
+            DETAIL,
+            "[%s] 命中渲染结果缓存，大小: %d字节",
+            request_id,
+            len(cached_content),
         )
+        summary.update(cache="hit", size=len(cached_content))
+        return io.BytesIO(cached_content)
 
-    logger.info(f"[{request_id}] 模板文件验证通过")
+    summary["cache"] = "miss"
+    # 按估算内存获取渲染准入，预算不足时按RENDER_ADMISSION_POLICY排队、拒绝或改用其他引擎
+    try:
+        admission = await admit_render(
+            template_type, template_path, context, sheet_limits
+        )
+    except AdmissionRejectedError as e:
+        logger.warning("[%s] %s", request_id, e)
+        summary["admission"] = "rejected"
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    summary["admission"] = admission.result
 
-    # Pydantic模型转字典，并处理别名
+    buffer = None
     try:
-        context = request.data.model_dump()
-        logger.info(
-            f"[{request_id}] 数据模型转换成功，包含字段: {list(context.keys())}"
+        logger.log(DETAIL, "[%s] 开始渲染Excel模板", request_id)
+        # 在渲染池中渲染并序列化Excel，事件循环保持空闲以处理其他请求
+        # 预留的内存在渲染池中的任务真正结束后归还：超时或客户端断开后仍在运行的任务继续占用预算
+        buffer, render_stats = await render_in_pool(
+            template_path,
+            context,
+            is_disconnected=is_disconnected,
+            sheet_limits=sheet_limits,
+            compresslevel=compresslevel,
+            profile_id=profile_id,
+            engine=admission.engine,
+            on_done=lambda: render_admission.release(admission),
         )
+        stats.engine, stats.stages = render_stats.engine, render_stats.stages
+        stats.profile = render_stats.profile
+        summary["engine"] = stats.engine
+        logger.log(DETAIL, "[%s] Excel模板渲染完成", request_id)
 
-        # 记录项目数据摘要
-        if "projects" in context and context["projects"]:
-            logger.info(
-                f"[{request_id}] 项目列表包含 {len(context['projects'])} 个项目"
-            )
-            for i, project in enumerate(context["projects"][:3]):  # 只记录前3个项目
-                logger.info(
-                    f"[{request_id}] 项目 {i + 1}: {project.get('project_code', 'N/A')} - {project.get('project_name', 'N/A')}"
-                )
-            if len(context["projects"]) > 3:
-                logger.info(
-                    f"[{request_id}] ... 还有 {len(context['projects']) - 3} 个项目"
-                )
-        else:
-            logger.warning(f"[{request_id}] 未找到项目数据")
+        content_length = buffer.seek(0, os.SEEK_END)
+        buffer.seek(0)
+        summary["size"] = content_length
+        logger.log(
+            DETAIL, "[%s] 渲染文件已序列化，大小: %d字节", request_id, content_length
+        )
+
+        if output_cache.enabled and content_length <= output_cache.max_item_size:
+            # 缓冲区可能已溢出到临时文件，在线程池中读取
+            content = await run_in_threadpool(buffer.read)
+            buffer.close()
+            buffer = io.BytesIO(content)
+            await _run_cache(output_cache.put, cache_key, content)
+        return buffer
+
+    except RenderTimeoutError as e:
+        logger.error("[%s] Excel渲染超时: %s", request_id, e)
+        raise HTTPException(status_code=504, detail=f"渲染Excel超时: {str(e)}")
+
+    except RenderCancelledError as e:
+        logger.warning("[%s] 客户端已断开，渲染任务已取消", request_id)
+        raise HTTPException(status_code=499, detail=str(e))
 
     except Exception as e:
-        logger.error(f"[{request_id}] 数据模型转换失败: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"数据格式错误: {str(e)}")
+        logger.error("[%s] Excel渲染过程中发生错误: %s", request_id, e, exc_info=True)
+
+        # 关闭缓冲区（如果存在），溢出的临时文件随之删除
+        if buffer is not None:
+            buffer.close()
+
+        summary["error"] = str(e)
+        raise HTTPException(status_code=500, detail=f"渲染Excel时发生错误: {str(e)}")
+
 
-    tmp_file_path = None
+@router.post("/jobs", status_code=202, openapi_extra=_RENDER_REQUEST_BODY)
+async def submit_render_job(
+    http_request: Request,
+    priority: Literal["high", "normal", "low"] = Query(
+        "normal", description="任务优先级，同优先级按提交顺序执行"
+    ),
+):
+    """
+    提交异步渲染任务，请求体与 /render 相同，立即返回任务编号。
+    通过 /jobs/{job_id} 查询状态，完成后从 /jobs/{job_id}/download 下载结果。
+    任务队列已满时返回429，Retry-After给出建议的重试等待秒数。
+    """
+    job_id = new_job_id()
+    body = await http_request.body()
+    try:
+        request = await run_in_threadpool(decode_render_request, body)
+    except ValidationError as e:
+        raise _request_validation_error(e)
+    template_type = request["template_type"]
+    context = request["data"]
+    template_path = _resolve_template(template_type, job_id)
+
+    job = RenderJob(
+        job_id=job_id,
+        template_type=template_type,
+        notice_no=context["notice_no"],
+        filename=_notice_filename(template_type, context["notice_no"]),
+        project_count=len(context["projects"]),
+        priority=priority,
+    )
     try:
-        logger.info(f"[{request_id}] 开始渲染Excel模板")
-        # 渲染Excel
-        rendered_wb = render_excel_template(template_path, context)
-        logger.info(f"[{request_id}] Excel模板渲染完成")
+        await job_queue.submit(job, template_path, context)
+    except JobQueueFullError as e:
+        logger.warning("[%s] %s", job_id, e)
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
-        # 将渲染后的工作簿保存到临时文件
-        tmp_file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-        tmp_file_path.close()  # 确保文件句柄关闭
+    status_url = http_request.url_for("get_render_job", job_id=job_id).path
+    return JSONResponse(
+        status_code=202,
+        content={
+            **job.to_dict(),
+            "status_url": status_url,
+            "download_url": status_url + "/download",
+        },
+        headers={"Location": status_url},
+    )
 
-        rendered_wb.save(tmp_file_path.name)
-        logger.info(f"[{request_id}] 渲染文件已保存到临时路径: {tmp_file_path.name}")
 
-        # 生成文件名
-        filename = f"{request.template_type}_通知单_{context['notice_no']}.xlsx"
-        logger.info(f"[{request_id}] 生成文件名: {filename}")
+async def _get_job(job_id: str) -> RenderJob:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404, detail=f"渲染任务 '{job_id}' 不存在或已过期"
+        )
+    return job
 
-        # 计算处理时间
-        process_time = time.time() - start_time
-        logger.info(f"[{request_id}] 请求处理完成，耗时: {process_time:.3f}秒")
 
-        # 返回文件给客户端
-        response = FileResponse(
-            path=tmp_file_path.name,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=filename,
+@router.get("/jobs/{job_id}")
+async def get_render_job(job_id: str):
+    """查询渲染任务的状态，任务未完成时响应带有建议的轮询间隔Retry-After"""
+    job = await _get_job(job_id)
+    headers = {}
+    if job.status in (JOB_QUEUED, JOB_RUNNING):
+        headers["Retry-After"] = str(job_queue.retry_after())
+    return JSONResponse(content=job.to_dict(), headers=headers)
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_render_job(job_id: str):
+    """下载已完成任务的渲染结果，任务未完成或失败时返回409"""
+    job = await _get_job(job_id)
+    if job.status in (JOB_QUEUED, JOB_RUNNING):
+        raise HTTPException(
+            status_code=409,
+            detail=f"渲染任务尚未完成，当前状态: {job.status}",
+            headers={"Retry-After": str(job_queue.retry_after())},
         )
+    if job.status != JOB_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"渲染任务失败: {job.error}")
+
+    artifact = await job_queue.open_artifact(job_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail=f"渲染任务 '{job_id}' 的结果已过期")
+    return StreamingResponse(
+        _iter_buffer(artifact),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": _content_disposition(job.filename),
+            "Content-Length": str(job.size),
+        },
+        background=BackgroundTask(artifact.close),
+    )
+
+
+def _render_upload_job(
+    chunks,
+    boundary: bytes,
+    request_id: str,
+    summary: dict,
+    stats: RenderStats,
+    admit: Callable[[str, str, dict], None],
+) -> tuple:
+    """
+    在渲染线程中执行：解析上传的请求体，项目数据边读取边校验边渲染。
+    模板类型确定后调用admit获取内存准入，获准后才开始渲染。
+    返回 (定位到开头的可读缓冲区, 下载文件名)。
+    """
+    upload = read_project_upload(chunks, boundary)
+    summary.update(
+        template_type=upload.template_type, notice_no=upload.notice["notice_no"]
+    )
+    template_path = _resolve_template(upload.template_type, request_id)
+    admit(upload.template_type, template_path, upload.notice)
 
-        logger.info(f"[{request_id}] 开始发送响应文件")
+    context = {**upload.notice, "projects": upload.projects}
+    try:
+        buffer = render_stream_to_buffer(template_path, context, stats)
+    finally:
+        summary["projects"] = upload.projects.count
+    upload.projects.finish(upload.template_type, upload.notice)
+    return buffer, _notice_filename(upload.template_type, upload.notice["notice_no"])
+
+
+@router.post("/render/upload")
+async def render_notice_upload(http_request: Request):
+    """
+    以multipart/form-data上传通知单并渲染：template_type与data（不含项目列表的
+    NoticeData JSON）两个字段在前，projects文件在后，内容为NDJSON（每行一个项目）
+    或CSV（首行为表头，可使用字段名或字段说明）。
+    项目数据边接收边校验、渲染，内存占用与项目数量无关。
+    """
+    request_id = str(uuid.uuid4())
+    start_time = time.time()
+    summary = {
+        "request_id": request_id,
+        "template_type": "unknown",
+        "upload": True,
+        "projects": 0,
+        "status": 500,
+    }
+    stats = RenderStats()
+    try:
+        response = await _render_upload(http_request, request_id, summary, stats)
+        summary["status"] = response.status_code
         return response
+    except HTTPException as e:
+        summary["status"] = e.status_code
+        raise
+    except RequestValidationError:
+        summary["status"] = 422
+        raise
+    finally:
+        duration = time.time() - start_time
+        summary["duration_ms"] = round(duration * 1000, 1)
+        log_summary(logger, **summary)
+        record_render(
+            summary["template_type"],
+            summary["projects"],
+            summary["status"],
+            duration,
+            stats=stats if stats.stages else None,
+        )
 
-    except Exception as e:
-        logger.error(f"[{request_id}] Excel渲染过程中发生错误: {str(e)}", exc_info=True)
 
-        # 清理临时文件（如果存在）
-        if tmp_file_path and os.path.exists(tmp_file_path.name):
-            try:
-                os.remove(tmp_file_path.name)
-                logger.info(f"[{request_id}] 已清理临时文件: {tmp_file_path.name}")
-            except Exception as cleanup_error:
-                logger.error(f"[{request_id}] 清理临时文件失败: {str(cleanup_error)}")
+async def _render_upload(
+    http_request: Request, request_id: str, summary: dict, stats: RenderStats
+):
+    """渲染上传的通知单，处理结果写入summary，渲染统计写入stats"""
+    content_type, options = parse_options_header(
+        http_request.headers.get("content-type", "")
+    )
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="请求体须为multipart/form-data")
+    logger.log(DETAIL, "[%s] 开始处理上传渲染请求", request_id)
+
+    loop = asyncio.get_running_loop()
+    admissions = []
 
-        # 计算失败时间
-        process_time = time.time() - start_time
-        logger.info(f"[{request_id}] 请求处理失败，耗时: {process_time:.3f}秒")
+    def admit(template_type: str, template_path: str, notice: dict) -> None:
+        """
+        在上传渲染线程中执行：等待事件循环中的内存准入。项目逐行渲染，
+        内存占用与项目数量无关，按模板与单次遍历引擎估算。
+        """
+        admission = asyncio.run_coroutine_threadsafe(
+            admit_render(
+                template_type,
+                template_path,
+                notice,
+                engine=select_stream_engine(template_path),
+            ),
+            loop,
+        ).result()
+        admissions.append(admission)
+        summary["admission"] = admission.result
 
+    def release() -> None:
+        """上传渲染线程真正结束后归还预留的内存"""
+        for admission in admissions:
+            render_admission.release(admission)
+
+    try:
+        buffer, filename = await run_stream_in_pool(
+            lambda chunks: _render_upload_job(
+                chunks, boundary, request_id, summary, stats, admit
+            ),
+            http_request.stream(),
+            on_done=release,
+        )
+    except AdmissionRejectedError as e:
+        logger.warning("[%s] %s", request_id, e)
+        summary["admission"] = "rejected"
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except UploadError as e:
+        logger.warning("[%s] 上传的请求体格式错误: %s", request_id, e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValidationError as e:
+        record_validation(summary["template_type"], 0, 0.0, ok=False)
+        raise _request_validation_error(e, ("body", "data"))
+    except ProjectRowError as e:
+        logger.warning("[%s] %s", request_id, e)
+        record_validation(summary["template_type"], 0, 0.0, ok=False)
+        raise _request_validation_error(e.error, ("body", "projects", e.line))
+    except RenderTimeoutError as e:
+        logger.error("[%s] 上传渲染超时: %s", request_id, e)
+        raise HTTPException(status_code=504, detail=f"渲染Excel超时: {str(e)}")
+    except (ClientDisconnect, RenderCancelledError) as e:
+        logger.warning("[%s] 客户端已断开，上传渲染已取消: %s", request_id, e)
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("[%s] 上传渲染过程中发生错误: %s", request_id, e, exc_info=True)
+        summary["error"] = str(e)
         raise HTTPException(status_code=500, detail=f"渲染Excel时发生错误: {str(e)}")
+
+    content_length = buffer.seek(0, os.SEEK_END)
+    buffer.seek(0)
+    summary.update(engine=stats.engine, size=content_length)
+    logger.log(
+        DETAIL,
+        "[%s] 上传渲染完成，共%d个项目，大小: %d字节",
+        request_id,
+        summary["projects"],
+        content_length,
+    )
+    return StreamingResponse(
+        _iter_buffer(buffer),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": _content_disposition(filename),
+            "Content-Length": str(content_length),
+        },
+        background=BackgroundTask(buffer.close),
+    )
+
+
+def _write_batch_entry(archive: ZipWriter, entry_name: str, content) -> None:
+    """将一项渲染结果写入批量结果的zip后关闭其缓冲区"""
+    with content, archive.open(entry_name) as entry:
+        shutil.copyfileobj(content, entry, OUTPUT_CHUNK_SIZE)
+
+
+def _finish_batch_zip(archive: ZipWriter, report: List[dict]) -> int:
+    """写入逐项结果报告与zip目录，返回zip的大小"""
+    info = zipfile.ZipInfo(BATCH_REPORT_NAME, date_time=time.localtime()[:6])
+    info.external_attr = 0o600 << 16
+    report_content = json.dumps(report, ensure_ascii=False, indent=2).encode("utf-8")
+    archive.write_raw(compress_entry(info, report_content, 6))
+    archive.close()
+    size = archive.fp.tell()
+    archive.fp.seek(0)
+    return size
+
+
+@router.post("/render/batch")
+async def render_notice_batch(
+    http_request: Request,
+    requests: List[Dict[str, Any]] = Body(
+        ..., description="RenderRequest列表，每一项与 /render 的请求体相同"
+    ),
+    compresslevel: Optional[int] = Query(
+        None,
+        ge=0,
+        le=9,
+        description="各Excel文件的压缩级别，与 /render 的同名参数相同",
+    ),
+):
+    """
+    批量渲染通知单，返回包含所有Excel文件与逐项结果报告（report.json）的zip。
+    每一项与 /render 的处理相同（校验、分表限制、压缩级别、渲染结果缓存与内存准入），
+    最多RENDER_POOL_SIZE项同时渲染。单项校验或渲染失败只记录在报告中，不影响其他通知单。
+    各项渲染完成后立即写入zip（超过OUTPUT_SPOOL_MAX_SIZE时溢出到临时文件），
+    不在内存中保留所有结果。
+    """
+    if len(requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"批量渲染最多{BATCH_MAX_ITEMS}个通知单，请求包含{len(requests)}个",
+        )
+    batch_id = str(uuid.uuid4())
+    start_time = time.time()
+    logger.log(
+        DETAIL, "[%s] 开始处理批量渲染请求，共%d个通知单", batch_id, len(requests)
+    )
+
+    compresslevel = resolve_compresslevel(compresslevel)
+    report = [{"index": index, "status": "pending"} for index in range(len(requests))]
+    # 同时渲染的项数与渲染池的工作者数量相同，其余项在此等待，不占用渲染池的排队时间
+    slots = asyncio.Semaphore(RENDER_POOL_SIZE)
+    # xlsx本身已压缩，各项直接存储不再重复压缩；同一时间只有一项写入zip
+    buffer = tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_MAX_SIZE)
+    archive = ZipWriter(buffer, 0)
+    archive_lock = asyncio.Lock()
+
+    async def render_item(index: int, raw_request: dict) -> None:
+        item_id = f"{batch_id}#{index + 1}"
+        try:
+            item = await run_in_threadpool(validate_render_request, raw_request)
+        except ValidationError as e:
+            report[index].update(status="invalid", error=str(e))
+            return
+        template_type, context = item["template_type"], item["data"]
+        report[index].update(
+            template_type=template_type, notice_no=context["notice_no"]
+        )
+        summary = {"request_id": item_id, "template_type": template_type}
+        try:
+            template_path = _resolve_template(template_type, item_id)
+            sheet_limits = get_sheet_limits(template_type)
+            cache_key = await _output_cache_key(
+                template_type, template_path, context, sheet_limits, compresslevel
+            )
+            async with slots:
+                content = await _render_output(
+                    template_path,
+                    context,
+                    item_id,
+                    summary,
+                    RenderStats(),
+                    compresslevel,
+                    sheet_limits,
+                    cache_key,
+                    is_disconnected=http_request.is_disconnected,
+                )
+        except HTTPException as e:
+            if e.status_code == 499:
+                raise
+            logger.error("[%s] 第%d个通知单渲染失败: %s", batch_id, index + 1, e.detail)
+            report[index].update(status="failed", error=e.detail)
+            return
+        except Exception as e:
+            logger.error(
+                "[%s] 第%d个通知单渲染失败: %s", batch_id, index + 1, e, exc_info=True
+            )
+            report[index].update(status="failed", error=f"渲染Excel时发生错误: {e}")
+            return
+
+        entry_name = f"{index + 1:04d}_" + _notice_filename(
+            template_type, context["notice_no"]
+        ).replace("/", "_")
+        async with archive_lock:
+            await run_in_threadpool(_write_batch_entry, archive, entry_name, content)
+        report[index].update(status="ok", filename=entry_name)
+
+    # 单项的失败在render_item中记入报告，仍抛出的只有客户端断开与写入zip失败，
+    # 此时取消其余各项
+    tasks = [
+        asyncio.ensure_future(render_item(index, raw_request))
+        for index, raw_request in enumerate(requests)
+    ]
+    try:
+        done, pending = (
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            if tasks
+            else (set(), set())
+        )
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        errors = [task.exception() for task in done if task.exception() is not None]
+        if errors:
+            if isinstance(errors[0], HTTPException):
+                logger.warning("[%s] 客户端已断开，批量渲染已取消", batch_id)
+            raise errors[0]
+        content_length = await run_in_threadpool(_finish_batch_zip, archive, report)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        buffer.close()
+        raise
+    succeeded_count = sum(1 for item in report if item["status"] == "ok")
+    failed_count = len(report) - succeeded_count
+
+    log_summary(
+        logger,
+        request_id=batch_id,
+        batch_size=len(requests),
+        succeeded=succeeded_count,
+        failed=failed_count,
+        size=content_length,
+        status=200,
+        duration_ms=round((time.time() - start_time) * 1000, 1),
+    )
+
+    return StreamingResponse(
+        _iter_buffer(buffer),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": _content_disposition(f"通知单_{batch_id}.zip"),
+            "Content-Length": str(content_length),
+            "X-Batch-Succeeded": str(succeeded_count),
+            "X-Batch-Failed": str(failed_count),
+        },
+        background=BackgroundTask(buffer.close),
+    )
@@ -0,0 +1,69 @@
+# app/api/endpoints/profiles.py
+import os
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.services.profiling import (
+    SNAPSHOT_SUFFIX,
+    STACKS_SUFFIX,
+    load_profile_summary,
+    profile_path,
+    verify_profile_token,
+)
+
+
+def require_profile_token(http_request: Request) -> None:
+    """性能分析及其结果的查询须在X-Profile-Token头中提供PROFILE_TOKEN，未配置时一律拒绝"""
+    if not verify_profile_token(http_request.headers.get("x-profile-token")):
+        raise HTTPException(
+            status_code=403, detail="性能分析需要有效的X-Profile-Token请求头"
+        )
+
+
+router = APIRouter(dependencies=[Depends(require_profile_token)])
+
+
+async def _load_summary(request_id: uuid.UUID) -> dict:
+    summary = await run_in_threadpool(load_profile_summary, str(request_id))
+    if summary is None:
+        raise HTTPException(
+            status_code=404, detail=f"性能分析结果 '{request_id}' 不存在或已过期"
+        )
+    return summary
+
+
+async def _artifact(request_id: uuid.UUID, suffix: str, media_type: str):
+    await _load_summary(request_id)
+    path = profile_path(str(request_id), suffix)
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=404, detail=f"性能分析结果 '{request_id}' 不包含该文件"
+        )
+    return FileResponse(path, media_type=media_type, filename=f"{request_id}{suffix}")
+
+
+@router.get("/{request_id}")
+async def get_profile(request_id: uuid.UUID, http_request: Request):
+    """
+    查询一次渲染请求的性能分析摘要：热点函数、内存峰值与占用最多的分配位置，
+    以及调用栈采样与内存快照的下载地址。request_id与渲染响应的X-Profile-Id相同。
+    """
+    summary = await _load_summary(request_id)
+    base = http_request.url_for("get_profile", request_id=request_id).path
+    summary["artifacts"] = {"stacks": base + "/stacks", "memory": base + "/memory"}
+    return summary
+
+
+@router.get("/{request_id}/stacks")
+async def get_profile_stacks(request_id: uuid.UUID):
+    """下载折叠格式的调用栈采样，可用flamegraph.pl或speedscope生成火焰图"""
+    return await _artifact(request_id, STACKS_SUFFIX, "text/plain; charset=utf-8")
+
+
+@router.get("/{request_id}/memory")
+async def get_profile_memory(request_id: uuid.UUID):
+    """下载渲染结束时的tracemalloc内存快照，用tracemalloc.Snapshot.load加载分析"""
+    return await _artifact(request_id, SNAPSHOT_SUFFIX, "application/octet-stream")
@@ -0,0 +1,137 @@
+# app/config.py
+import json
+import os
+import tempfile
+
+
+def _env_int(name: str, default: int) -> int:
+    """读取整数类型的环境变量，未设置时使用默认值"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """读取浮点数类型的环境变量，未设置时使用默认值"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# 模板类型到文件名的映射
+TEMPLATE_MAP = {
+    "横向": "template_横向.xlsx",
+    "纵向": "template_纵向.xlsx",
+    "协同创新专项": "template_协同创新专项.xlsx",
+    "协同创新专项精品": "template_协同创新专项精品.xlsx",
+}
+TEMPLATE_DIR = "app/templates"
+
+# 日志级别：DEBUG、INFO、WARNING、ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 日志模式：detailed（逐步骤记录）或 summary（每个请求只记录一条摘要，步骤日志降为DEBUG）
+LOG_MODE = os.getenv("LOG_MODE", "detailed")
+# 逐项目日志的采样比例，1为全部记录，0为不记录
+LOG_PROJECT_SAMPLE_RATE = _env_float("LOG_PROJECT_SAMPLE_RATE", 1.0)
+
+# 渲染结果在内存中缓冲的最大字节数，超过后溢出到临时文件
+OUTPUT_SPOOL_MAX_SIZE = _env_int("OUTPUT_SPOOL_MAX_SIZE", 8 * 1024 * 1024)
+# 流式响应每次发送的字节数
+OUTPUT_CHUNK_SIZE = _env_int("OUTPUT_CHUNK_SIZE", 64 * 1024)
+# 输出文件的压缩级别：0为不压缩（最省CPU），1-9为deflate压缩级别（越大文件越小、越耗CPU）
+OUTPUT_COMPRESSLEVEL = _env_int("OUTPUT_COMPRESSLEVEL", 6)
+
+# 渲染任务执行方式：process（进程池）或 thread（线程池）
+RENDER_EXECUTOR = os.getenv("RENDER_EXECUTOR", "process")
+# 每个服务进程中渲染池的工作者数量
+RENDER_POOL_SIZE = _env_int("RENDER_POOL_SIZE", 2)
+# 单个渲染任务的超时时间（秒）
+RENDER_TIMEOUT = _env_int("RENDER_TIMEOUT", 120)
+# 批量渲染每次请求的最大通知单数，超出时返回413
+BATCH_MAX_ITEMS = _env_int("BATCH_MAX_ITEMS", 100)
+
+# 渲染引擎：auto（自动选择）、patch（直接改写工作表XML）、openpyxl（整表加载后原位修改）或 streaming（只写流式）
+RENDER_ENGINE = os.getenv("RENDER_ENGINE", "auto")
+# auto模式下模板不支持XML改写、且项目数量达到该值时使用流式渲染引擎
+STREAMING_THRESHOLD = _env_int("STREAMING_THRESHOLD", 5000)
+
+# 每个服务进程（含其渲染池）中同时进行的渲染按估算可占用的内存总量（字节），设为0则不进行准入控制
+RENDER_MEMORY_BUDGET = _env_int("RENDER_MEMORY_BUDGET", 1024 * 1024 * 1024)
+# 估算内存超出剩余预算时的处理：queue（排队等待）、reject（返回503）或 degrade（改用内存占用更低的引擎，仍不足时排队）
+RENDER_ADMISSION_POLICY = os.getenv("RENDER_ADMISSION_POLICY", "queue")
+# 排队等待内存预算的最长时间（秒），超时返回503
+RENDER_ADMISSION_TIMEOUT = _env_float("RENDER_ADMISSION_TIMEOUT", 30.0)
+# 内存估算的校正系数，可对照 /metrics 中的实际RSS调整
+RENDER_MEMORY_ESTIMATE_FACTOR = _env_float("RENDER_MEMORY_ESTIMATE_FACTOR", 1.0)
+
+# 启动时预加载所有模板并用示例数据渲染一次，模板缺失或损坏时启动失败；设为0则跳过
+STARTUP_WARMUP = _env_int("STARTUP_WARMUP", 1)
+# 预热渲染使用的示例项目数量
+WARMUP_PROJECTS = _env_int("WARMUP_PROJECTS", 3)
+
+# 每个工作表最多容纳的项目数量，超过后拆分到多个工作表并行渲染，0为不限制
+SHEET_MAX_PROJECTS = _env_int("SHEET_MAX_PROJECTS", 0)
+# 每个工作表的最大行数，默认为Excel的上限
+SHEET_MAX_ROWS = _env_int("SHEET_MAX_ROWS", 1048576)
+# 按模板类型覆盖上述两项，JSON对象，如 {"横向": {"max_projects": 5000, "max_rows": 20000}}
+SHEET_LIMITS = json.loads(os.getenv("SHEET_LIMITS") or "{}")
+
+# 渲染结果内存缓存的最大字节数，设为0则不使用内存缓存
+OUTPUT_CACHE_MAX_SIZE = _env_int("OUTPUT_CACHE_MAX_SIZE", 64 * 1024 * 1024)
+# 单个渲染结果可缓存的最大字节数
+OUTPUT_CACHE_MAX_ITEM_SIZE = _env_int("OUTPUT_CACHE_MAX_ITEM_SIZE", 4 * 1024 * 1024)
+# 渲染结果缓存的有效期（秒），设为0则关闭缓存
+OUTPUT_CACHE_TTL = _env_int("OUTPUT_CACHE_TTL", 3600)
+# 磁盘缓存目录，为空则不使用磁盘缓存
+OUTPUT_CACHE_DIR = os.getenv("OUTPUT_CACHE_DIR", "")
+# 磁盘缓存的最大字节数
+OUTPUT_CACHE_DISK_MAX_SIZE = _env_int("OUTPUT_CACHE_DISK_MAX_SIZE", 1024 * 1024 * 1024)
+
+# 增量渲染的渲染指纹在内存中保存的最大字节数（每个进程），设为0则不使用内存层
+RERENDER_CACHE_MAX_SIZE = _env_int("RERENDER_CACHE_MAX_SIZE", 128 * 1024 * 1024)
+# 渲染指纹的有效期（秒），设为0则关闭增量渲染
+RERENDER_CACHE_TTL = _env_int("RERENDER_CACHE_TTL", 7 * 24 * 3600)
+# 渲染指纹的磁盘目录，为空则不使用磁盘层；设置后多个进程共享指纹
+RERENDER_CACHE_DIR = os.getenv("RERENDER_CACHE_DIR", "")
+# 渲染指纹磁盘层的最大字节数
+RERENDER_CACHE_DISK_MAX_SIZE = _env_int(
+    "RERENDER_CACHE_DISK_MAX_SIZE", 1024 * 1024 * 1024
+)
+# 项目数达到该值的通知才保存渲染指纹，项目较少的通知完整渲染已足够快
+RERENDER_MIN_PROJECTS = _env_int("RERENDER_MIN_PROJECTS", 500)
+
+# 渲染任务队列的最大长度，队列已满时提交任务返回429
+JOB_QUEUE_MAX_DEPTH = _env_int("JOB_QUEUE_MAX_DEPTH", 32)
+# 同时执行的渲染任务数量，默认与渲染池的工作者数量相同
+JOB_WORKERS = _env_int("JOB_WORKERS", RENDER_POOL_SIZE)
+# 已完成任务的状态与渲染结果的保留时间（秒）
+JOB_RESULT_TTL = _env_int("JOB_RESULT_TTL", 3600)
+# 任务存储目录，为空则保存在内存中；设置后状态与结果可由同一主机的其他服务进程查询与下载。
+# 为空且服务以多个工作进程运行时，改用临时目录下的JOB_SHARED_DIR
+JOB_DIR = os.getenv("JOB_DIR", "")
+JOB_SHARED_DIR = os.path.join(tempfile.gettempdir(), "excel-fund-jobs")
+# 任务保存在内存中时，已完成任务的渲染结果占用的最大字节数，超出时删除最早完成的结果
+JOB_MEMORY_MAX_SIZE = _env_int("JOB_MEMORY_MAX_SIZE", 256 * 1024 * 1024)
+# 尚无任务耗时统计时，Retry-After使用的预计任务耗时（秒）
+JOB_RETRY_AFTER = _env_int("JOB_RETRY_AFTER", 5)
+
+# 指标快照目录，同一主机上的多个服务进程通过该目录汇总指标；为空则只返回本进程的指标
+METRICS_DIR = os.getenv(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "excel-fund-metrics")
+)
+# 服务进程写入指标快照的最小间隔（秒）
+METRICS_FLUSH_INTERVAL = _env_float("METRICS_FLUSH_INTERVAL", 1.0)
+
+# 性能分析的访问令牌，请求须在X-Profile-Token头中提供；为空则不允许性能分析
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# 性能分析结果（调用栈采样、内存快照与摘要）的保存目录
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "excel-fund-profiles")
+)
+# 性能分析结果的保留时间（秒）
+PROFILE_TTL = _env_int("PROFILE_TTL", 24 * 3600)
+# 每个服务进程在PROFILE_RATE_WINDOW秒内最多接受的性能分析请求数，同一时间最多一个
+PROFILE_RATE_LIMIT = _env_int("PROFILE_RATE_LIMIT", 5)
+PROFILE_RATE_WINDOW = _env_int("PROFILE_RATE_WINDOW", 60)
+# 调用栈采样间隔（秒）
+PROFILE_INTERVAL = _env_float("PROFILE_INTERVAL", 0.005)
+# tracemalloc为每次内存分配记录的调用栈深度，越深开销越大（10层时渲染慢约20倍）
+PROFILE_TRACEMALLOC_FRAMES = _env_int("PROFILE_TRACEMALLOC_FRAMES", 1)
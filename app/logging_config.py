@@ -0,0 +1,42 @@
+# app/logging_config.py
+import json
+import logging
+
+from app.config import LOG_LEVEL, LOG_MODE, LOG_PROJECT_SAMPLE_RATE
+
+# 请求处理过程中逐步骤日志使用的级别：summary模式下降为DEBUG，只保留请求摘要
+DETAIL = logging.DEBUG if LOG_MODE == "summary" else logging.INFO
+
+
+def configure_logging() -> None:
+    """按LOG_LEVEL配置根日志记录器，服务进程与渲染池的工作进程都需要调用"""
+    logging.basicConfig(level=LOG_LEVEL)
+    logging.getLogger().setLevel(LOG_LEVEL)
+
+
+def sample_step() -> int:
+    """按LOG_PROJECT_SAMPLE_RATE等间隔抽样时的间隔，0表示不记录"""
+    if LOG_PROJECT_SAMPLE_RATE <= 0:
+        return 0
+    return max(1, round(1 / min(LOG_PROJECT_SAMPLE_RATE, 1.0)))
+
+
+def sampled_indices(count: int) -> range:
+    """按LOG_PROJECT_SAMPLE_RATE等间隔抽样，返回需要记录日志的项目下标"""
+    step = sample_step()
+    if count <= 0 or step == 0:
+        return range(0)
+    return range(0, count, step)
+
+
+def log_summary(logger: logging.Logger, **fields) -> None:
+    """
+    记录一条结构化的请求摘要：消息体为JSON，字段同时放在记录的summary属性中，
+    便于日志处理器直接取用。
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "[请求摘要] %s",
+            json.dumps(fields, ensure_ascii=False, default=str),
+            extra={"summary": fields},
+        )
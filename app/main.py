@@ -1,20 +1,80 @@
 # app/main.py
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.api.endpoints import notice
+from fastapi.responses import JSONResponse
+from app.config import STARTUP_WARMUP
+from app.logging_config import configure_logging
+from app.api.endpoints import metrics, notice, profiles
+from app.services.admission import memory_status
+from app.services.metrics import registry
+from app.services.render_jobs import job_queue
+from app.services.render_pool import (
+    executor_broken,
+    shutdown_executor,
+    warmup_templates,
+)
 import logging
 
+# 按LOG_LEVEL配置日志
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 清理已退出进程留下的指标快照
+    registry.prune()
+    # 预加载并预热所有模板，模板缺失或损坏时抛出异常，服务启动失败
+    app.state.warmup = {}
+    if STARTUP_WARMUP:
+        app.state.warmup = await warmup_templates(
+            {
+                template_type: os.path.join(notice.TEMPLATE_DIR, filename)
+                for template_type, filename in notice.TEMPLATE_MAP.items()
+            }
+        )
+    await job_queue.start()
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    # 停止渲染任务队列，尚未执行的任务标记为失败
+    await job_queue.stop()
+    registry.flush()
+    # 关闭渲染池，回收工作进程
+    shutdown_executor()
+
+
 app = FastAPI(
     title="Excel渲染API",
     description="一个用于根据模板和数据渲染Excel文件的服务。",
     version="1.0.0",
+    lifespan=lifespan,
 )
 # 定义logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 app.include_router(notice.router, prefix="/api/v1/notices", tags=["通知单"])
+app.include_router(metrics.router, tags=["监控"])
+app.include_router(profiles.router, prefix="/api/v1/profiles", tags=["性能分析"])
 
 
 @app.get("/")
 def read_root():
     return {"message": "欢迎使用Excel渲染API，请访问 /docs 查看文档。"}
+
+
+@app.get("/ready", tags=["监控"])
+def read_ready():
+    """
+    就绪检查：模板预热完成且渲染池可用时返回200，启动中、关闭中或渲染池不可用时返回503。
+    响应中的memory为本进程的渲染内存预算、估算占用与各进程的RSS。存活检查使用 /。
+    """
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "not_ready"})
+    if executor_broken():
+        return JSONResponse(status_code=503, content={"status": "render_pool_broken"})
+    return {
+        "status": "ready",
+        "templates": app.state.warmup,
+        "memory": memory_status(),
+    }
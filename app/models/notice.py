@@ -1,12 +1,77 @@
 # app/models/notice.py
+import json
 import logging
-from pydantic import BaseModel, Field, model_validator
-from typing import List, Optional
+import time
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, model_validator
+from typing import Iterable, Iterator, List, Optional, Tuple
+from typing_extensions import Required, TypedDict
+
+from app.logging_config import DETAIL, sample_step, sampled_indices
+from app.services.metrics import record_validation
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 
+def _log_project_info(project: dict):
+    """记录项目信息的日志，按采样比例调用"""
+    project_identifier = (
+        project.get("project_code") or project.get("project_name") or "未知项目"
+    )
+    logger.log(DETAIL, "[数据模型] 项目信息验证完成: %s", project_identifier)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "[数据模型] 项目详情: %s",
+            {key: value for key, value in project.items() if value is not None},
+        )
+
+
+def _check_total_money(all_money: Optional[float], total_project_money: float):
+    """验证项目总经费是否与各项目经费总和匹配"""
+    if all_money is None:
+        return
+    if abs(all_money - total_project_money) > 0.01:  # 允许0.01的浮点数误差
+        logger.warning(
+            "[数据模型] 总经费与项目经费总和不匹配: %s != %s",
+            all_money,
+            total_project_money,
+        )
+    else:
+        logger.debug("[数据模型] 总经费与项目经费总和匹配: %s", all_money)
+
+
+def _check_notice_data(notice: dict, projects: List[dict]):
+    """记录通知数据验证完成后的日志，并检查总经费与各项目经费总和是否一致"""
+    logger.log(
+        DETAIL,
+        "[数据模型] 通知数据验证完成: %s (日期: %s)",
+        notice["notice_no"],
+        notice["date"],
+    )
+    logger.log(DETAIL, "[数据模型] 包含%d个项目", len(projects))
+
+    # 逐项目日志按采样比例记录，级别未启用时不做任何格式化
+    if logger.isEnabledFor(DETAIL):
+        for index in sampled_indices(len(projects)):
+            _log_project_info(projects[index])
+
+    if projects:
+        _check_total_money(
+            notice.get("all_money"),
+            sum(project.get("money") or 0 for project in projects),
+        )
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "[数据模型] 通知详情: %s",
+            {
+                key: value
+                for key, value in notice.items()
+                if value is not None and key != "projects"
+            },
+        )
+
+
 class ProjectInfo(BaseModel):
     project_code: Optional[str] = Field(None, description="项目编码")
     project_name: Optional[str] = Field(None, description="项目名称")
@@ -22,13 +87,9 @@ class ProjectInfo(BaseModel):
     bank_num: Optional[str] = Field(None, description="银行帐号")
     number: Optional[str] = Field(None, description="身份证号")
 
-    @model_validator(mode="after")
     def log_project_info(self):
-        """记录项目信息验证完成后的日志"""
-        project_identifier = self.project_code or self.project_name or "未知项目"
-        logger.info(f"[数据模型] 项目信息验证完成: {project_identifier}")
-        logger.debug(f"[数据模型] 项目详情: {self.model_dump(exclude_none=True)}")
-        return self
+        """记录项目信息的日志"""
+        _log_project_info(vars(self))
 
 
 class NoticeData(BaseModel):
@@ -48,24 +109,7 @@ class NoticeData(BaseModel):
     @model_validator(mode="after")
     def log_notice_data(self):
         """记录通知数据验证完成后的日志"""
-        logger.info(
-            f"[数据模型] 通知数据验证完成: {self.notice_no} (日期: {self.date})"
-        )
-        logger.info(f"[数据模型] 包含{len(self.projects)}个项目")
-
-        # 验证项目总经费是否与各项目经费总和匹配
-        if self.all_money is not None and self.projects:
-            total_project_money = sum(project.money or 0 for project in self.projects)
-            if abs(self.all_money - total_project_money) > 0.01:  # 允许0.01的浮点数误差
-                logger.warning(
-                    f"[数据模型] 总经费与项目经费总和不匹配: {self.all_money} != {total_project_money}"
-                )
-            else:
-                logger.debug(f"[数据模型] 总经费与项目经费总和匹配: {self.all_money}")
-
-        logger.debug(
-            f"[数据模型] 通知详情: {self.model_dump(exclude_none=True, exclude={'projects'})}"
-        )
+        _check_notice_data(vars(self), [vars(project) for project in self.projects])
         return self
 
 
@@ -76,8 +120,213 @@ class RenderRequest(BaseModel):
     @model_validator(mode="after")
     def log_render_request(self):
         """记录渲染请求验证完成后的日志"""
-        logger.info(
-            f"[数据模型] 渲染请求验证完成: 模板类型='{self.template_type}', 通知编号='{self.data.notice_no}'"
+        logger.log(
+            DETAIL,
+            "[数据模型] 渲染请求验证完成: 模板类型='%s', 通知编号='%s'",
+            self.template_type,
+            self.data.notice_no,
         )
-        logger.debug(f"[数据模型] 渲染请求详情: {self.model_dump(exclude_none=True)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "[数据模型] 渲染请求详情: %s", self.model_dump(exclude_none=True)
+            )
         return self
+
+
+# 以下TypedDict与上面的模型字段、类型一一对应，供接口快速解码使用：
+# 校验直接产出字典，不创建模型实例，也省去随后的model_dump()
+
+
+class ProjectInfoDict(TypedDict, total=False):
+    project_code: Optional[str]
+    project_name: Optional[str]
+    leader: Optional[str]
+    department: Optional[str]
+    source: Optional[str]
+    close_time: Optional[str]
+    money: Optional[float]
+    system_money: Optional[float]
+    public_consumption: Optional[float]
+    bank_name: Optional[str]
+    open_bank: Optional[str]
+    bank_num: Optional[str]
+    number: Optional[str]
+
+
+class NoticeDataDict(TypedDict, total=False):
+    notice_no: Required[str]
+    date: Required[str]
+    all_money: Optional[float]
+    signing_officer: Optional[str]
+    deputy1_dean: Optional[str]
+    top_leader: Optional[str]
+    finance_officer: Optional[str]
+    deputy2_dean: Optional[str]
+    research_handler: Optional[str]
+    finance_handler: Optional[str]
+    projects: List[ProjectInfoDict]
+
+
+class RenderRequestDict(TypedDict):
+    template_type: str
+    data: NoticeDataDict
+
+
+_render_request_adapter = TypeAdapter(RenderRequestDict)
+_notice_adapter = TypeAdapter(NoticeDataDict)
+_project_adapter = TypeAdapter(ProjectInfoDict)
+# 请求中未提供的字段补为None，使结果的字段与顺序与model_dump()一致
+_PROJECT_DEFAULTS = dict.fromkeys(ProjectInfo.model_fields)
+_NOTICE_DEFAULTS = {**dict.fromkeys(NoticeData.model_fields), "projects": []}
+
+
+def _raw_template_type(raw) -> str:
+    """校验失败时尽量从原始输入中取出模板类型，用于指标标签"""
+    if isinstance(raw, (bytes, str)):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            raw = None
+    template_type = raw.get("template_type") if isinstance(raw, dict) else None
+    return str(template_type or "unknown")
+
+
+def _validate_render_request(validate, raw) -> dict:
+    start = time.perf_counter()
+    try:
+        request = validate(raw)
+    except ValidationError:
+        record_validation(_raw_template_type(raw), 0, 0.0, ok=False)
+        raise
+
+    data = request["data"]
+    projects = [
+        {**_PROJECT_DEFAULTS, **project} for project in data.get("projects", ())
+    ]
+    data = {**_NOTICE_DEFAULTS, **data, "projects": projects}
+    request["data"] = data
+    _check_notice_data(data, projects)
+
+    record_validation(
+        request["template_type"],
+        len(projects),
+        time.perf_counter() - start,
+        ok=True,
+    )
+    logger.log(
+        DETAIL,
+        "[数据模型] 渲染请求验证完成: 模板类型='%s', 通知编号='%s'",
+        request["template_type"],
+        data["notice_no"],
+    )
+    return request
+
+
+def decode_render_request(body: bytes) -> dict:
+    """
+    将 /render 的JSON请求体直接校验为字典，校验规则与RenderRequest相同。
+    返回 {"template_type": ..., "data": ...}，其中data等同于RenderRequest.data.model_dump()。
+    校验失败时抛出ValidationError。
+    """
+    return _validate_render_request(_render_request_adapter.validate_json, body)
+
+
+def validate_render_request(obj) -> dict:
+    """与decode_render_request相同，输入为已解析的JSON对象"""
+    return _validate_render_request(_render_request_adapter.validate_python, obj)
+
+
+def decode_notice_header(body: bytes) -> dict:
+    """
+    校验上传接口中的通知数据（NoticeData的JSON，项目列表单独上传），
+    返回补全了缺省字段的字典，校验失败时抛出ValidationError。
+    """
+    return {**_NOTICE_DEFAULTS, **_notice_adapter.validate_json(body)}
+
+
+def sample_notice_data(project_count: int) -> dict:
+    """
+    生成所有字段均有值的示例通知数据（与decode_render_request返回的data结构相同），
+    用于启动时的预热渲染。
+    """
+
+    def sample(model, index: int) -> dict:
+        return {
+            name: index + 1.0
+            if field.annotation == Optional[float]
+            else f"{name}-{index}"
+            for name, field in model.model_fields.items()
+            if name != "projects"
+        }
+
+    return {
+        **sample(NoticeData, 0),
+        "projects": [sample(ProjectInfo, index) for index in range(project_count)],
+    }
+
+
+# CSV表头可以是字段名，也可以是字段说明（如“项目编码”）
+PROJECT_COLUMNS = {
+    **{field.description: name for name, field in ProjectInfo.model_fields.items()},
+    **{name: name for name in ProjectInfo.model_fields},
+}
+
+
+def decode_project_line(line: bytes) -> dict:
+    """校验NDJSON中的一行项目数据"""
+    return {**_PROJECT_DEFAULTS, **_project_adapter.validate_json(line)}
+
+
+def validate_project_row(row: dict) -> dict:
+    """校验CSV中的一行项目数据，值均为字符串，按ProjectInfo的类型转换"""
+    return {**_PROJECT_DEFAULTS, **_project_adapter.validate_python(row)}
+
+
+class ProjectRowError(Exception):
+    """上传的项目数据中某一行校验失败"""
+
+    def __init__(self, line: int, error: ValidationError):
+        super().__init__(f"第{line}行项目数据校验失败: {error}")
+        self.line = line
+        self.error = error
+
+
+class ProjectRowStream:
+    """
+    逐行校验上传的项目数据，供渲染引擎作为项目列表迭代，只能迭代一次。
+    迭代过程中累计项目数量与经费总和，结束后由finish()完成总经费检查并记录校验指标。
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, object]], validate):
+        self._rows = rows
+        self._validate = validate
+        self.count = 0
+        self.total_money = 0.0
+        self.validation_seconds = 0.0
+
+    def __iter__(self) -> Iterator[dict]:
+        step = sample_step() if logger.isEnabledFor(DETAIL) else 0
+        for line, raw in self._rows:
+            start = time.perf_counter()
+            try:
+                project = self._validate(raw)
+            except ValidationError as e:
+                raise ProjectRowError(line, e) from None
+            self.validation_seconds += time.perf_counter() - start
+
+            if step and self.count % step == 0:
+                _log_project_info(project)
+            self.count += 1
+            self.total_money += project["money"] or 0
+            yield project
+
+    def finish(self, template_type: str, notice: dict) -> None:
+        logger.log(
+            DETAIL,
+            "[数据模型] 上传的项目数据校验完成: %s，共%d个项目",
+            notice["notice_no"],
+            self.count,
+        )
+        if self.count:
+            _check_total_money(notice["all_money"], self.total_money)
+        record_validation(template_type, self.count, self.validation_seconds, ok=True)
@@ -0,0 +1,314 @@
+# app/services/admission.py
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from app.config import (
+    JOB_RETRY_AFTER,
+    RENDER_ADMISSION_POLICY,
+    RENDER_ADMISSION_TIMEOUT,
+    RENDER_EXECUTOR,
+    RENDER_MEMORY_BUDGET,
+    RENDER_MEMORY_ESTIMATE_FACTOR,
+)
+from app.services.excel_renderer import resolve_loop_list
+from app.services.metrics import record_admission, record_memory
+from app.services.render_pool import render_engine_candidates, render_worker_pids
+from app.services.template_cache import get_compiled_template
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 各渲染引擎每个循环块单元格的内存占用（字节），按示例模板渲染1000-20000个项目时实测的峰值内存增量估算
+ENGINE_CELL_BYTES = {"openpyxl": 700, "patch": 100, "streaming": 13}
+# 进程渲染池中上下文序列化、传给渲染进程还原以及结果传回的开销（每个单元格，字节）
+TRANSFER_CELL_BYTES = 80
+# 每次渲染与模板大小相关的固定开销：模板工作簿快照大小的倍数
+TEMPLATE_SIZE_FACTOR = 16
+# 估算渲染耗时的指数移动平均系数，用于估算Retry-After
+_DURATION_SMOOTHING = 0.2
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class AdmissionRejectedError(Exception):
+    """渲染请求的估算内存超出预算，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Admission:
+    """一次获准的渲染：使用的引擎、预留的估算内存与准入结果"""
+
+    # 未进行准入控制时为None，由渲染池自行选择
+    engine: Optional[str]
+    cost: int
+    # admitted（直接执行）、degraded（改用内存占用更低的引擎）或 queued（排队后执行）
+    result: str
+    admitted_at: float = 0.0
+
+
+def _loop_rows(block: dict, context: dict, items) -> int:
+    """
+    循环块展开后的行数。嵌套循环的列表是外层项目的属性（如 item.children）时
+    按各项目分别计算，否则按上下文中的列表计算一次。
+    """
+    rows = (block["end_row"] - block["start_row"] + 1) * len(items)
+    for child in block["children"]:
+        child_rows = child["end_row"] - child["start_row"] + 1
+        if child["list_name"].partition(".")[0] == block["loop_var"]:
+            for item in items:
+                child_items = resolve_loop_list(
+                    child["list_name"], {block["loop_var"]: item}
+                )
+                rows += _loop_rows(child, context, child_items or ()) - child_rows
+        else:
+            child_items = resolve_loop_list(child["list_name"], context) or ()
+            rows += (_loop_rows(child, context, child_items) - child_rows) * len(items)
+    return rows
+
+
+def estimate_render_memory(template_path: str, context: dict, engine: str) -> int:
+    """
+    估算一次渲染的峰值内存（字节）：与模板大小成比例的固定开销，
+    加上循环块展开后的单元格数（项目数 × 循环块行数 × 列数）乘以所用引擎的单元格开销。
+    """
+    compiled = get_compiled_template(template_path)
+    cells = 0
+    for block in compiled.loop_blocks:
+        items = context.get(block["list_name"]) or ()
+        width = block["last_col"] - block["first_col"] + 1
+        cells += _loop_rows(block, context, items) * width
+
+    cell_bytes = ENGINE_CELL_BYTES[engine]
+    if RENDER_EXECUTOR != "thread":
+        cell_bytes += TRANSFER_CELL_BYTES
+    cost = len(compiled.snapshot) * TEMPLATE_SIZE_FACTOR + cells * cell_bytes
+    return int(cost * RENDER_MEMORY_ESTIMATE_FACTOR)
+
+
+def estimate_candidates(
+    template_path: str,
+    context: dict,
+    sheet_limits: Optional[Tuple[int, int]] = None,
+) -> List[Tuple[str, int]]:
+    """本次渲染可用的引擎及各自的估算内存，第一项为默认引擎，其余内存占用依次更低"""
+    return [
+        (engine, estimate_render_memory(template_path, context, engine))
+        for engine in render_engine_candidates(template_path, context, sheet_limits)
+    ]
+
+
+def read_rss(pid: Optional[int] = None) -> Optional[int]:
+    """读取进程当前的常驻内存（字节），不在Linux上运行或进程已退出时返回None"""
+    path = f"/proc/{pid or 'self'}/statm"
+    try:
+        with open(path) as f:
+            fields = f.read().split()
+    except OSError:
+        return None
+    return int(fields[1]) * _PAGE_SIZE
+
+
+class MemoryAdmission:
+    """
+    渲染的内存准入控制：每个服务进程持有一份内存预算，渲染开始前预留其估算内存，
+    结束后归还。剩余预算不足时按策略排队等待、拒绝，或改用内存占用更低的引擎。
+    排队按到达顺序放行，估算超过整个预算的请求等到没有其他渲染时单独执行。
+    """
+
+    def __init__(self, budget: int, policy: str, timeout: float):
+        self.budget = budget
+        self.policy = policy
+        self.timeout = timeout
+        self.reserved = 0
+        self._running = 0
+        self._waiters: deque = deque()
+        self._average_seconds = float(JOB_RETRY_AFTER)
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """按排队请求数量与平均渲染耗时估算的重试等待秒数"""
+        return max(1, math.ceil(self._average_seconds * (1 + self.waiting)))
+
+    def _fits(self, cost: int) -> bool:
+        return self._running == 0 or self.reserved + cost <= self.budget
+
+    def _reserve(self, cost: int) -> None:
+        self.reserved += cost
+        self._running += 1
+
+    def _wake(self) -> None:
+        """按到达顺序放行剩余预算足以容纳的排队请求"""
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if not self._fits(cost):
+                break
+            self._waiters.popleft()
+            self._reserve(cost)
+            future.set_result(None)
+
+    async def _wait(self, cost: int, timeout: Optional[float]) -> None:
+        future = asyncio.get_running_loop().create_future()
+        waiter = (cost, future)
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException:
+            if future.done():
+                # 超时或取消的同时已获准，归还预留的内存
+                self._unreserve(cost)
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+                self._wake()
+            raise
+
+    async def admit(
+        self, candidates: List[Tuple[str, int]], wait: bool = False
+    ) -> Admission:
+        """
+        为渲染预留内存。candidates为 (引擎, 估算内存)，第一项为默认引擎。
+        wait为True时总是排队等待、不设超时（用于异步渲染任务）。
+        按策略拒绝或等待超时时抛出AdmissionRejectedError。
+        """
+        engine, cost = candidates[0]
+        if not self._waiters and self._fits(cost):
+            self._reserve(cost)
+            return Admission(engine, cost, "admitted", time.monotonic())
+
+        if self.policy == "degrade":
+            if not self._waiters:
+                for engine, cost in candidates[1:]:
+                    if self._fits(cost):
+                        self._reserve(cost)
+                        return Admission(engine, cost, "degraded", time.monotonic())
+            # 仍然不足时排队，预算释放后多半能以默认引擎执行；
+            # 默认引擎的估算超过整个预算时改用预算能容纳的引擎排队
+            engine, cost = next(
+                (
+                    (candidate, candidate_cost)
+                    for candidate, candidate_cost in candidates
+                    if candidate_cost <= self.budget
+                ),
+                candidates[-1],
+            )
+        elif self.policy == "reject" and not wait:
+            raise AdmissionRejectedError(
+                f"渲染内存预算不足（估算{cost}字节，已占用{self.reserved}字节，"
+                f"预算{self.budget}字节），请稍后重试",
+                self.retry_after(),
+            )
+
+        try:
+            await self._wait(cost, None if wait else self.timeout)
+        except asyncio.TimeoutError:
+            raise AdmissionRejectedError(
+                f"等待渲染内存预算超过{self.timeout}秒（估算{cost}字节），请稍后重试",
+                self.retry_after(),
+            ) from None
+        return Admission(engine, cost, "queued", time.monotonic())
+
+    def _unreserve(self, cost: int) -> None:
+        self.reserved -= cost
+        self._running -= 1
+        self._wake()
+
+    def release(self, admission: Admission) -> None:
+        """渲染结束后归还预留的内存，并更新平均渲染耗时"""
+        if not self.enabled:
+            return
+        self._average_seconds += _DURATION_SMOOTHING * (
+            time.monotonic() - admission.admitted_at - self._average_seconds
+        )
+        self._unreserve(admission.cost)
+        record_memory(memory_status())
+
+    def status(self) -> dict:
+        return {
+            "budget": self.budget,
+            "policy": self.policy,
+            "reserved": self.reserved,
+            "running": self._running,
+            "waiting": self.waiting,
+        }
+
+
+# 进程内共享的渲染内存准入控制
+render_admission = MemoryAdmission(
+    RENDER_MEMORY_BUDGET, RENDER_ADMISSION_POLICY, RENDER_ADMISSION_TIMEOUT
+)
+
+
+def memory_status() -> dict:
+    """内存准入的状态以及本服务进程与其渲染进程的RSS，用于调整预算与估算系数"""
+    processes = [{"pid": os.getpid(), "role": "service", "rss": read_rss()}]
+    processes.extend(
+        {"pid": pid, "role": "render", "rss": read_rss(pid)}
+        for pid in render_worker_pids()
+    )
+    return {
+        **render_admission.status(),
+        "rss": sum(process["rss"] or 0 for process in processes),
+        "processes": processes,
+    }
+
+
+async def admit_render(
+    template_type: str,
+    template_path: str,
+    context: dict,
+    sheet_limits: Optional[Tuple[int, int]] = None,
+    wait: bool = False,
+    engine: Optional[str] = None,
+) -> Admission:
+    """
+    估算渲染所需的内存并获取准入，返回使用的引擎与预留的内存，渲染池中的任务结束后须调用
+    render_admission.release。内存预算不足且按策略拒绝或等待超时时抛出AdmissionRejectedError。
+    engine指定渲染只能使用的引擎（如上传渲染的单次遍历引擎），此时只按该引擎估算、不改用其他引擎。
+    """
+    if not render_admission.enabled:
+        return Admission(None, 0, "admitted")
+    if engine is not None:
+        cost = await asyncio.to_thread(
+            estimate_render_memory, template_path, context, engine
+        )
+        candidates = [(engine, cost)]
+    else:
+        candidates = await asyncio.to_thread(
+            estimate_candidates, template_path, context, sheet_limits
+        )
+    try:
+        admission = await render_admission.admit(candidates, wait)
+    except AdmissionRejectedError:
+        record_admission(template_type, "rejected", candidates[0][0])
+        record_memory(memory_status())
+        raise
+    record_admission(template_type, admission.result, admission.engine)
+    if admission.result != "admitted":
+        logger.info(
+            "[内存准入] 渲染内存预算不足，%s: %s，引擎: %s，估算: %d字节",
+            "改用内存占用更低的引擎"
+            if admission.result == "degraded"
+            else "排队后执行",
+            template_type,
+            admission.engine,
+            admission.cost,
+        )
+    record_memory(memory_status())
+    return admission
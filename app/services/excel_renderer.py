@@ -1,262 +1,527 @@
 # app/services/excel_renderer.py
 import os
-import re
 import logging
+import tempfile
+import threading
 import time
+from copy import copy
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 import openpyxl
-from jinja2 import Environment, BaseLoader, TemplateSyntaxError
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.worksheet.dimensions import RowDimension
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.merge import MergedCellRange
+
+from app.logging_config import DETAIL
+from app.services.metrics import RenderStats, add_stage_time
+from app.services.render_deadline import check_deadline
+from app.services.template_cache import get_compiled_template, strip_loop_tags
+from app.services.zip_writer import save_workbook
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 正则表达式，用于匹配Jinja2的for循环的开始和结束
-FOR_START_PATTERN = re.compile(r"{%\s*for\s+(\w+)\s+in\s+(\w+)\s*%}")
-FOR_END_PATTERN = re.compile(r"{%\s*endfor\s*%}")
+
+def resolve_loop_list(list_name: str, scope: dict):
+    """
+    循环的列表：scope中的名称，可以带属性路径，如 item.children 取外层循环变量item
+    当前项目的children。名称按第一个"."拆分，先在scope中查找，再逐级取属性；找不到时返回None。
+    """
+    name, _, path = list_name.partition(".")
+    value = scope.get(name)
+    for attr in path.split(".") if path else ():
+        if value is None:
+            return None
+        value = (
+            value.get(attr) if isinstance(value, dict) else getattr(value, attr, None)
+        )
+    return value
 
 
-def _copy_style(source_cell, target_cell):
+def expand_item_rows(block: dict, item, scope: dict):
     """
-    使用 openpyxl 内部机制，稳健地复制单元格样式。
-    这是解决 'StyleArray' 问题的关键。
+    展开循环块中的一个数据项，依次产出 (模板行号, 渲染上下文)。
+    嵌套的循环块按内层列表逐项展开，内层列表可以是当前项目的属性（如 item.children），
+    也可以是外层循环变量或上下文中的列表。
     """
-    if source_cell.has_style:
-        # 将源单元格的样式对象赋值给目标单元格
-        # openpyxl 会自动处理样式的深拷贝
-        target_cell._style = source_cell._style
+    item_scope = {block["loop_var"]: item}
+    row = block["start_row"]
+    for child in block["children"]:
+        while row < child["start_row"]:
+            yield row, item_scope
+            row += 1
+        outer_scope = {**scope, **item_scope}
+        child_list = resolve_loop_list(child["list_name"], outer_scope)
+        for child_item in child_list or []:
+            for child_row, child_scope in expand_item_rows(
+                child, child_item, outer_scope
+            ):
+                yield child_row, {**item_scope, **child_scope}
+        row = child["end_row"] + 1
+    while row <= block["end_row"]:
+        yield row, item_scope
+        row += 1
 
 
-def render_excel_template(template_path: str, context: dict) -> openpyxl.Workbook:
+def render_loop_value(compiled, original_value, scope: dict) -> tuple:
     """
-    渲染一个包含Jinja2语法的Excel模板，支持多行循环并保留样式。
+    渲染循环块中一个单元格的值，返回 (渲染结果, 是否渲染了变量)。
+    循环标记被去除；模板语法错误时保留原值。
     """
-    start_time = time.time()
-    logger.info(f"[Excel渲染器] 开始渲染模板: {template_path}")
-    logger.info(f"[Excel渲染器] 模板路径: {os.path.abspath(template_path)}")
-    logger.info(f"[Excel渲染器] 渲染上下文包含字段: {list(context.keys())}")
-
-    # 记录重要字段的摘要信息
-    if "notice_no" in context:
-        logger.info(f"[Excel渲染器] 通知编号: {context['notice_no']}")
-    if "date" in context:
-        logger.info(f"[Excel渲染器] 通知日期: {context['date']}")
-    if "projects" in context:
-        logger.info(f"[Excel渲染器] 项目数量: {len(context['projects'])}")
-        for i, proj in enumerate(context["projects"][:2]):  # 只记录前2个项目
-            logger.info(
-                f"[Excel渲染器] 项目{i + 1}: {proj.get('project_code', 'N/A')} - {proj.get('project_name', 'N/A')}"
-            )
-        if len(context["projects"]) > 2:
-            logger.info(f"[Excel渲染器] ... 还有{len(context['projects']) - 2}个项目")
+    if isinstance(original_value, str) and "{{" in original_value:
+        clean_value = strip_loop_tags(original_value)
+        if not clean_value:
+            return None, False
 
-    try:
-        wb = openpyxl.load_workbook(template_path)
-        logger.info(f"[Excel渲染器] 模板文件加载成功，工作表名称: {wb.sheetnames}")
-        ws = wb.active
-        logger.info(f"[Excel渲染器] 激活工作表: {ws.title}")
-        logger.info(f"[Excel渲染器] 工作表尺寸: {ws.max_row}行 x {ws.max_column}列")
+        template = compiled.get_template(clean_value)
+        if template is None:
+            logger.warning("[Excel渲染器] 循环块模板语法错误: %s", original_value)
+            return original_value, False
+        return template.render(scope), True
 
-    except Exception as e:
-        logger.error(f"[Excel渲染器] 加载模板文件失败: {str(e)}")
-        raise
+    if isinstance(original_value, str) and (
+        "{% for" in original_value or "{% endfor %}" in original_value
+    ):
+        return None, False
+    return original_value, False
+
+
+def render_scalar_value(compiled, value, context: dict) -> tuple:
+    """
+    渲染循环块之外的普通变量单元格，返回 (渲染结果, 是否渲染了变量)。
+    """
+    if not (isinstance(value, str) and "{{" in value and "{%" not in value):
+        return value, False
 
-    env = Environment(loader=BaseLoader())
-    logger.info("[Excel渲染器] Jinja2环境初始化完成")
+    template = compiled.get_template(value)
+    if template is None:
+        logger.warning("[Excel渲染器] 普通变量模板语法错误: %s", value)
+        return value, False
 
-    # --- 第一步：扫描并定位所有循环块 ---
-    loop_blocks = []
-    max_row = ws.max_row
-    max_col = ws.max_column
+    rendered_value = template.render(context)
+    logger.debug("[Excel渲染器] 渲染变量: %s -> %s", value, rendered_value)
+    return rendered_value, True
 
-    logger.info(f"[Excel渲染器] 开始扫描循环块，扫描范围: {max_row}行 x {max_col}列")
 
-    for row_idx in range(max_row, 0, -1):
-        for col_idx in range(max_col, 0, -1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            if not cell.value or not isinstance(cell.value, str):
+def render_cell_value(
+    compiled, row: int, column: int, value, scope: dict, render_value
+) -> tuple:
+    """
+    渲染模板中(row, column)处的单元格，返回 (渲染结果, 是否渲染了变量)。
+    整个单元格为简单变量时直接取值，结果为数字、日期等原生类型；其余交给render_value。
+    """
+    binding = compiled.bindings.get((row, column))
+    if binding is not None:
+        return binding.value(scope), True
+    return render_value(compiled, value, scope)
+
+
+@dataclass(frozen=True)
+class LoopCellPlan:
+    """
+    循环块模板行中的一个单元格：列号、样式编号，以及写入的静态值或渲染函数
+    （直接取值器或已编译的Jinja模板，以作用域字典为参数）。
+    """
+
+    column: int
+    style: Optional[StyleArray]
+    merged: bool
+    value: Any = None
+    render: Optional[Callable[[dict], Any]] = None
+
+
+@dataclass(frozen=True)
+class LoopRowPlan:
+    """循环块中的一个模板行：各单元格、行高，以及以该行为起点的合并区域 (起始列, 结束列, 跨越行数)"""
+
+    cells: Tuple[LoopCellPlan, ...]
+    height: Optional[RowDimension]
+    merges: Tuple[Tuple[int, int, int], ...]
+
+
+def _plan_cell(compiled, row: int, column: int, value) -> LoopCellPlan:
+    """确定循环块中一个单元格的写入方式，规则与render_loop_value一致"""
+    binding = compiled.bindings.get((row, column))
+    if binding is not None:
+        return LoopCellPlan(column, None, False, render=binding.value)
+
+    if isinstance(value, str) and "{{" in value:
+        clean_value = strip_loop_tags(value)
+        if not clean_value:
+            return LoopCellPlan(column, None, False)
+        template = compiled.get_template(clean_value)
+        if template is None:
+            logger.warning("[Excel渲染器] 循环块模板语法错误: %s", value)
+            return LoopCellPlan(column, None, False, value=value)
+        return LoopCellPlan(column, None, False, render=template.render)
+
+    if isinstance(value, str) and ("{% for" in value or "{% endfor %}" in value):
+        return LoopCellPlan(column, None, False)
+    return LoopCellPlan(column, None, False, value=value)
+
+
+def build_block_plan(compiled, ws, block: dict) -> Dict[int, LoopRowPlan]:
+    """
+    从未修改的模板工作表中提取循环块的写入方案，按模板行号索引。
+    方案只保存样式编号、静态值、渲染函数与合并区域的相对位置，不引用工作表中的单元格。
+    """
+    start_row, end_row = block["start_row"], block["end_row"]
+    first_col, last_col = block["first_col"], block["last_col"]
+
+    merges: Dict[int, list] = {}
+    for mcr in ws.merged_cells.ranges:
+        if mcr.min_row >= start_row and mcr.max_row <= end_row:
+            merges.setdefault(mcr.min_row, []).append(
+                (mcr.min_col, mcr.max_col, mcr.max_row - mcr.min_row)
+            )
+
+    rows = {}
+    for r_idx in range(start_row, end_row + 1):
+        cells = []
+        for c_idx in range(first_col, last_col + 1):
+            cell = ws._cells.get((r_idx, c_idx))
+            if cell is None:
+                cells.append(LoopCellPlan(c_idx, None, False))
                 continue
+            style = StyleArray(cell._style) if cell.has_style else None
+            if isinstance(cell, MergedCell):
+                cells.append(LoopCellPlan(c_idx, style, True))
+                continue
+            plan = _plan_cell(compiled, r_idx, c_idx, cell.value)
+            cells.append(
+                LoopCellPlan(c_idx, style, False, value=plan.value, render=plan.render)
+            )
+        height = None
+        if r_idx in ws.row_dimensions:
+            # 只保留行高属性，不引用提取方案用的工作表
+            height = copy(ws.row_dimensions[r_idx])
+            height.parent = None
+        rows[r_idx] = LoopRowPlan(tuple(cells), height, tuple(merges.get(r_idx, ())))
+    return rows
+
+
+_block_plans: Dict[str, tuple] = {}
+_block_plans_lock = threading.Lock()
+
+
+def get_block_plans(compiled) -> List[Dict[int, LoopRowPlan]]:
+    """获取各顶层循环块的写入方案，按模板版本缓存"""
+    with _block_plans_lock:
+        cached = _block_plans.get(compiled.path)
+        if cached is not None and cached[0] == compiled.version:
+            return cached[1]
+
+        ws = compiled.load_workbook().active
+        plans = [
+            build_block_plan(compiled, ws, block) for block in compiled.loop_blocks
+        ]
+        _block_plans[compiled.path] = (compiled.version, plans)
+        return plans
+
 
-            if FOR_END_PATTERN.search(cell.value):
-                end_row, end_col = row_idx, col_idx
-                start_row, start_col = None, None
-                loop_var, list_name = None, None
-
-                for r_idx in range(end_row, 0, -1):
-                    for c_idx in range(max_col, 0, -1):
-                        if r_idx == end_row and c_idx >= end_col:
-                            continue
-
-                        start_cell = ws.cell(row=r_idx, column=c_idx)
-                        if not start_cell.value or not isinstance(
-                            start_cell.value, str
-                        ):
-                            continue
-
-                        match = FOR_START_PATTERN.search(start_cell.value)
-                        if match:
-                            start_row, start_col = r_idx, c_idx
-                            loop_var, list_name = match.groups()
-                            break
-                    if start_row:
-                        break
-
-                if start_row:
-                    loop_blocks.append(
-                        {
-                            "start_row": start_row,
-                            "end_row": end_row,
-                            "start_col": start_col,
-                            "end_col": end_col,
-                            "loop_var": loop_var,
-                            "list_name": list_name,
-                        }
-                    )
-                    logger.info(
-                        f"[Excel渲染器] 发现循环块 {len(loop_blocks)}: {list_name}.{loop_var} (行{start_row}-{end_row}, 列{start_col}-{end_col})"
-                    )
-
-    logger.info(f"[Excel渲染器] 扫描完成，共发现 {len(loop_blocks)} 个循环块")
+def _clear_block(ws, block: dict) -> None:
+    """清空循环块所在的行：单元格、行高以及块内的合并区域，生成的行将原位写入"""
+    start_row, end_row = block["start_row"], block["end_row"]
+    for r_idx in range(start_row, end_row + 1):
+        for c_idx in range(1, ws.max_column + 1):
+            ws._cells.pop((r_idx, c_idx), None)
+        if r_idx in ws.row_dimensions:
+            del ws.row_dimensions[r_idx]
+
+    for mcr in list(ws.merged_cells.ranges):
+        if mcr.min_row >= start_row and mcr.max_row <= end_row:
+            ws.merged_cells.ranges.discard(mcr)
+
+
+def _add_merged_range(ws, min_col: int, min_row: int, max_col: int, max_row: int):
+    """
+    登记生成行中的合并区域。
+    方案中左上角单元格的样式已包含合并区域的边框，不再经由MergedCellRange的构造逐个合并边框。
+    """
+    merged_range = MergedCellRange.__new__(MergedCellRange)
+    CellRange.__init__(
+        merged_range, min_col=min_col, min_row=min_row, max_col=max_col, max_row=max_row
+    )
+    merged_range.ws = ws
+    merged_range.start_cell = ws._cells.get((min_row, min_col))
+    ws.merged_cells.ranges.add(merged_range)
+
+
+def _write_plan_row(ws, row_idx: int, row_plan: LoopRowPlan, scope: dict) -> int:
+    """按方案写出一个生成的行，返回渲染的变量数"""
+    cells = ws._cells
+    rendered = 0
+    for cell_plan in row_plan.cells:
+        column = cell_plan.column
+        if cell_plan.merged:
+            cell = MergedCell(ws, row=row_idx, column=column)
+            if cell_plan.style is not None:
+                cell._style = StyleArray(cell_plan.style)
+        elif cell_plan.render is not None:
+            cell = Cell(ws, row_idx, column, cell_plan.render(scope), cell_plan.style)
+            rendered += 1
+        else:
+            cell = Cell(ws, row_idx, column, cell_plan.value, cell_plan.style)
+        cells[row_idx, column] = cell
+
+    if row_plan.height is not None:
+        row_dim = copy(row_plan.height)
+        row_dim.parent = ws
+        row_dim.index = row_idx
+        ws.row_dimensions[row_idx] = row_dim
+
+    for min_col, max_col, row_span in row_plan.merges:
+        _add_merged_range(ws, min_col, row_idx, max_col, row_idx + row_span)
+    return rendered
+
+
+def _shift_print_ranges(ws, after_row: int, delta: int):
+    """平移打印区域、打印标题行与分页符中位于after_row之后的行"""
+    if ws._print_area.ranges:
+        shifted = []
+        for cell_range in ws._print_area.ranges:
+            cell_range = CellRange(cell_range.coord)
+            if cell_range.min_row > after_row:
+                cell_range.shift(row_shift=delta)
+            elif cell_range.max_row >= after_row:
+                cell_range.expand(down=delta)
+            shifted.append(cell_range.coord)
+        ws.print_area = shifted
+
+    if ws._print_rows:
+        rows = ws._print_rows
+        if rows.min_row > after_row:
+            ws.print_title_rows = f"{rows.min_row + delta}:{rows.max_row + delta}"
+        elif rows.max_row >= after_row:
+            ws.print_title_rows = f"{rows.min_row}:{rows.max_row + delta}"
+
+    for brk in ws.row_breaks.brk:
+        if brk.id > after_row:
+            brk.id += delta
+
+
+def _shift_rows_below(ws, end_row: int, delta: int):
+    """
+    一次性将end_row之后的所有行移动delta行（可为负数）。
+    openpyxl的insert_rows/delete_rows只移动单元格，合并区域、行高与打印设置在此一并平移。
+    """
+    if delta == 0:
+        return
+
+    if delta > 0:
+        ws.insert_rows(end_row + 1, delta)
+    else:
+        ws.delete_rows(end_row + 1 + delta, -delta)
+
+    # 合并区域的哈希值依赖其坐标，平移后重建集合
+    ranges = []
+    for mcr in ws.merged_cells.ranges:
+        if mcr.min_row > end_row:
+            mcr.shift(row_shift=delta)
+        elif mcr.max_row > end_row:
+            mcr.expand(down=delta)
+        ranges.append(mcr)
+    ws.merged_cells.ranges = set(ranges)
+
+    dims = ws.row_dimensions
+    below = sorted((r for r in dims if r > end_row), reverse=delta > 0)
+    for r_idx in below:
+        dim = dims.pop(r_idx)
+        dim.index = r_idx + delta
+        dims[r_idx + delta] = dim
+
+    _shift_print_ranges(ws, end_row, delta)
+
+
+def render_excel_template(
+    template_path: str, context: dict, stats: Optional[RenderStats] = None
+) -> openpyxl.Workbook:
+    """
+    渲染一个包含Jinja2语法的Excel模板，支持多行循环并保留样式。
+    传入stats时记录各阶段耗时。
+    """
+    start_time = time.time()
+    logger.log(DETAIL, "[Excel渲染器] 开始渲染模板: %s", template_path)
+    if logger.isEnabledFor(DETAIL):
+        logger.log(DETAIL, "[Excel渲染器] 模板路径: %s", os.path.abspath(template_path))
+        logger.log(DETAIL, "[Excel渲染器] 渲染上下文包含字段: %s", list(context))
+
+        # 记录重要字段的摘要信息
+        if "notice_no" in context:
+            logger.log(DETAIL, "[Excel渲染器] 通知编号: %s", context["notice_no"])
+        if "date" in context:
+            logger.log(DETAIL, "[Excel渲染器] 通知日期: %s", context["date"])
+        if "projects" in context:
+            logger.log(DETAIL, "[Excel渲染器] 项目数量: %d", len(context["projects"]))
+            for i, proj in enumerate(context["projects"][:2]):  # 只记录前2个项目
+                logger.log(
+                    DETAIL,
+                    "[Excel渲染器] 项目%d: %s - %s",
+                    i + 1,
+                    proj.get("project_code", "N/A"),
+                    proj.get("project_name", "N/A"),
+                )
+            if len(context["projects"]) > 2:
+                logger.log(
+                    DETAIL,
+                    "[Excel渲染器] ... 还有%d个项目",
+                    len(context["projects"]) - 2,
+                )
+
+    stage_start = time.perf_counter()
+    try:
+        compiled = get_compiled_template(template_path)
+        wb = compiled.load_workbook()
+        logger.log(
+            DETAIL, "[Excel渲染器] 模板快照加载成功，工作表名称: %s", wb.sheetnames
+        )
+        ws = wb.active
+        logger.log(DETAIL, "[Excel渲染器] 激活工作表: %s", ws.title)
+        logger.log(
+            DETAIL, "[Excel渲染器] 工作表尺寸: %d行 x %d列", ws.max_row, ws.max_column
+        )
+
+    except Exception as e:
+        logger.error("[Excel渲染器] 加载模板文件失败: %s", e)
+        raise
+
+    # --- 第一步：使用预编译条目中的标签索引定位循环块 ---
+    stage_start = add_stage_time(stats, "template_load", stage_start)
+    loop_blocks = compiled.loop_blocks
+    block_plans = get_block_plans(compiled)
+    logger.log(
+        DETAIL, "[Excel渲染器] 使用缓存的标签索引，共 %d 个顶层循环块", len(loop_blocks)
+    )
 
     # --- 第二步：处理找到的循环块 ---
-    logger.info(f"[Excel渲染器] 开始处理循环块，共{len(loop_blocks)}个")
+    # 自下而上处理，插入行不会影响尚未处理的循环块的位置
+    logger.log(DETAIL, "[Excel渲染器] 开始处理循环块，共%d个", len(loop_blocks))
 
-    for idx, block in enumerate(loop_blocks):
+    stage_start = add_stage_time(stats, "loop_scan", stage_start)
+    # 各循环块插入（或删除）的行数，用于换算其下方普通变量单元格的位置
+    row_shifts = []
+    for idx, block in reversed(list(enumerate(loop_blocks))):
         start_row = block["start_row"]
         end_row = block["end_row"]
-        start_col = block["start_col"]
-        end_col = block["end_col"]
         loop_var = block["loop_var"]
         list_name = block["list_name"]
+        block_height = end_row - start_row + 1
 
-        logger.info(f"[Excel渲染器] 处理循环块{idx + 1}: {list_name}.{loop_var}")
+        logger.log(
+            DETAIL, "[Excel渲染器] 处理循环块%d: %s.%s", idx + 1, list_name, loop_var
+        )
 
         project_list = context.get(list_name)
         if not project_list:
             logger.warning(
-                f"[Excel渲染器] 循环块{idx + 1}: 未找到数据列表 '{list_name}'，删除模板区域"
+                "[Excel渲染器] 循环块%d: 未找到数据列表 '%s'，删除模板区域",
+                idx + 1,
+                list_name,
+            )
+            project_list = []
+        else:
+            logger.log(
+                DETAIL,
+                "[Excel渲染器] 循环块%d: 找到%d个项目数据",
+                idx + 1,
+                len(project_list),
             )
-            ws.delete_rows(start_row, (end_row - start_row + 1))
-            continue
-
-        logger.info(f"[Excel渲染器] 循环块{idx + 1}: 找到{len(project_list)}个项目数据")
-
-        # 提取模板区域内的所有单元格值和样式
-        template_rows_data = []
-        for r_idx in range(start_row, end_row + 1):
-            row_data = []
-            for c_idx in range(start_col, end_col + 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                # 存储单元格对象本身，以便后续复制样式
-                row_data.append(cell)
-            template_rows_data.append(row_data)
 
-        logger.info(
-            f"[Excel渲染器] 循环块{idx + 1}: 提取了{len(template_rows_data)}行模板数据"
+        # 循环块的写入方案在模板首次使用时生成，之后直接复用
+        block_plan = block_plans[idx]
+        _clear_block(ws, block)
+
+        # 嵌套循环按内层列表展开，每个项目生成的行数可能不同
+        output_rows = []
+        for project_item in project_list:
+            check_deadline()
+            output_rows.extend(expand_item_rows(block, project_item, context))
+
+        # --- 第三步：一次性腾出所有项目所需的行，再原位渲染 ---
+        delta = len(output_rows) - block_height
+        _shift_rows_below(ws, end_row, delta)
+        row_shifts.append((end_row, delta))
+        logger.log(
+            DETAIL,
+            "[Excel渲染器] 循环块%d: 为%d个项目腾出%d行",
+            idx + 1,
+            len(project_list),
+            len(output_rows),
         )
 
-        ws.delete_rows(start_row, (end_row - start_row + 1))
-        logger.info(f"[Excel渲染器] 循环块{idx + 1}: 删除了原始模板区域")
+        rendered_count = 0
+        for r_offset, (template_row, temp_context) in enumerate(output_rows):
+            check_deadline()
+            rendered_count += _write_plan_row(
+                ws, start_row + r_offset, block_plan[template_row], temp_context
+            )
 
-        # --- 第三步：为每个项目创建新行并渲染 ---
-        logger.info(
-            f"[Excel渲染器] 循环块{idx + 1}: 开始为{len(project_list)}个项目创建渲染行"
+        logger.log(
+            DETAIL,
+            "[Excel渲染器] 循环块%d: 所有%d个项目渲染完成，渲染了%d个变量",
+            idx + 1,
+            len(project_list),
+            rendered_count,
         )
 
-        for i, project_item in enumerate(reversed(project_list)):
-            ws.insert_rows(start_row, len(template_rows_data))
-            logger.debug(
-                f"[Excel渲染器] 循环块{idx + 1}: 项目{i + 1} - 插入{len(template_rows_data)}行"
-            )
+    stage_start = add_stage_time(stats, "loop_expand", stage_start)
 
-            temp_context = {loop_var: project_item}
-            project_info = (
-                project_item.get("project_code", "N/A")
-                if isinstance(project_item, dict)
-                else "N/A"
-            )
-            logger.debug(
-                f"[Excel渲染器] 循环块{idx + 1}: 项目{i + 1} ({project_info}) - 开始渲染单元格"
-            )
+    # --- 第四步：按标签索引渲染普通变量 ---
+    # 只访问模板中记录的普通变量单元格，位置按其上方循环块插入的行数平移，
+    # 耗时与项目数量无关，也不会再次渲染循环生成的单元格
+    logger.log(DETAIL, "[Excel渲染器] 开始处理普通变量渲染")
 
-            rendered_count = 0
-            for r_offset, template_cells in enumerate(template_rows_data):
-                for c_offset, template_cell in enumerate(template_cells):
-                    current_cell = ws.cell(
-                        row=start_row + r_offset, column=start_col + c_offset
-                    )
-                    original_value = template_cell.value
-
-                    # *** 修正点：直接复制整个样式对象 ***
-                    if template_cell.has_style:
-                        _copy_style(template_cell, current_cell)
-
-                    # 渲染值
-                    if isinstance(original_value, str) and "{{" in original_value:
-                        clean_value = FOR_START_PATTERN.sub("", original_value).strip()
-                        clean_value = FOR_END_PATTERN.sub("", clean_value).strip()
-
-                        if clean_value:
-                            try:
-                                template = env.from_string(clean_value)
-                                rendered_value = template.render(temp_context)
-                                current_cell.value = rendered_value
-                                rendered_count += 1
-                            except TemplateSyntaxError:
-                                current_cell.value = original_value
-                                logger.warning(
-                                    f"[Excel渲染器] 循环块{idx + 1}: 项目{i + 1} - 模板语法错误: {original_value}"
-                                )
-                        else:
-                            current_cell.value = None
-                    else:
-                        if isinstance(original_value, str) and (
-                            "{% for" in original_value
-                            or "{% endfor %}" in original_value
-                        ):
-                            current_cell.value = None
-                        else:
-                            current_cell.value = original_value
-
-            logger.debug(
-                f"[Excel渲染器] 循环块{idx + 1}: 项目{i + 1} - 完成渲染，渲染了{rendered_count}个变量"
-            )
-
-        logger.info(
-            f"[Excel渲染器] 循环块{idx + 1}: 所有{len(project_list)}个项目渲染完成"
+    rendered_vars = 0
+    scalar_cells = compiled.tag_index.scalar_cells
+    for tagged in scalar_cells:
+        row_idx = tagged.row + sum(
+            delta for end_row, delta in row_shifts if end_row < tagged.row
         )
+        cell = ws._cells.get((row_idx, tagged.column))
+        if cell is None:
+            continue
+        cell.value, rendered = render_cell_value(
+            compiled,
+            tagged.row,
+            tagged.column,
+            cell.value,
+            context,
+            render_scalar_value,
+        )
+        rendered_vars += rendered
 
-    # --- 第四步：处理页面中剩余的普通变量 ---
-    logger.info("[Excel渲染器] 开始处理普通变量渲染")
-
-    rendered_vars = 0
-    total_cells = 0
-    for row in ws.iter_rows():
-        for cell in row:
-            total_cells += 1
-            if (
-                cell.value
-                and isinstance(cell.value, str)
-                and "{{" in cell.value
-                and "{%" not in cell.value
-            ):
-                try:
-                    template = env.from_string(cell.value)
-                    rendered_value = template.render(context)
-                    cell.value = rendered_value
-                    rendered_vars += 1
-                    logger.debug(
-                        f"[Excel渲染器] 渲染变量: {cell.value} -> {rendered_value}"
-                    )
-                except TemplateSyntaxError:
-                    logger.warning(f"[Excel渲染器] 普通变量模板语法错误: {cell.value}")
-                    pass
-
-    logger.info(
-        f"[Excel渲染器] 普通变量渲染完成，共检查{total_cells}个单元格，渲染了{rendered_vars}个变量"
+    logger.log(
+        DETAIL,
+        "[Excel渲染器] 普通变量渲染完成，共%d个变量单元格，渲染了%d个变量",
+        len(scalar_cells),
+        rendered_vars,
     )
 
+    add_stage_time(stats, "scalar_render", stage_start)
     elapsed_time = time.time() - start_time
-    logger.info(f"[Excel渲染器] 模板渲染完成，耗时{elapsed_time:.2f}秒")
+    logger.log(DETAIL, "[Excel渲染器] 模板渲染完成，耗时%.2f秒", elapsed_time)
 
     return wb
 
-    return wb
+
+def save_workbook_to_buffer(
+    wb: openpyxl.Workbook,
+    max_size: int,
+    template_path: str,
+    compresslevel: Optional[int] = None,
+) -> tempfile.SpooledTemporaryFile:
+    """
+    将工作簿序列化到有界缓冲区：不超过max_size字节时保存在内存中，超出后溢出到临时文件。
+    返回的缓冲区已定位到开头，关闭时自动删除溢出的临时文件。
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_size, suffix=".xlsx")
+    try:
+        save_workbook(wb, buffer, template_path, compresslevel)
+    except Exception:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
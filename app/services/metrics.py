@@ -0,0 +1,408 @@
+# app/services/metrics.py
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import METRICS_DIR, METRICS_FLUSH_INTERVAL, TEMPLATE_MAP
+from app.services.profiling import ProfileResult
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的桶上限（秒）
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# 项目数量分桶，避免按原始数量产生过多标签组合
+PROJECT_BUCKETS = (
+    (0, "0"),
+    (10, "1-10"),
+    (100, "11-100"),
+    (1000, "101-1k"),
+    (10000, "1k-10k"),
+)
+
+# 指标名称 -> (类型, 说明)
+METRICS = {
+    "excel_render_requests_total": ("counter", "渲染请求数量"),
+    "excel_render_request_seconds": ("histogram", "渲染请求的总耗时（秒）"),
+    "excel_render_stage_seconds": ("histogram", "渲染各阶段的耗时（秒）"),
+    "excel_render_cache_total": ("counter", "渲染结果缓存的查询结果"),
+    "excel_request_validation_seconds": ("histogram", "请求数据校验的耗时（秒）"),
+    "excel_request_validation_errors_total": ("counter", "请求数据校验失败的次数"),
+    "excel_render_jobs_total": ("counter", "渲染任务的提交、拒绝与完成次数"),
+    "excel_render_admission_total": ("counter", "渲染请求的内存准入结果"),
+    "excel_render_memory_budget_bytes": ("gauge", "服务进程的渲染内存预算（字节）"),
+    "excel_render_memory_reserved_bytes": (
+        "gauge",
+        "服务进程中进行中的渲染按估算占用的内存（字节）",
+    ),
+    "excel_render_admission_waiting": ("gauge", "排队等待内存预算的渲染请求数量"),
+    "excel_process_resident_memory_bytes": (
+        "gauge",
+        "服务进程与渲染进程的常驻内存（RSS，字节）",
+    ),
+}
+
+
+def template_label(template_type: str) -> str:
+    """
+    将模板类型映射为指标标签：TEMPLATE_MAP之外的取值（来自客户端的无效输入）
+    统一记为unknown，防止任意输入产生无限多的指标序列
+    """
+    return template_type if template_type in TEMPLATE_MAP else "unknown"
+
+
+def project_bucket(count: int) -> str:
+    """将项目数量映射到分桶标签"""
+    for upper, label in PROJECT_BUCKETS:
+        if count <= upper:
+            return label
+    return "10k+"
+
+
+@dataclass
+class RenderStats:
+    """一次渲染的统计信息，由渲染池任务返回给服务进程记录"""
+
+    engine: str = ""
+    stages: Dict[str, float] = field(default_factory=dict)
+    # 请求了性能分析时的分析结果
+    profile: Optional[ProfileResult] = None
+
+
+@contextmanager
+def timed(stats: Optional[RenderStats], stage: str):
+    """累计代码块的耗时到指定阶段，stats为None时不计时"""
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.stages[stage] = stats.stages.get(stage, 0.0) + time.perf_counter() - start
+
+
+def add_stage_time(stats: Optional[RenderStats], stage: str, start: float) -> float:
+    """将自start起的耗时累计到指定阶段，返回当前时间，便于连续记录下一阶段"""
+    now = time.perf_counter()
+    if stats is not None:
+        stats.stages[stage] = stats.stages.get(stage, 0.0) + now - start
+    return now
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表。每个服务进程把自己的快照写入METRICS_DIR下以进程号命名的文件，
+    /metrics 汇总目录中所有进程的快照，因此多worker部署时任意进程都能返回完整数据。
+    """
+
+    def __init__(self, directory: str, flush_interval: float):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._counters: Dict[tuple, float] = {}
+        self._histograms: Dict[tuple, list] = {}
+        self._gauges: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def inc(self, name: str, labels: dict, value: float = 1.0) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                # 各桶计数（不累计）、+Inf桶计数、总和
+                series = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+                self._histograms[key] = series
+            series[bisect_left(DURATION_BUCKETS, value)] += 1
+            series[-1] += value
+
+    def set_gauge(self, name: str, series: Iterable[Tuple[dict, float]]) -> None:
+        """以 (标签, 取值) 序列替换指定仪表盘指标的全部取值"""
+        values = {(name, _label_key(labels)): value for labels, value in series}
+        with self._lock:
+            for key in [key for key in self._gauges if key[0] == name]:
+                del self._gauges[key]
+            self._gauges.update(values)
+
+    def snapshot(self) -> dict:
+        """导出可序列化的快照"""
+        with self._lock:
+            return {
+                "counters": [
+                    [name, list(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                "histograms": [
+                    [name, list(labels), list(series)]
+                    for (name, labels), series in self._histograms.items()
+                ],
+                "gauges": [
+                    [name, list(labels), value]
+                    for (name, labels), value in self._gauges.items()
+                ],
+            }
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def flush(self) -> None:
+        """将本进程的快照写入指标目录"""
+        if not self.directory:
+            return
+        self._last_flush = time.monotonic()
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self._snapshot_path(os.getpid()))
+        except OSError as e:
+            logger.warning("[指标] 写入指标快照失败: %s", e)
+
+    def maybe_flush(self) -> None:
+        """距上次写入超过METRICS_FLUSH_INTERVAL时写入快照"""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def prune(self) -> None:
+        """删除已退出进程留下的快照，服务启动时调用"""
+        if not self.directory:
+            return
+        for entry in os.scandir(self.directory):
+            name, _, suffix = entry.name.partition(".")
+            if suffix != "json" or not name.isdigit():
+                continue
+            try:
+                os.kill(int(name), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            except PermissionError:
+                pass
+
+    def collect(self) -> List[dict]:
+        """读取所有进程的快照，本进程使用内存中的最新数据"""
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+
+        own_file = f"{os.getpid()}.json"
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json") or entry.name == own_file:
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning("[指标] 读取指标快照失败: %s - %s", entry.path, e)
+        return snapshots
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable, extra: Optional[tuple] = None) -> str:
+    pairs = [tuple(pair) for pair in labels]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render_prometheus(snapshots: List[dict]) -> str:
+    """汇总多个进程的快照，输出Prometheus文本格式"""
+    counters: Dict[tuple, float] = {}
+    histograms: Dict[tuple, list] = {}
+    gauges: Dict[tuple, float] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get("gauges", ()):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, value in snapshot.get("counters", ()):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, series in snapshot.get("histograms", ()):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = list(series)
+            else:
+                for i, value in enumerate(series):
+                    merged[i] += value
+
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type in ("counter", "gauge"):
+            values = counters if metric_type == "counter" else gauges
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {_format_number(value)}"
+                    )
+            continue
+
+        for (metric, labels), series in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for upper, count in zip(DURATION_BUCKETS, series):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, ('le', upper))} {cumulative}"
+                )
+            cumulative += series[len(DURATION_BUCKETS)]
+            lines.append(
+                f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {cumulative}"
+            )
+            lines.append(
+                f"{name}_sum{_format_labels(labels)} {_format_number(series[-1])}"
+            )
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# 进程内共享的指标注册表
+registry = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+
+
+def record_render(
+    template_type: str,
+    project_count: int,
+    status: int,
+    duration: float,
+    cache: Optional[str] = None,
+    stats: Optional[RenderStats] = None,
+) -> None:
+    """记录一次渲染请求的指标"""
+    template_type = template_label(template_type)
+    projects = project_bucket(project_count)
+    registry.inc(
+        "excel_render_requests_total",
+        {"template_type": template_type, "status": status},
+    )
+    registry.observe(
+        "excel_render_request_seconds",
+        {"template_type": template_type, "projects": projects},
+        duration,
+    )
+    if cache is not None:
+        registry.inc(
+            "excel_render_cache_total",
+            {"template_type": template_type, "result": cache},
+        )
+    if stats is not None:
+        for stage, seconds in stats.stages.items():
+            registry.observe(
+                "excel_render_stage_seconds",
+                {
+                    "stage": stage,
+                    "engine": stats.engine,
+                    "template_type": template_type,
+                    "projects": projects,
+                },
+                seconds,
+            )
+    registry.maybe_flush()
+
+
+def record_validation(
+    template_type: str, project_count: int, duration: float, ok: bool
+) -> None:
+    """记录一次请求数据校验的指标"""
+    template_type = template_label(template_type)
+    if ok:
+        registry.observe(
+            "excel_request_validation_seconds",
+            {"template_type": template_type, "projects": project_bucket(project_count)},
+            duration,
+        )
+    else:
+        registry.inc(
+            "excel_request_validation_errors_total", {"template_type": template_type}
+        )
+
+
+def record_job(template_type: str, result: str) -> None:
+    """记录渲染任务的提交（submitted）、拒绝（rejected）或完成结果（succeeded/failed）"""
+    registry.inc(
+        "excel_render_jobs_total",
+        {"template_type": template_label(template_type), "result": result},
+    )
+    registry.maybe_flush()
+
+
+def record_admission(template_type: str, result: str, engine: str) -> None:
+    """记录渲染请求的内存准入结果：admitted、degraded、queued 或 rejected"""
+    registry.inc(
+        "excel_render_admission_total",
+        {
+            "template_type": template_label(template_type),
+            "result": result,
+            "engine": engine,
+        },
+    )
+    registry.maybe_flush()
+
+
+def record_memory(status: dict) -> None:
+    """记录本服务进程的渲染内存预算、估算占用与各进程的RSS"""
+    pid = str(os.getpid())
+    registry.set_gauge(
+        "excel_render_memory_budget_bytes", [({"pid": pid}, status["budget"])]
+    )
+    registry.set_gauge(
+        "excel_render_memory_reserved_bytes", [({"pid": pid}, status["reserved"])]
+    )
+    registry.set_gauge(
+        "excel_render_admission_waiting", [({"pid": pid}, status["waiting"])]
+    )
+    registry.set_gauge(
+        "excel_process_resident_memory_bytes",
+        [
+            ({"pid": str(process["pid"]), "role": process["role"]}, process["rss"])
+            for process in status["processes"]
+            if process["rss"] is not None
+        ],
+    )
@@ -0,0 +1,120 @@
+# app/services/output_cache.py
+import hashlib
+import json
+from typing import BinaryIO, Optional
+
+from app.config import (
+    OUTPUT_CACHE_DIR,
+    OUTPUT_CACHE_DISK_MAX_SIZE,
+    OUTPUT_CACHE_MAX_ITEM_SIZE,
+    OUTPUT_CACHE_MAX_SIZE,
+    OUTPUT_CACHE_TTL,
+)
+from app.services.sized_store import SizedStore
+
+# 缓存键格式版本，渲染结果的格式发生不兼容变化时递增，使旧缓存全部失效
+CACHE_KEY_VERSION = 1
+
+
+def make_cache_key(
+    template_type: str,
+    template_version: str,
+    data: dict,
+    options: Optional[dict] = None,
+) -> str:
+    """
+    根据模板类型、模板文件版本、规范化后的通知数据与影响输出的渲染选项计算缓存键。
+    数据按键排序序列化，字段顺序不同但内容相同的请求得到相同的键。
+    """
+    payload = json.dumps(
+        {
+            "v": CACHE_KEY_VERSION,
+            "template_type": template_type,
+            "template_version": template_version,
+            "data": data,
+            "options": options or {},
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_etag(cache_key: str) -> str:
+    """
+    由缓存键生成弱ETag：缓存键相同的请求语义上得到同一份通知单，但文件字节可能不同
+    （文档属性中的创建时间、内存准入改用的渲染引擎），因此不能作为强校验器
+    """
+    return f'W/"{cache_key}"'
+
+
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str, exists: bool = False) -> bool:
+    """
+    判断If-None-Match请求头是否包含指定的ETag（按弱比较规则）。
+    "*"只在exists为True（已有该请求的缓存结果）时匹配：渲染接口为POST，
+    客户端发送"*"并不表示它已经收到过本次请求的输出。
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return exists
+    opaque_tag = _opaque_tag(etag)
+    return any(
+        _opaque_tag(candidate.strip()) == opaque_tag
+        for candidate in if_none_match.split(",")
+    )
+
+
+class OutputCache(SizedStore):
+    """
+    渲染结果缓存：内存中按LRU淘汰，受总大小与过期时间限制；
+    可选的磁盘层在内存淘汰后继续保留结果，并在同一主机的多个服务进程间共享。
+    """
+
+    log_name = "输出缓存"
+    disk_suffix = ".xlsx"
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: int,
+        max_item_size: int,
+        disk_dir: str = "",
+        disk_max_size: int = 0,
+    ):
+        super().__init__(max_size, ttl, disk_dir, disk_max_size)
+        self.max_item_size = max_item_size
+
+    def get(self, key: str) -> Optional[bytes]:
+        """查找缓存的渲染结果，过期条目视为未命中。磁盘命中时提升到内存层"""
+        return super().get(key)
+
+    def put(self, key: str, content: bytes) -> None:
+        """缓存渲染结果，超过单项大小上限的结果不缓存"""
+        if len(content) <= self.max_item_size:
+            super().put(key, content)
+
+    def _size_of(self, content: bytes) -> int:
+        return len(content)
+
+    def _dump(self, content: bytes, f: BinaryIO) -> None:
+        f.write(content)
+
+    def _load(self, f: BinaryIO) -> bytes:
+        return f.read()
+
+
+# 进程内共享的渲染结果缓存
+output_cache = OutputCache(
+    max_size=OUTPUT_CACHE_MAX_SIZE,
+    ttl=OUTPUT_CACHE_TTL,
+    max_item_size=OUTPUT_CACHE_MAX_ITEM_SIZE,
+    disk_dir=OUTPUT_CACHE_DIR,
+    disk_max_size=OUTPUT_CACHE_DISK_MAX_SIZE,
+)
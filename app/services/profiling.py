@@ -0,0 +1,297 @@
+# app/services/profiling.py
+import hmac
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from app.config import (
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_RATE_LIMIT,
+    PROFILE_RATE_WINDOW,
+    PROFILE_TOKEN,
+    PROFILE_TRACEMALLOC_FRAMES,
+    PROFILE_TTL,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 性能分析结果的文件：摘要、折叠格式的调用栈采样与tracemalloc内存快照
+SUMMARY_SUFFIX = ".json"
+STACKS_SUFFIX = ".stacks.txt"
+SNAPSHOT_SUFFIX = ".tracemalloc"
+# 摘要与响应头中列出的热点函数与内存分配位置的数量
+TOP_COUNT = 5
+
+
+@dataclass
+class ProfileResult:
+    """一次渲染的性能分析结果，由渲染池任务返回给服务进程保存"""
+
+    # 折叠格式的调用栈（由外到内以;分隔）-> 采样次数
+    stacks: Dict[str, int] = field(default_factory=dict)
+    samples: int = 0
+    interval: float = PROFILE_INTERVAL
+    # 渲染期间tracemalloc记录的内存峰值（字节）
+    peak_memory: int = 0
+    # 渲染结束时仍占用内存最多的分配位置
+    top_allocations: List[dict] = field(default_factory=list)
+    # 内存快照文件，由执行渲染的进程写入
+    snapshot_path: str = ""
+
+
+def _frame_label(frame) -> str:
+    """
+    调用栈中一帧的名称：函数名、模块名与函数的起始行号。不使用文件路径，
+    结果经响应头X-Profile-Top返回给客户端，不暴露服务器上的目录结构。
+    """
+    module = frame.f_globals.get("__name__") or "?"
+    return f"{frame.f_code.co_name} ({module}:{frame.f_code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """
+    采样式性能分析：后台线程按固定间隔读取目标线程的调用栈并计数，
+    开销与函数调用次数无关，不需要修改被分析的代码。
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run_profiled(func: Callable, args: tuple, snapshot_path: str):
+    """
+    在渲染池中执行：对func(*args)进行调用栈采样与tracemalloc内存跟踪，
+    内存快照写入snapshot_path。返回 (func的返回值, ProfileResult)。
+    """
+    sampler = StackSampler(threading.get_ident())
+    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    sampler.start()
+    try:
+        result = func(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        sampler.stop()
+        tracemalloc.stop()
+
+    snapshot.dump(snapshot_path)
+    top_allocations = [
+        {
+            "location": str(stat.traceback[0]),
+            "size": stat.size,
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:TOP_COUNT]
+    ]
+    return result, ProfileResult(
+        stacks=dict(sampler.stacks),
+        samples=sampler.samples,
+        interval=sampler.interval,
+        peak_memory=peak_memory,
+        top_allocations=top_allocations,
+        snapshot_path=snapshot_path,
+    )
+
+
+def merge_profiles(results: List[ProfileResult]) -> ProfileResult:
+    """
+    合并拆分为多个工作表依次渲染时各部分的分析结果：调用栈累加，
+    内存峰值与快照取峰值最高的部分，其余部分的快照文件删除。
+    """
+    merged = max(results, key=lambda result: result.peak_memory)
+    stacks: Counter = Counter()
+    for result in results:
+        stacks.update(result.stacks)
+        if result is not merged:
+            _unlink(result.snapshot_path)
+    return ProfileResult(
+        stacks=dict(stacks),
+        samples=sum(result.samples for result in results),
+        interval=merged.interval,
+        peak_memory=merged.peak_memory,
+        top_allocations=merged.top_allocations,
+        snapshot_path=merged.snapshot_path,
+    )
+
+
+def top_frames(result: ProfileResult, count: int = TOP_COUNT) -> List[dict]:
+    """按自身采样次数（调用栈最内层）排列的热点函数"""
+    leaves: Counter = Counter()
+    for stack, samples in result.stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += samples
+    return [
+        {
+            "frame": frame,
+            "samples": samples,
+            "ratio": round(samples / result.samples, 3),
+        }
+        for frame, samples in leaves.most_common(count)
+    ]
+
+
+def profile_headers(request_id: str, result: ProfileResult, url: str) -> dict:
+    """性能分析结果的响应头：热点函数、内存峰值与结果的查询地址"""
+    top = ", ".join(
+        f"{frame['frame']}={frame['ratio']:.1%}" for frame in top_frames(result)
+    )
+    return {
+        "X-Profile-Id": request_id,
+        "X-Profile-Url": url,
+        "X-Profile-Samples": str(result.samples),
+        # 响应头只能使用latin-1字符，函数名与模块名中的其他字符转义
+        "X-Profile-Top": top.encode("ascii", "backslashreplace").decode("ascii"),
+        "X-Profile-Peak-Memory": str(result.peak_memory),
+    }
+
+
+def verify_profile_token(token: Optional[str]) -> bool:
+    """校验性能分析的访问令牌，未配置PROFILE_TOKEN时一律拒绝"""
+    if not PROFILE_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8"))
+
+
+class ProfileRateLimiter:
+    """
+    限制性能分析请求的频率：时间窗口内最多limit个，同一时间最多一个，
+    避免采样与内存跟踪的开销影响正常的渲染请求。
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._started = deque()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[int]:
+        """获取一次性能分析的许可，成功时返回None，否则返回建议的重试等待秒数"""
+        now = time.monotonic()
+        with self._lock:
+            while self._started and self._started[0] + self.window <= now:
+                self._started.popleft()
+            if self._running:
+                return 1
+            if len(self._started) >= self.limit:
+                return max(1, int(self._started[0] + self.window - now + 1))
+            self._started.append(now)
+            self._running = True
+            return None
+
+    def release(self) -> None:
+        with self._lock:
+            self._running = False
+
+
+# 进程内共享的性能分析限流器
+profile_limiter = ProfileRateLimiter(PROFILE_RATE_LIMIT, PROFILE_RATE_WINDOW)
+
+
+def profile_path(request_id: str, suffix: str) -> str:
+    """性能分析结果文件的路径"""
+    return os.path.join(PROFILE_DIR, request_id + suffix)
+
+
+def new_snapshot_path(request_id: str, part: int = 0) -> str:
+    """渲染进程写入内存快照的路径，拆分渲染的各部分分别写入"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return profile_path(f"{request_id}.{part}", SNAPSHOT_SUFFIX)
+
+
+def save_profile(request_id: str, result: ProfileResult, summary: dict) -> dict:
+    """
+    保存性能分析结果：折叠格式的调用栈（可用flamegraph.pl或speedscope查看）、
+    内存快照（可用tracemalloc.Snapshot.load加载）与摘要。返回写入的摘要。
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    document = {
+        **summary,
+        "request_id": request_id,
+        "created_at": time.time(),
+        "samples": result.samples,
+        "interval": result.interval,
+        "top_frames": top_frames(result),
+        "peak_memory": result.peak_memory,
+        "top_allocations": result.top_allocations,
+    }
+    _write_file(
+        profile_path(request_id, STACKS_SUFFIX),
+        "".join(
+            f"{stack} {samples}\n" for stack, samples in sorted(result.stacks.items())
+        ).encode("utf-8"),
+    )
+    if result.snapshot_path:
+        os.replace(result.snapshot_path, profile_path(request_id, SNAPSHOT_SUFFIX))
+    _write_file(
+        profile_path(request_id, SUMMARY_SUFFIX),
+        json.dumps(document, ensure_ascii=False, indent=2).encode("utf-8"),
+    )
+    _prune_profiles()
+    return document
+
+
+def load_profile_summary(request_id: str) -> Optional[dict]:
+    """读取性能分析结果的摘要，不存在或已过期时返回None"""
+    path = profile_path(request_id, SUMMARY_SUFFIX)
+    try:
+        if os.stat(path).st_mtime + PROFILE_TTL <= time.time():
+            return None
+        with open(path, "rb") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_file(path: str, content: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=PROFILE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _prune_profiles() -> None:
+    """删除超过PROFILE_TTL的性能分析结果文件"""
+    expires = time.time() - PROFILE_TTL
+    for entry in os.scandir(PROFILE_DIR):
+        try:
+            if entry.stat().st_mtime <= expires:
+                _unlink(entry.path)
+        except FileNotFoundError:
+            continue
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,291 @@
+# app/services/project_upload.py
+import codecs
+import csv
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.logging_config import DETAIL
+from app.models.notice import (
+    PROJECT_COLUMNS,
+    ProjectRowStream,
+    decode_notice_header,
+    decode_project_line,
+    validate_project_row,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# template_type、data字段的最大字节数，项目数据不受此限制
+MAX_FIELD_SIZE = 1024 * 1024
+# CSV未声明编码时使用的编码，兼容带BOM的UTF-8
+DEFAULT_CSV_ENCODING = "utf-8-sig"
+
+_CSV_CONTENT_TYPES = ("text/csv", "application/csv", "application/vnd.ms-excel")
+_NDJSON_CONTENT_TYPES = (
+    "application/x-ndjson",
+    "application/ndjson",
+    "application/jsonl",
+    "application/x-jsonlines",
+)
+
+
+class UploadError(Exception):
+    """上传的请求体格式错误"""
+
+
+@dataclass
+class UploadPart:
+    """multipart请求体中的一个部分"""
+
+    name: str
+    filename: str
+    content_type: str
+    charset: Optional[str]
+
+
+@dataclass
+class ProjectUpload:
+    """解析出的上传请求：模板类型、通知数据与逐行校验的项目数据"""
+
+    template_type: str
+    notice: dict
+    projects: ProjectRowStream
+
+
+class _MultipartReader:
+    """
+    将python-multipart的回调式解析器包装为按顺序拉取的读取器：
+    需要更多数据时才从chunks中读取下一块请求体。
+    """
+
+    def __init__(self, chunks: Iterator[bytes], boundary: bytes):
+        self._chunks = chunks
+        self._events = deque()
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._finished = False
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_end": self._on_end,
+            },
+        )
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        self._events.append(("part", self._headers))
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self) -> None:
+        self._events.append(("end", None))
+
+    def _on_end(self) -> None:
+        self._events.append(("eof", None))
+
+    def _next_event(self) -> tuple:
+        while not self._events:
+            if self._finished:
+                return ("eof", None)
+            chunk = next(self._chunks, None)
+            try:
+                if chunk is None:
+                    self._parser.finalize()
+                    if not self._events:
+                        raise UploadError("请求体不完整")
+                else:
+                    self._parser.write(chunk)
+            except MultipartParseError as e:
+                raise UploadError(f"multipart请求体解析失败: {e}") from None
+        event = self._events.popleft()
+        if event[0] == "eof":
+            self._finished = True
+        return event
+
+    def next_part(self) -> Optional[UploadPart]:
+        """跳过当前部分的剩余数据，返回下一个部分；没有更多部分时返回None"""
+        while True:
+            kind, value = self._next_event()
+            if kind == "eof":
+                return None
+            if kind == "part":
+                return self._make_part(value)
+
+    @staticmethod
+    def _make_part(headers: dict) -> UploadPart:
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        content_type, options = parse_options_header(headers.get(b"content-type", b""))
+        charset = options.get(b"charset")
+        return UploadPart(
+            name=disposition.get(b"name", b"").decode("utf-8", "replace"),
+            filename=disposition.get(b"filename", b"").decode("utf-8", "replace"),
+            content_type=content_type.decode("latin-1").lower(),
+            charset=charset.decode("latin-1") if charset else None,
+        )
+
+    def read(self, max_size: int) -> bytes:
+        """读取当前部分的全部数据"""
+        data = bytearray()
+        for chunk in self.iter_data():
+            data += chunk
+            if len(data) > max_size:
+                raise UploadError(f"字段超过{max_size}字节的大小限制")
+        return bytes(data)
+
+    def iter_data(self) -> Iterator[bytes]:
+        """逐块返回当前部分的数据"""
+        while True:
+            kind, value = self._next_event()
+            if kind == "data":
+                yield value
+            elif kind in ("end", "eof"):
+                return
+
+
+def _iter_ndjson(data: Iterator[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """按行切分NDJSON，返回 (行号, 行内容)，跳过空行"""
+    pending = b""
+    line_no = 0
+    for chunk in data:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, line
+    if pending.strip():
+        yield line_no + 1, pending
+
+
+def _iter_csv(data: Iterator[bytes], encoding: str) -> Iterator[Tuple[int, dict]]:
+    """
+    逐行解析CSV，首行为表头，返回 (行号, 以ProjectInfo字段名为键的字典)。
+    无法识别的列被忽略，空值视为未提供。
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)()
+    except LookupError:
+        raise UploadError(f"不支持的CSV编码: {encoding}") from None
+
+    def lines() -> Iterator[str]:
+        pending = ""
+        try:
+            for chunk in data:
+                text = pending + decoder.decode(chunk)
+                *complete, pending = text.split("\n")
+                for line in complete:
+                    yield line + "\n"
+            pending += decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            raise UploadError(f"CSV内容不是有效的{encoding}编码: {e}") from None
+        if pending:
+            yield pending
+
+    reader = csv.reader(lines())
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [PROJECT_COLUMNS.get(name.strip()) for name in header]
+    if not any(columns):
+        raise UploadError(f"CSV表头中没有可识别的项目字段: {header}")
+    logger.log(
+        DETAIL,
+        "[项目上传] CSV表头: %s",
+        [name for name, column in zip(header, columns) if column],
+    )
+
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        yield (
+            reader.line_num,
+            {
+                column: value
+                for column, value in zip(columns, row)
+                if column and value.strip()
+            },
+        )
+
+
+def _project_format(part: UploadPart) -> str:
+    """根据Content-Type或文件扩展名判断项目数据的格式"""
+    filename = part.filename.lower()
+    if part.content_type in _CSV_CONTENT_TYPES or filename.endswith(".csv"):
+        return "csv"
+    if part.content_type in _NDJSON_CONTENT_TYPES or filename.endswith(
+        (".ndjson", ".jsonl")
+    ):
+        return "ndjson"
+    raise UploadError(
+        "无法识别projects的格式，请使用 .csv / .ndjson 文件名或对应的Content-Type"
+    )
+
+
+def read_project_upload(chunks: Iterator[bytes], boundary: bytes) -> ProjectUpload:
+    """
+    解析上传请求：template_type与data字段必须位于projects部分之前。
+    读取到projects部分时即返回，项目数据在迭代ProjectUpload.projects时才逐块读取。
+    """
+    reader = _MultipartReader(chunks, boundary)
+    fields = {}
+    while True:
+        part = reader.next_part()
+        if part is None:
+            raise UploadError("缺少projects部分")
+        if part.name == "projects":
+            break
+        if part.name in ("template_type", "data"):
+            fields[part.name] = reader.read(MAX_FIELD_SIZE)
+
+    missing = [name for name in ("template_type", "data") if name not in fields]
+    if missing:
+        raise UploadError(f"字段 {', '.join(missing)} 缺失或位于projects部分之后")
+
+    template_type = fields["template_type"].decode("utf-8", "replace").strip()
+    notice = decode_notice_header(fields["data"])
+    if notice.pop("projects"):
+        raise UploadError("data中不能包含projects，项目数据应通过projects部分上传")
+
+    project_format = _project_format(part)
+    logger.log(
+        DETAIL,
+        "[项目上传] 通知编号: %s，项目数据格式: %s",
+        notice["notice_no"],
+        project_format,
+    )
+    if project_format == "csv":
+        rows = _iter_csv(reader.iter_data(), part.charset or DEFAULT_CSV_ENCODING)
+        projects = ProjectRowStream(rows, validate_project_row)
+    else:
+        projects = ProjectRowStream(
+            _iter_ndjson(reader.iter_data()), decode_project_line
+        )
+    return ProjectUpload(template_type, notice, projects)
@@ -0,0 +1,48 @@
+# app/services/render_deadline.py
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class RenderTimeoutError(Exception):
+    """渲染任务超过了允许的执行时间"""
+
+
+class RenderCancelledError(Exception):
+    """客户端断开连接，渲染任务已取消"""
+
+
+# 当前线程中执行的渲染任务的 (截止时间, 取消标志)
+_current = threading.local()
+
+
+@contextmanager
+def render_deadline(
+    deadline: Optional[float], cancelled: Optional[threading.Event] = None
+):
+    """
+    在渲染池任务中设置当前线程的截止时间（time.time()的绝对时间，渲染进程与服务进程共用）
+    与取消标志（只用于线程渲染池，进程间无法共享）。渲染引擎通过check_deadline检查。
+    """
+    previous = getattr(_current, "state", None)
+    _current.state = (deadline, cancelled)
+    try:
+        yield
+    finally:
+        _current.state = previous
+
+
+def check_deadline() -> None:
+    """
+    渲染引擎在项目与行块之间调用：超过截止时间或任务已取消时抛出异常，
+    使服务端已放弃的任务尽快结束、让出渲染池。不在渲染池任务中时不做检查。
+    """
+    state = getattr(_current, "state", None)
+    if state is None:
+        return
+    deadline, cancelled = state
+    if cancelled is not None and cancelled.is_set():
+        raise RenderCancelledError("渲染任务已取消")
+    if deadline is not None and time.time() >= deadline:
+        raise RenderTimeoutError("渲染任务超过允许的执行时间，已在渲染池中中止")
@@ -0,0 +1,164 @@
+# app/services/render_fingerprints.py
+import base64
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from app.config import (
+    RERENDER_CACHE_DIR,
+    RERENDER_CACHE_DISK_MAX_SIZE,
+    RERENDER_CACHE_MAX_SIZE,
+    RERENDER_CACHE_TTL,
+)
+from app.services.sized_store import SizedStore
+
+# 指纹格式版本，片段、分块或磁盘文件的格式发生不兼容变化时递增，使旧指纹全部失效
+FINGERPRINT_VERSION = 2
+
+
+@dataclass(frozen=True)
+class LoopUnit:
+    """
+    循环块中一个项目渲染好的行：行XML中的行号以占位符\\x00表示，
+    写出时替换为实际行号，因此项目在列表中移动位置后仍可复用。
+    """
+
+    row_count: int
+    # (项目内的相对行号, 行XML)，相对行号从1开始
+    rows: Tuple[Tuple[int, bytes], ...]
+    # (相对行号, 模板行号)，需要复制模板合并区域的行
+    merges: Tuple[Tuple[int, int], ...]
+    # 行XML的总字节数
+    size: int
+
+
+@dataclass(frozen=True)
+class CompressedChunk:
+    """工作表XML中独立压缩的一个分块"""
+
+    raw: bytes
+    crc: int
+    file_size: int
+
+
+@dataclass(frozen=True)
+class RenderFingerprint:
+    """
+    一份通知上次渲染的指纹：各项目的摘要与渲染好的行，以及工作表XML
+    按分块独立压缩的结果。再次提交时只渲染摘要变化的项目，只压缩内容变化的分块。
+    """
+
+    template_version: str
+    compresslevel: int
+    # 项目摘要 -> 渲染好的行
+    units: Dict[bytes, LoopUnit]
+    # 分块摘要（起始行号与所含片段的摘要）-> 压缩好的分块
+    chunks: Dict[bytes, CompressedChunk]
+    # 指纹占用的大致字节数，用于内存层的容量限制
+    size: int
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text.encode("ascii"), validate=True)
+
+
+def fingerprint_to_json(fingerprint: RenderFingerprint) -> bytes:
+    """
+    指纹的磁盘格式：JSON，字节串以base64表示。磁盘目录可能由多个进程共享，
+    读取时只解析数据，不像pickle那样可能执行代码。
+    """
+    document = {
+        "template_version": fingerprint.template_version,
+        "compresslevel": fingerprint.compresslevel,
+        "units": [
+            [
+                _b64(digest),
+                unit.row_count,
+                [[offset, _b64(xml)] for offset, xml in unit.rows],
+                [list(merge) for merge in unit.merges],
+                unit.size,
+            ]
+            for digest, unit in fingerprint.units.items()
+        ],
+        "chunks": [
+            [_b64(digest), _b64(chunk.raw), chunk.crc, chunk.file_size]
+            for digest, chunk in fingerprint.chunks.items()
+        ],
+        "size": fingerprint.size,
+    }
+    return json.dumps(document, separators=(",", ":")).encode("ascii")
+
+
+def fingerprint_from_json(content: bytes) -> RenderFingerprint:
+    """解析fingerprint_to_json的结果，格式不符时抛出ValueError、KeyError或TypeError"""
+    document = json.loads(content)
+    units = {
+        _unb64(digest): LoopUnit(
+            int(row_count),
+            tuple((int(offset), _unb64(xml)) for offset, xml in rows),
+            tuple((int(offset), int(template_row)) for offset, template_row in merges),
+            int(size),
+        )
+        for digest, row_count, rows, merges, size in document["units"]
+    }
+    chunks = {
+        _unb64(digest): CompressedChunk(_unb64(raw), int(crc), int(file_size))
+        for digest, raw, crc, file_size in document["chunks"]
+    }
+    return RenderFingerprint(
+        str(document["template_version"]),
+        int(document["compresslevel"]),
+        units,
+        chunks,
+        int(document["size"]),
+    )
+
+
+def make_fingerprint_key(template_path: str, notice_no: str) -> str:
+    """指纹按 (模板, 通知编号) 保存，同一编号在不同模板下互不影响"""
+    payload = f"{FINGERPRINT_VERSION}\x00{template_path}\x00{notice_no}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FingerprintStore(SizedStore):
+    """
+    渲染指纹存储：内存中按LRU淘汰，受总大小与过期时间限制；
+    可选的磁盘层在同一主机的多个服务进程与渲染池工作进程间共享指纹，
+    使再次提交的通知无论由哪个进程渲染都能增量渲染。
+    """
+
+    log_name = "渲染指纹"
+    disk_suffix = ".fingerprint.json"
+    # binascii.Error与json.JSONDecodeError均为ValueError的子类
+    load_errors = (ValueError, KeyError, TypeError)
+
+    def get(self, key: str) -> Optional[RenderFingerprint]:
+        """查找通知的渲染指纹，过期视为不存在。磁盘命中时提升到内存层"""
+        return super().get(key)
+
+    def put(self, key: str, fingerprint: RenderFingerprint) -> None:
+        """保存通知本次渲染的指纹，替换上次的指纹"""
+        super().put(key, fingerprint)
+
+    def _size_of(self, fingerprint: RenderFingerprint) -> int:
+        return fingerprint.size
+
+    def _dump(self, fingerprint: RenderFingerprint, f: BinaryIO) -> None:
+        f.write(fingerprint_to_json(fingerprint))
+
+    def _load(self, f: BinaryIO) -> RenderFingerprint:
+        return fingerprint_from_json(f.read())
+
+
+# 进程内共享的渲染指纹存储
+fingerprint_store = FingerprintStore(
+    max_size=RERENDER_CACHE_MAX_SIZE,
+    ttl=RERENDER_CACHE_TTL,
+    disk_dir=RERENDER_CACHE_DIR,
+    disk_max_size=RERENDER_CACHE_DISK_MAX_SIZE,
+)
@@ -0,0 +1,481 @@
+# app/services/render_jobs.py
+import asyncio
+import io
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from collections import OrderedDict
+from typing import BinaryIO, Dict, List, Optional
+
+from app.config import (
+    JOB_DIR,
+    JOB_MEMORY_MAX_SIZE,
+    JOB_QUEUE_MAX_DEPTH,
+    JOB_RESULT_TTL,
+    JOB_RETRY_AFTER,
+    JOB_SHARED_DIR,
+    JOB_WORKERS,
+    OUTPUT_CHUNK_SIZE,
+)
+from app.logging_config import DETAIL, log_summary
+from app.services.admission import admit_render, render_admission
+from app.services.metrics import RenderStats, record_job, record_render
+from app.services.render_pool import (
+    RenderTimeoutError,
+    get_sheet_limits,
+    render_in_pool,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 任务优先级，数值小的先执行
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+# 任务编号为uuid4的十六进制形式，文件存储据此拼接路径
+_JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# 任务耗时的指数移动平均系数，用于估算Retry-After
+_DURATION_SMOOTHING = 0.2
+# 清理过期任务的最大间隔（秒）
+_EVICT_INTERVAL = 60
+
+
+class JobQueueFullError(Exception):
+    """任务队列已满，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"渲染任务队列已满，请{retry_after}秒后重试")
+        self.retry_after = retry_after
+
+
+@dataclass
+class RenderJob:
+    """渲染任务的状态，不含请求数据与渲染结果"""
+
+    job_id: str
+    template_type: str
+    notice_no: str
+    filename: str
+    project_count: int
+    priority: str
+    status: str = JOB_QUEUED
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    size: Optional[int] = None
+    pid: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class MemoryJobStore:
+    """
+    任务状态与渲染结果保存在本进程内存中。渲染结果合计不超过max_size字节，
+    超出时按完成顺序删除最早的结果，之后下载该任务的结果返回已过期。
+    """
+
+    blocking = False
+
+    def __init__(self, max_size: int = JOB_MEMORY_MAX_SIZE):
+        self.max_size = max_size
+        self._jobs: Dict[str, RenderJob] = {}
+        self._artifacts: "OrderedDict[str, bytes]" = OrderedDict()
+        self._artifacts_size = 0
+        self._lock = threading.Lock()
+
+    def save(self, job: RenderJob) -> None:
+        with self._lock:
+            self._jobs[job.job_id] = job
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def save_artifact(self, job_id: str, buffer: BinaryIO) -> int:
+        content = buffer.read()
+        if len(content) > self.max_size:
+            raise ValueError(
+                f"渲染结果{len(content)}字节，超过内存中保存的上限{self.max_size}字节"
+            )
+        with self._lock:
+            self._artifacts[job_id] = content
+            self._artifacts_size += len(content)
+            while self._artifacts_size > self.max_size:
+                _, evicted = self._artifacts.popitem(last=False)
+                self._artifacts_size -= len(evicted)
+        return len(content)
+
+    def open_artifact(self, job_id: str) -> Optional[BinaryIO]:
+        with self._lock:
+            content = self._artifacts.get(job_id)
+        return io.BytesIO(content) if content is not None else None
+
+    def evict(self, cutoff: float) -> int:
+        """删除在cutoff之前完成的任务及其渲染结果，返回删除的数量"""
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished and job.finished_at <= cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                content = self._artifacts.pop(job_id, None)
+                if content is not None:
+                    self._artifacts_size -= len(content)
+        return len(expired)
+
+
+class FileJobStore:
+    """
+    任务状态（JSON）与渲染结果（xlsx）保存在目录中，同一主机的多个服务进程共享。
+    任务只在提交它的进程中执行，其他进程可以查询状态、下载结果。
+    """
+
+    blocking = True
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _write_atomic(self, path: str, write) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+
+    def save(self, job: RenderJob) -> None:
+        content = json.dumps(job.to_dict(), ensure_ascii=False).encode("utf-8")
+        self._write_atomic(self._path(job.job_id, ".json"), lambda f: f.write(content))
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        if not _JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id, ".json"), "rb") as f:
+                return RenderJob(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("[渲染任务] 读取任务状态失败: %s - %s", job_id, e)
+            return None
+
+    def save_artifact(self, job_id: str, buffer: BinaryIO) -> int:
+        self._write_atomic(
+            self._path(job_id, ".xlsx"),
+            lambda f: shutil.copyfileobj(buffer, f, OUTPUT_CHUNK_SIZE),
+        )
+        return os.path.getsize(self._path(job_id, ".xlsx"))
+
+    def open_artifact(self, job_id: str) -> Optional[BinaryIO]:
+        if not _JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            return open(self._path(job_id, ".xlsx"), "rb")
+        except FileNotFoundError:
+            return None
+
+    def evict(self, cutoff: float) -> int:
+        """
+        删除在cutoff之前完成的任务及其渲染结果，返回删除的数量。
+        执行任务的进程已退出时，其未完成的任务标记为失败，之后按同样的规则删除。
+        """
+        removed = 0
+        for entry in os.scandir(self.directory):
+            job_id, _, suffix = entry.name.partition(".")
+            if suffix != "json":
+                continue
+            job = self.get(job_id)
+            if job is None:
+                continue
+            if not job.finished:
+                if not _process_exists(job.pid):
+                    job.status = JOB_FAILED
+                    job.error = "执行任务的服务进程已退出"
+                    job.finished_at = time.time()
+                    self.save(job)
+                continue
+            if job.finished_at <= cutoff:
+                self._unlink(self._path(job_id, ".xlsx"))
+                self._unlink(entry.path)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    有界的渲染任务队列：按优先级、同优先级按提交顺序执行，由若干协程工作者
+    将任务交给渲染池。队列已满时拒绝提交，已完成的任务超过保留时间后删除。
+    """
+
+    def __init__(self, store, max_depth: int, workers: int, result_ttl: int):
+        self.store = store
+        self.max_depth = max_depth
+        self.workers = max(1, workers)
+        self.result_ttl = result_ttl
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._average_seconds = float(JOB_RETRY_AFTER)
+
+    async def _call(self, func, *args):
+        """访问任务存储，文件存储在线程池中执行以免阻塞事件循环"""
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        """按排队与执行中的任务数量、平均任务耗时估算的等待秒数"""
+        pending = self.depth + self._running
+        seconds = self._average_seconds * max(1, pending) / self.workers
+        return max(1, math.ceil(seconds))
+
+    async def start(self) -> None:
+        """启动工作者与过期任务清理，服务启动时调用"""
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_depth)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"render-job-{index}")
+            for index in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._evict_loop(), name="job-evict"))
+        logger.info(
+            "[渲染任务] 任务队列已启动，工作者: %d，最大长度: %d",
+            self.workers,
+            self.max_depth,
+        )
+
+    async def stop(self) -> None:
+        """停止工作者，尚未执行的任务标记为失败，服务关闭时调用"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queue is None:
+            return
+        while not self._queue.empty():
+            *_, job, _, _ = self._queue.get_nowait()
+            await self._finish(job, JOB_FAILED, error="服务已停止，任务未执行")
+        self._queue = None
+
+    async def submit(self, job: RenderJob, template_path: str, context: dict) -> None:
+        """提交任务，队列已满时抛出JobQueueFullError"""
+        if self._queue is None:
+            raise RuntimeError("渲染任务队列未启动")
+        if self._queue.full():
+            record_job(job.template_type, "rejected")
+            raise JobQueueFullError(self.retry_after())
+
+        job.status = JOB_QUEUED
+        job.created_at = time.time()
+        job.pid = os.getpid()
+        await self._call(self.store.save, job)
+        # 保存状态期间队列可能被其他请求填满
+        try:
+            self._queue.put_nowait(
+                (
+                    JOB_PRIORITIES[job.priority],
+                    next(self._sequence),
+                    job,
+                    template_path,
+                    context,
+                )
+            )
+        except asyncio.QueueFull:
+            await self._finish(job, JOB_FAILED, error="渲染任务队列已满")
+            record_job(job.template_type, "rejected")
+            raise JobQueueFullError(self.retry_after()) from None
+        record_job(job.template_type, "submitted")
+        logger.log(
+            DETAIL,
+            "[渲染任务] 任务已提交: %s，优先级: %s，队列长度: %d",
+            job.job_id,
+            job.priority,
+            self.depth,
+        )
+
+    async def get(self, job_id: str) -> Optional[RenderJob]:
+        return await self._call(self.store.get, job_id)
+
+    async def open_artifact(self, job_id: str) -> Optional[BinaryIO]:
+        return await self._call(self.store.open_artifact, job_id)
+
+    async def _finish(self, job: RenderJob, status: str, error: str = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        await self._call(self.store.save, job)
+
+    async def _worker(self) -> None:
+        while True:
+            *_, job, template_path, context = await self._queue.get()
+            self._running += 1
+            try:
+                await self._run(job, template_path, context)
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: RenderJob, template_path: str, context: dict) -> None:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        await self._call(self.store.save, job)
+        logger.log(DETAIL, "[渲染任务] 开始执行任务: %s", job.job_id)
+
+        stats = RenderStats()
+        status_code = 500
+        try:
+            # 任务不会因内存预算不足被拒绝，等到预算足够时再执行
+            sheet_limits = get_sheet_limits(job.template_type)
+            admission = await admit_render(
+                job.template_type, template_path, context, sheet_limits, wait=True
+            )
+            # 预留的内存在渲染池中的任务真正结束后归还，超时后仍在运行的任务继续占用预算
+            buffer, stats = await render_in_pool(
+                template_path,
+                context,
+                sheet_limits=sheet_limits,
+                engine=admission.engine,
+                on_done=lambda: render_admission.release(admission),
+            )
+            # 渲染结果可能已溢出到临时文件，内存存储读取时同样在线程池中进行
+            try:
+                job.size = await asyncio.to_thread(
+                    self.store.save_artifact, job.job_id, buffer
+                )
+            finally:
+                buffer.close()
+            status_code = 200
+            await self._finish(job, JOB_SUCCEEDED)
+        except asyncio.CancelledError:
+            await self._finish(job, JOB_FAILED, error="服务已停止，任务被中断")
+            raise
+        except RenderTimeoutError as e:
+            logger.error("[渲染任务] 任务渲染超时: %s - %s", job.job_id, e)
+            status_code = 504
+            await self._finish(job, JOB_FAILED, error=f"渲染Excel超时: {str(e)}")
+        except Exception as e:
+            logger.error(
+                "[渲染任务] 任务执行失败: %s - %s", job.job_id, e, exc_info=True
+            )
+            await self._finish(job, JOB_FAILED, error=f"渲染Excel时发生错误: {str(e)}")
+        finally:
+            duration = time.time() - job.started_at
+            if status_code == 200:
+                self._average_seconds += _DURATION_SMOOTHING * (
+                    duration - self._average_seconds
+                )
+            record_job(job.template_type, job.status)
+            record_render(
+                job.template_type,
+                job.project_count,
+                status_code,
+                duration,
+                stats=stats if stats.stages else None,
+            )
+            log_summary(
+                logger,
+                request_id=job.job_id,
+                job=True,
+                template_type=job.template_type,
+                notice_no=job.notice_no,
+                projects=job.project_count,
+                priority=job.priority,
+                status=status_code,
+                engine=stats.engine,
+                size=job.size,
+                queued_ms=round((job.started_at - job.created_at) * 1000, 1),
+                duration_ms=round(duration * 1000, 1),
+            )
+
+    async def _evict_loop(self) -> None:
+        interval = max(1, min(self.result_ttl, _EVICT_INTERVAL))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self._call(
+                    self.store.evict, time.time() - self.result_ttl
+                )
+            except OSError as e:
+                logger.warning("[渲染任务] 清理过期任务失败: %s", e)
+                continue
+            if removed:
+                logger.log(DETAIL, "[渲染任务] 已删除%d个过期任务", removed)
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _default_store():
+    """
+    未设置JOB_DIR时任务保存在内存中，只有提交任务的进程能查询与下载。
+    服务以多个工作进程运行（uvicorn --workers，工作进程由主进程启动）时，
+    后续请求多半落到其他进程，因此改用同一主机共享的JOB_SHARED_DIR。
+    """
+    if JOB_DIR:
+        return FileJobStore(JOB_DIR)
+    if multiprocessing.parent_process() is not None:
+        logger.warning(
+            "[渲染任务] 服务以多个工作进程运行且未设置JOB_DIR，任务保存在: %s",
+            JOB_SHARED_DIR,
+        )
+        return FileJobStore(JOB_SHARED_DIR)
+    return MemoryJobStore()
+
+
+# 进程内共享的渲染任务队列
+job_queue = JobQueue(
+    _default_store(),
+    max_depth=JOB_QUEUE_MAX_DEPTH,
+    workers=JOB_WORKERS,
+    result_ttl=JOB_RESULT_TTL,
+)
@@ -0,0 +1,689 @@
+# app/services/render_pool.py
+import asyncio
+import concurrent.futures
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from app.config import (
+    OUTPUT_SPOOL_MAX_SIZE,
+    RENDER_ENGINE,
+    RENDER_EXECUTOR,
+    RENDER_POOL_SIZE,
+    RENDER_TIMEOUT,
+    SHEET_LIMITS,
+    SHEET_MAX_PROJECTS,
+    SHEET_MAX_ROWS,
+    STREAMING_THRESHOLD,
+    WARMUP_PROJECTS,
+)
+from app.logging_config import DETAIL, configure_logging
+from app.models.notice import sample_notice_data
+from app.services.excel_renderer import render_excel_template, save_workbook_to_buffer
+from app.services.metrics import RenderStats, timed
+from app.services.profiling import merge_profiles, new_snapshot_path, run_profiled
+from app.services.render_deadline import (
+    RenderCancelledError,
+    RenderTimeoutError,
+    render_deadline,
+)
+from app.services.streaming_renderer import render_excel_template_streaming
+from app.services.xml_patch_renderer import (
+    plan_sheet_partitions,
+    render_excel_template_patch,
+    render_sheet_entry,
+    supports_patch,
+    write_partitioned_workbook,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 等待渲染结果时检查客户端连接状态的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class TemplateWarmupError(Exception):
+    """启动时预加载或预热渲染模板失败"""
+
+
+def select_engine(template_path: str, context: dict) -> str:
+    """
+    根据配置、模板结构与项目数量选择渲染引擎：patch、streaming 或 openpyxl。
+    模板不支持XML改写时回退到其余两种引擎。
+    """
+    if RENDER_ENGINE in ("auto", "patch") and supports_patch(template_path):
+        return "patch"
+    if RENDER_ENGINE == "patch":
+        logger.warning(
+            "[渲染池] 模板不支持XML改写引擎，改用openpyxl引擎: %s", template_path
+        )
+        return "openpyxl"
+    if RENDER_ENGINE == "streaming":
+        return "streaming"
+    if RENDER_ENGINE == "auto" and STREAMING_THRESHOLD > 0:
+        if len(context.get("projects") or []) >= STREAMING_THRESHOLD:
+            return "streaming"
+    return "openpyxl"
+
+
+# 渲染引擎按内存占用从高到低排列
+_ENGINE_MEMORY_ORDER = ("openpyxl", "patch", "streaming")
+
+
+def render_engine_candidates(
+    template_path: str,
+    context: dict,
+    sheet_limits: Optional[Tuple[int, int]] = None,
+) -> List[str]:
+    """
+    返回本次渲染可以使用的引擎：第一项为select_engine的选择，其余为内存占用依次更低、
+    内存预算不足时可以改用的引擎。需要拆分为多个工作表时只能使用XML改写引擎。
+    """
+    if (
+        sheet_limits is not None
+        and plan_sheet_partitions(template_path, context, *sheet_limits) is not None
+    ):
+        return ["patch"]
+    engine = select_engine(template_path, context)
+    lower = _ENGINE_MEMORY_ORDER[_ENGINE_MEMORY_ORDER.index(engine) + 1 :]
+    return [engine] + [
+        candidate
+        for candidate in lower
+        if candidate != "patch" or supports_patch(template_path)
+    ]
+
+
+def select_stream_engine(template_path: str) -> str:
+    """项目以迭代器逐行传入时只能使用单次遍历的引擎：patch，模板不支持时为streaming"""
+    return "patch" if supports_patch(template_path) else "streaming"
+
+
+def _render_to_buffer(
+    template_path: str,
+    context: dict,
+    stats: Optional[RenderStats] = None,
+    engine: Optional[str] = None,
+    compresslevel: Optional[int] = None,
+):
+    """
+    渲染并序列化到有界缓冲区，传入stats时记录所用引擎与各阶段耗时。
+    compresslevel为输出文件的压缩级别，未指定时使用OUTPUT_COMPRESSLEVEL。
+    """
+    # 选择引擎时会加载并编译模板，耗时计入template_load
+    if engine is None:
+        with timed(stats, "template_load"):
+            engine = select_engine(template_path, context)
+    if stats is not None:
+        stats.engine = engine
+    if engine == "openpyxl":
+        wb = render_excel_template(template_path, context, stats)
+        with timed(stats, "save"):
+            return save_workbook_to_buffer(
+                wb, OUTPUT_SPOOL_MAX_SIZE, template_path, compresslevel
+            )
+
+    render = (
+        render_excel_template_patch
+        if engine == "patch"
+        else render_excel_template_streaming
+    )
+    buffer = tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_MAX_SIZE)
+    try:
+        render(template_path, context, buffer, stats, compresslevel)
+    except Exception:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+def _render_to_bytes(
+    template_path: str,
+    context: dict,
+    stats: Optional[RenderStats] = None,
+    compresslevel: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> bytes:
+    """渲染结果需要跨进程传回时使用，返回字节串"""
+    with _render_to_buffer(
+        template_path, context, stats, engine, compresslevel
+    ) as buffer:
+        return buffer.read()
+
+
+def _render_buffer_job(
+    template_path: str,
+    context: dict,
+    compresslevel: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> tuple:
+    """线程池任务：返回 (缓冲区, 渲染统计)"""
+    stats = RenderStats()
+    buffer = _render_to_buffer(template_path, context, stats, engine, compresslevel)
+    return buffer, stats
+
+
+def _render_bytes_job(
+    template_path: str,
+    context: dict,
+    compresslevel: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> tuple:
+    """进程池任务：返回 (文件内容, 渲染统计)"""
+    stats = RenderStats()
+    return _render_to_bytes(template_path, context, stats, compresslevel, engine), stats
+
+
+def render_stream_to_buffer(
+    template_path: str, context: dict, stats: Optional[RenderStats] = None
+):
+    """渲染项目列表为迭代器的上下文，返回定位到开头的可读缓冲区"""
+    with timed(stats, "template_load"):
+        engine = select_stream_engine(template_path)
+    return _render_to_buffer(template_path, context, stats, engine)
+
+
+def warmup_render(template_path: str) -> dict:
+    """
+    用示例数据完整渲染一次模板：加载、编译模板并执行所选引擎的渲染与序列化，
+    使本进程的模板缓存与各模块的首次调用开销在处理请求前完成。
+    """
+    start = time.perf_counter()
+    stats = RenderStats()
+    context = sample_notice_data(WARMUP_PROJECTS)
+    with _render_to_buffer(template_path, context, stats) as buffer:
+        size = buffer.seek(0, os.SEEK_END)
+    return {
+        "engine": stats.engine,
+        "size": size,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def _init_worker(warmup_templates: Tuple[str, ...]) -> None:
+    """渲染进程的初始化：配置日志并预热所有模板，预热失败时进程池不可用"""
+    configure_logging()
+    for template_path in warmup_templates:
+        warmup_render(template_path)
+
+
+_executor: Optional[Executor] = None
+_stream_executor: Optional[Executor] = None
+_profile_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+# 渲染进程启动时预热的模板
+_warmup_templates: Tuple[str, ...] = ()
+
+
+def get_executor() -> Executor:
+    """获取（必要时创建）当前进程的渲染池"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if RENDER_EXECUTOR == "thread":
+                _executor = ThreadPoolExecutor(
+                    max_workers=RENDER_POOL_SIZE, thread_name_prefix="render"
+                )
+            else:
+                _executor = _new_process_pool(RENDER_POOL_SIZE)
+            logger.info(
+                "[渲染池] 已创建%s渲染池，工作者数量: %d",
+                RENDER_EXECUTOR,
+                RENDER_POOL_SIZE,
+            )
+        return _executor
+
+
+def _new_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """创建渲染进程池，工作进程在初始化时预热所有模板"""
+    start_methods = multiprocessing.get_all_start_methods()
+    method = "forkserver" if "forkserver" in start_methods else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_worker,
+        initargs=(_warmup_templates,),
+    )
+
+
+def get_profile_executor() -> Executor:
+    """
+    获取性能分析任务使用的渲染池。tracemalloc跟踪整个进程的内存分配，
+    线程渲染池中同时运行的其他渲染会计入被分析请求的内存峰值与快照，
+    因此渲染池为线程池时，性能分析任务交给单独的单进程渲染池（首次使用时创建）。
+    渲染池本身为进程池时直接复用：每个工作进程同一时间只执行一个任务。
+    """
+    global _profile_executor
+    if RENDER_EXECUTOR != "thread":
+        return get_executor()
+    with _executor_lock:
+        if _profile_executor is None:
+            _profile_executor = _new_process_pool(1)
+            logger.info("[渲染池] 已创建性能分析使用的单进程渲染池")
+        return _profile_executor
+
+
+def get_stream_executor() -> Executor:
+    """
+    获取边接收边渲染任务使用的线程池：任务需要从事件循环拉取请求体，无法交给进程池。
+    渲染池本身为线程池时直接复用。
+    """
+    global _stream_executor
+    if RENDER_EXECUTOR == "thread":
+        return get_executor()
+    with _executor_lock:
+        if _stream_executor is None:
+            _stream_executor = ThreadPoolExecutor(
+                max_workers=RENDER_POOL_SIZE, thread_name_prefix="render-stream"
+            )
+        return _stream_executor
+
+
+def render_worker_pids() -> List[int]:
+    """
+    进程渲染池中已启动的工作进程号，尚未创建时为空。
+    渲染池为线程池时为性能分析使用的渲染进程（已创建时）。
+    """
+    executor = _profile_executor if RENDER_EXECUTOR == "thread" else _executor
+    if executor is None:
+        return []
+    return list(getattr(executor, "_processes", None) or ())
+
+
+def executor_broken() -> bool:
+    """渲染进程异常退出后进程池不再可用，所有渲染都会失败"""
+    return bool(getattr(_executor, "_broken", False))
+
+
+async def warmup_templates(template_paths: Dict[str, str]) -> Dict[str, dict]:
+    """
+    服务启动时调用：在本进程中逐个预加载、校验模板并用示例数据渲染一次，
+    再启动渲染池的全部工作者（进程池的每个工作进程在初始化时同样预热所有模板）。
+    任一模板缺失或无法渲染时抛出TemplateWarmupError。返回各模板的预热结果。
+    """
+    global _warmup_templates
+    report = {}
+    for template_type, template_path in template_paths.items():
+        try:
+            report[template_type] = await asyncio.to_thread(
+                warmup_render, template_path
+            )
+        except Exception as e:
+            raise TemplateWarmupError(
+                f"模板 '{template_type}' ({template_path}) 预热失败: {e}"
+            ) from e
+        logger.info(
+            "[渲染池] 模板预热完成: %s，引擎: %s，耗时%.3f秒",
+            template_type,
+            report[template_type]["engine"],
+            report[template_type]["seconds"],
+        )
+
+    _warmup_templates = tuple(template_paths.values())
+    if RENDER_EXECUTOR != "thread":
+        # 同时提交与工作者数量相同的任务，使进程池启动全部工作进程
+        try:
+            await asyncio.gather(
+                *(run_in_pool(os.getpid) for _ in range(RENDER_POOL_SIZE))
+            )
+        except Exception as e:
+            raise TemplateWarmupError(f"渲染进程预热失败: {e}") from e
+        logger.info("[渲染池] %d个渲染进程已完成预热", RENDER_POOL_SIZE)
+    return report
+
+
+def shutdown_executor() -> None:
+    """关闭渲染池，取消尚未开始的任务"""
+    global _executor, _stream_executor, _profile_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+            logger.info("[渲染池] 渲染池已关闭")
+        if _stream_executor is not None:
+            _stream_executor.shutdown(wait=True, cancel_futures=True)
+            _stream_executor = None
+        if _profile_executor is not None:
+            _profile_executor.shutdown(wait=True, cancel_futures=True)
+            _profile_executor = None
+
+
+class _PoolJobGroup:
+    """
+    一次渲染提交到渲染池的一组任务，全部真正结束后调用一次on_done。
+    超时或客户端断开后仍在运行的任务继续计入，直到其执行结束。
+    """
+
+    def __init__(self, on_done: Optional[Callable[[], None]]):
+        self._on_done = on_done
+        self._pending = 0
+        self._closed = False
+
+    def track(self) -> Callable[[], None]:
+        """登记一个即将提交的任务，返回该任务结束时调用的函数"""
+        self._pending += 1
+        return self._job_done
+
+    def _job_done(self) -> None:
+        self._pending -= 1
+        self._finish()
+
+    def close(self) -> None:
+        """不再提交新的任务"""
+        self._closed = True
+        self._finish()
+
+    def _finish(self) -> None:
+        if self._closed and self._pending == 0 and self._on_done is not None:
+            on_done, self._on_done = self._on_done, None
+            on_done()
+
+
+def _run_with_deadline(
+    deadline: float, cancelled: Optional[threading.Event], func: Callable, *args
+):
+    """渲染池任务：在截止时间与取消标志下执行func(*args)"""
+    with render_deadline(deadline, cancelled):
+        return func(*args)
+
+
+def _abandon(future, waiter, cancelled: Optional[threading.Event]) -> None:
+    """放弃任务：尚未开始的任务不再执行，线程中已在运行的任务在下一次检查时中止"""
+    future.cancel()
+    if cancelled is not None:
+        cancelled.set()
+    # 中止的任务以异常结束，结果已无人等待，取出异常避免事件循环报告未处理的异常
+    waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+async def run_in_pool(
+    func: Callable,
+    *args,
+    timeout: float = RENDER_TIMEOUT,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    executor: Optional[Executor] = None,
+    on_done: Optional[Callable[[], None]] = None,
+):
+    """
+    在渲染池中执行任务，事件循环在等待期间保持空闲。
+    超时或客户端断开时放弃任务：尚未开始的任务不再执行；已在运行的任务无法从外部中断，
+    渲染引擎在项目之间检查截止时间（提交时间加timeout），超时后在渲染池中自行中止，
+    因此RENDER_TIMEOUT同时限制任务占用渲染池的时间。线程渲染池中的任务在客户端断开后
+    也会在下一次检查时中止；进程渲染池中的任务运行到截止时间为止。
+    on_done在任务真正结束后（已在运行的任务被放弃时，等其执行完毕）于事件循环中调用，
+    任务未能提交时立即调用。
+    """
+    loop = asyncio.get_running_loop()
+    executor = executor or get_executor()
+    # 取消标志无法传给渲染进程，只用于线程执行的任务
+    cancelled = threading.Event() if isinstance(executor, ThreadPoolExecutor) else None
+    try:
+        future = executor.submit(
+            _run_with_deadline, time.time() + timeout, cancelled, func, *args
+        )
+    except BaseException:
+        if on_done is not None:
+            on_done()
+        raise
+    waiter = asyncio.wrap_future(future)
+    if on_done is not None:
+        waiter.add_done_callback(lambda _: on_done())
+    deadline = loop.time() + timeout
+
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            # 已在运行的任务按同一截止时间自行中止
+            _abandon(future, waiter, None)
+            raise RenderTimeoutError(f"渲染任务超过{timeout}秒未完成")
+
+        done, _ = await asyncio.wait(
+            {waiter}, timeout=min(DISCONNECT_POLL_INTERVAL, remaining)
+        )
+        if done:
+            return waiter.result()
+
+        if is_disconnected is not None and await is_disconnected():
+            _abandon(future, waiter, cancelled)
+            raise RenderCancelledError("客户端已断开连接")
+
+
+async def _run_render_job(
+    func: Callable,
+    *args,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    profile_id: Optional[str] = None,
+    part: int = 0,
+    group: Optional[_PoolJobGroup] = None,
+):
+    """
+    在渲染池中执行渲染任务。传入profile_id时在性能分析的渲染池中、
+    调用栈采样与内存跟踪下执行，返回 (任务结果, 性能分析结果)，否则性能分析结果为None。
+    传入group时任务计入该组，执行结束后通知该组。
+    """
+    on_done = group.track() if group is not None else None
+    if profile_id is None:
+        result = await run_in_pool(
+            func, *args, is_disconnected=is_disconnected, on_done=on_done
+        )
+        return result, None
+    return await run_in_pool(
+        run_profiled,
+        func,
+        args,
+        new_snapshot_path(profile_id, part),
+        is_disconnected=is_disconnected,
+        executor=get_profile_executor(),
+        on_done=on_done,
+    )
+
+
+def get_sheet_limits(template_type: str) -> Tuple[int, int]:
+    """返回模板类型对应的 (每个工作表的项目数量上限, 每个工作表的行数上限)"""
+    limits = SHEET_LIMITS.get(template_type) or {}
+    return (
+        int(limits.get("max_projects", SHEET_MAX_PROJECTS)),
+        int(limits.get("max_rows", SHEET_MAX_ROWS)),
+    )
+
+
+async def _render_partitioned_in_pool(
+    template_path: str,
+    context: dict,
+    list_name: str,
+    sizes: List[int],
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    compresslevel: Optional[int] = None,
+    profile_id: Optional[str] = None,
+    group: Optional[_PoolJobGroup] = None,
+) -> tuple:
+    """
+    将项目列表拆分到多个由模板复制出的工作表，各工作表分发到渲染池并行渲染，
+    再合并为一个工作簿。每个工作表的上下文额外包含sheet_index与sheet_count。
+    进行性能分析时各工作表依次渲染，避免同时运行的任务互相干扰。
+    """
+    logger.log(
+        DETAIL,
+        "[渲染池] %d个项目拆分为%d个工作表并行渲染",
+        sum(sizes),
+        len(sizes),
+    )
+    projects = context[list_name]
+    jobs = []
+    start = 0
+    for index, size in enumerate(sizes):
+        part = {
+            **context,
+            list_name: projects[start : start + size],
+            "sheet_index": index + 1,
+            "sheet_count": len(sizes),
+        }
+        start += size
+        jobs.append(
+            _run_render_job(
+                render_sheet_entry,
+                template_path,
+                part,
+                index == 0,
+                compresslevel,
+                is_disconnected=is_disconnected,
+                profile_id=profile_id,
+                part=index,
+                group=group,
+            )
+        )
+    if profile_id is None:
+        job_results = await asyncio.gather(*jobs)
+    else:
+        try:
+            job_results = [await job for job in jobs]
+        finally:
+            # 中途失败时关闭尚未执行的任务协程
+            for job in jobs:
+                job.close()
+    results = [result for result, _ in job_results]
+
+    # 各阶段耗时为所有工作表之和，即各工作者实际消耗的时间
+    stats = RenderStats(engine="patch")
+    for _, part_stats in results:
+        for stage, seconds in part_stats.stages.items():
+            stats.stages[stage] = stats.stages.get(stage, 0.0) + seconds
+    if profile_id is not None:
+        stats.profile = merge_profiles([profile for _, profile in job_results])
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_MAX_SIZE)
+    try:
+        with timed(stats, "save"):
+            await asyncio.to_thread(
+                write_partitioned_workbook,
+                template_path,
+                [entry for entry, _ in results],
+                buffer,
+                compresslevel,
+            )
+    except Exception:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer, stats
+
+
+async def render_in_pool(
+    template_path: str,
+    context: dict,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    sheet_limits: Optional[Tuple[int, int]] = None,
+    compresslevel: Optional[int] = None,
+    profile_id: Optional[str] = None,
+    engine: Optional[str] = None,
+    on_done: Optional[Callable[[], None]] = None,
+) -> tuple:
+    """
+    在渲染池中渲染模板并序列化，返回 (定位到开头的可读缓冲区, 渲染统计)。
+    传入sheet_limits且项目数量超出单个工作表的限制时，拆分为多个工作表并行渲染。
+    compresslevel为输出文件的压缩级别，未指定时使用OUTPUT_COMPRESSLEVEL。
+    传入profile_id时进行性能分析，结果记录在渲染统计的profile中。
+    engine指定不拆分渲染时使用的引擎，未指定时由select_engine选择。
+    on_done在本次提交到渲染池的任务全部真正结束后调用一次，超时或客户端断开时
+    也要等仍在运行的任务执行完毕，用于归还内存准入预留的内存。
+    """
+    group = _PoolJobGroup(on_done)
+    try:
+        if sheet_limits is not None:
+            partitions = await asyncio.to_thread(
+                plan_sheet_partitions, template_path, context, *sheet_limits
+            )
+            if partitions is not None:
+                return await _render_partitioned_in_pool(
+                    template_path,
+                    context,
+                    *partitions,
+                    is_disconnected=is_disconnected,
+                    compresslevel=compresslevel,
+                    profile_id=profile_id,
+                    group=group,
+                )
+
+        # 渲染结果由渲染进程传回时为字节串
+        in_thread = RENDER_EXECUTOR == "thread" and profile_id is None
+        job = _render_buffer_job if in_thread else _render_bytes_job
+        (output, stats), profile = await _run_render_job(
+            job,
+            template_path,
+            context,
+            compresslevel,
+            engine,
+            is_disconnected=is_disconnected,
+            profile_id=profile_id,
+            group=group,
+        )
+    finally:
+        group.close()
+    stats.profile = profile
+    if in_thread:
+        return output, stats
+    return io.BytesIO(output), stats
+
+
+async def run_stream_in_pool(
+    func: Callable[[Iterator[bytes]], Any],
+    body: AsyncIterator[bytes],
+    timeout: float = RENDER_TIMEOUT,
+    on_done: Optional[Callable[[], None]] = None,
+):
+    """
+    在线程中执行以请求体为输入的任务：func(chunks)每需要一块数据才从事件循环拉取，
+    请求体边接收边处理，不在内存中完整保留。超时后任务在下次拉取数据时中止。
+    on_done在线程中的任务真正结束后调用。
+    """
+    loop = asyncio.get_running_loop()
+    stopped = threading.Event()
+
+    async def next_chunk() -> Optional[bytes]:
+        try:
+            return await body.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def chunks() -> Iterator[bytes]:
+        while True:
+            if stopped.is_set():
+                raise RenderCancelledError("渲染任务已取消")
+            future = asyncio.run_coroutine_threadsafe(next_chunk(), loop)
+            try:
+                chunk = future.result(timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise RenderTimeoutError(f"超过{timeout}秒未收到请求数据") from None
+            if chunk is None:
+                return
+            if chunk:
+                yield chunk
+
+    try:
+        return await run_in_pool(
+            func,
+            chunks(),
+            timeout=timeout,
+            executor=get_stream_executor(),
+            on_done=on_done,
+        )
+    finally:
+        stopped.set()
@@ -0,0 +1,211 @@
+# app/services/sized_store.py
+import logging
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 磁盘层两次清理之间的最长间隔（秒）
+DISK_PRUNE_INTERVAL = 60
+# 自上次清理以来写入的字节数超过磁盘层上限的该比例时提前清理，限制超出上限的幅度
+DISK_PRUNE_WRITE_RATIO = 1 / 16
+
+
+@dataclass
+class _StoreEntry:
+    value: Any
+    size: int
+    expires_at: float
+
+
+class SizedStore(ABC):
+    """
+    按大小与过期时间限制的两层存储：内存中按LRU淘汰；可选的磁盘层在内存淘汰后
+    继续保留条目，并在同一主机的多个进程间共享。磁盘层按时间间隔或写入量定期清理，
+    而不是每次写入都扫描目录。子类通过_size_of、_dump与_load定义条目的大小与文件格式。
+    """
+
+    # 日志前缀
+    log_name = "存储"
+    # 磁盘文件的扩展名
+    disk_suffix = ".bin"
+    # 读取磁盘文件时视为文件损坏的异常（OSError之外）
+    load_errors: tuple = ()
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: int,
+        disk_dir: str = "",
+        disk_max_size: int = 0,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_size = disk_max_size
+        self._entries: "OrderedDict[str, _StoreEntry]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._written_since_prune = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and (self.max_size > 0 or bool(self.disk_dir))
+
+    @property
+    def has_disk_tier(self) -> bool:
+        return bool(self.disk_dir)
+
+    @abstractmethod
+    def _size_of(self, value) -> int:
+        """条目在内存层中计入的字节数"""
+
+    @abstractmethod
+    def _dump(self, value, f: BinaryIO) -> None:
+        """将条目写入磁盘文件"""
+
+    @abstractmethod
+    def _load(self, f: BinaryIO):
+        """从磁盘文件读取条目，文件损坏时抛出OSError或load_errors中的异常"""
+
+    def get(self, key: str):
+        """查找条目，过期视为不存在。磁盘命中时提升到内存层"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    return entry.value
+                self._remove(key)
+
+        if not self.disk_dir:
+            return None
+        value = self._read_disk(key, now)
+        if value is not None:
+            self._put_memory(key, value, now)
+        return value
+
+    def put(self, key: str, value) -> None:
+        """保存条目，替换同一键的旧条目"""
+        if not self.enabled:
+            return
+        self._put_memory(key, value, time.time())
+        if self.disk_dir:
+            self._write_disk(key, value)
+
+    def clear(self) -> None:
+        """清空内存层（磁盘层文件按过期时间自然失效）"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+
+    def _put_memory(self, key: str, value, now: float) -> None:
+        size = self._size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = _StoreEntry(value, size, now + self.ttl)
+            self._size += size
+            while self._size > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + self.disk_suffix)
+
+    def _read_disk(self, key: str, now: float) -> Optional[Any]:
+        path = self._disk_path(key)
+        try:
+            if os.stat(path).st_mtime + self.ttl <= now:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return self._load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, *self.load_errors) as e:
+            logger.warning("[%s] 读取磁盘文件失败: %s - %s", self.log_name, path, e)
+            return None
+
+    def _write_disk(self, key: str, value) -> None:
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    self._dump(value, f)
+                    written = f.tell()
+                os.replace(tmp_path, self._disk_path(key))
+            except BaseException:
+                self._unlink(tmp_path)
+                raise
+            if self._should_prune(written):
+                self._prune_disk()
+        except OSError as e:
+            logger.warning("[%s] 写入磁盘文件失败: %s", self.log_name, e)
+
+    def _should_prune(self, written: int) -> bool:
+        """距上次清理超过DISK_PRUNE_INTERVAL秒，或写入量达到磁盘层上限的一定比例时清理"""
+        now = time.monotonic()
+        with self._lock:
+            self._written_since_prune += written
+            if (
+                now - self._pruned_at < DISK_PRUNE_INTERVAL
+                and self._written_since_prune
+                < self.disk_max_size * DISK_PRUNE_WRITE_RATIO
+            ):
+                return False
+            self._pruned_at = now
+            self._written_since_prune = 0
+            return True
+
+    def _prune_disk(self) -> None:
+        """删除过期的磁盘文件，总大小超限时从最久未写入的文件开始删除"""
+        now = time.time()
+        files = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(self.disk_suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime + self.ttl <= now:
+                self._unlink(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_size:
+                break
+            self._unlink(path)
+            total -= size
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,315 @@
+# app/services/streaming_renderer.py
+import logging
+import time
+from array import array
+from copy import copy
+from typing import Optional
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils import get_column_letter
+from openpyxl.xml.functions import Element
+
+from app.services.excel_renderer import (
+    expand_item_rows,
+    render_cell_value,
+    render_loop_value,
+    render_scalar_value,
+)
+from app.logging_config import DETAIL
+from app.services.metrics import RenderStats, add_stage_time, timed
+from app.services.render_deadline import check_deadline
+from app.services.template_cache import get_compiled_template
+from app.services.zip_writer import save_workbook
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 从模板工作簿整体迁移到输出工作簿的样式表，单元格的样式编号因此可以直接沿用
+_STYLE_REGISTRIES = (
+    "_fonts",
+    "_alignments",
+    "_borders",
+    "_fills",
+    "_number_formats",
+    "_date_formats",
+    "_timedelta_formats",
+    "_protections",
+    "_colors",
+    "_cell_styles",
+    "_named_styles",
+    "_table_styles",
+    "_differential_styles",
+)
+
+# 直接沿用的工作表级设置（打印、页面、视图等）
+_SHEET_SETTINGS = (
+    "sheet_properties",
+    "sheet_format",
+    "views",
+    "page_setup",
+    "page_margins",
+    "print_options",
+    "protection",
+)
+
+
+class _MergedRanges:
+    """
+    以紧凑形式记录合并区域：模板中的合并区域只保存一次，
+    生成的行只记录 (输出行号, 模板行号) 两个整数。
+    """
+
+    def __init__(self, template_merges: dict):
+        self.template_merges = template_merges
+        self.fixed = []
+        self.rows = array("q")
+
+    def add_row(self, output_row: int, template_row: int) -> None:
+        if template_row in self.template_merges:
+            self.rows.append(output_row)
+            self.rows.append(template_row)
+
+    def __len__(self) -> int:
+        count = len(self.fixed)
+        for i in range(1, len(self.rows), 2):
+            count += len(self.template_merges[self.rows[i]])
+        return count
+
+    def __iter__(self):
+        yield from self.fixed
+        for i in range(0, len(self.rows), 2):
+            output_row, template_row = self.rows[i], self.rows[i + 1]
+            for min_col, max_col, row_span in self.template_merges[template_row]:
+                yield (
+                    f"{get_column_letter(min_col)}{output_row}:"
+                    f"{get_column_letter(max_col)}{output_row + row_span}"
+                )
+
+
+def _capture_rows(template_ws) -> dict:
+    """按模板行收集单元格 (列号, 值, 样式, 是否为合并单元格)，只读取已存在的单元格"""
+    rows = {}
+    for (row_idx, col_idx), cell in sorted(template_ws._cells.items()):
+        style = cell._style if cell.has_style else None
+        is_merged = isinstance(cell, MergedCell)
+        rows.setdefault(row_idx, []).append((col_idx, cell.value, style, is_merged))
+    return rows
+
+
+def _capture_merges(template_ws, loop_blocks: list) -> tuple:
+    """
+    将模板的合并区域分为两类：位于循环块内、需要随生成行复制的，以及其余固定区域。
+    固定区域记录为 (起始行, 结束行, 起始列, 结束列)。
+    """
+    block_rows = set()
+    for block in loop_blocks:
+        block_rows.update(range(block["start_row"], block["end_row"] + 1))
+
+    template_merges = {}
+    fixed = []
+    for mcr in template_ws.merged_cells.ranges:
+        if mcr.min_row in block_rows and mcr.max_row in block_rows:
+            template_merges.setdefault(mcr.min_row, []).append(
+                (mcr.min_col, mcr.max_col, mcr.max_row - mcr.min_row)
+            )
+        else:
+            fixed.append((mcr.min_row, mcr.max_row, mcr.min_col, mcr.max_col))
+    return template_merges, fixed
+
+
+def _prepare_workbook(template_wb, template_ws):
+    """创建只写工作簿，并迁移模板的样式表、列宽与工作表设置"""
+    wb = openpyxl.Workbook(write_only=True)
+    for name in _STYLE_REGISTRIES:
+        setattr(wb, name, getattr(template_wb, name))
+    wb.loaded_theme = template_wb.loaded_theme
+    wb._epoch = template_wb._epoch
+
+    ws = wb.create_sheet(template_ws.title)
+    for name in _SHEET_SETTINGS:
+        setattr(ws, name, getattr(template_ws, name))
+    ws.page_setup._parent = ws
+
+    for key, dim in template_ws.column_dimensions.items():
+        column_dim = copy(dim)
+        column_dim.parent = ws
+        ws.column_dimensions[key] = column_dim
+    return wb, ws
+
+
+def _stream_merged_cells(ws, merged: _MergedRanges) -> None:
+    """
+    替换只写工作表的合并区域写出方法，逐条写出而不是一次性构建完整的XML树。
+    """
+    writer = ws._writer
+
+    def write_merged_cells():
+        count = len(merged)
+        if not count:
+            return
+        xf = writer.xf.send(True)
+        with xf.element("mergeCells", {"count": str(count)}):
+            for ref in merged:
+                xf.write(Element("mergeCell", {"ref": ref}))
+        writer.xf.send(None)
+
+    writer.write_merged_cells = write_merged_cells
+
+
+def _discard_worksheet(ws) -> None:
+    """渲染中止时结束write_only工作表的写出，删除已写出行的临时文件"""
+    if ws._writer is None:
+        return
+    try:
+        ws.close()
+    finally:
+        ws._writer.cleanup()
+
+
+def render_excel_template_streaming(
+    template_path: str,
+    context: dict,
+    output,
+    stats: Optional[RenderStats] = None,
+    compresslevel: Optional[int] = None,
+) -> None:
+    """
+    流式渲染引擎：按行顺序读取模板并通过openpyxl的write_only模式写出到output。
+    每个项目的行在写出后即被丢弃，内存占用与项目数量基本无关。
+    保留样式、列宽、行高以及表头/表尾的合并单元格。
+    """
+    start_time = time.time()
+    logger.log(DETAIL, "[流式渲染器] 开始渲染模板: %s", template_path)
+
+    stage_start = time.perf_counter()
+    compiled = get_compiled_template(template_path)
+    template_wb = compiled.load_workbook()
+    template_ws = template_wb.active
+    template_max_row = template_ws.max_row
+
+    rows = _capture_rows(template_ws)
+    row_dims = dict(template_ws.row_dimensions.items())
+    wb, ws = _prepare_workbook(template_wb, template_ws)
+    stage_start = add_stage_time(stats, "template_load", stage_start)
+
+    loop_blocks = compiled.loop_blocks
+    template_merges, fixed_merges = _capture_merges(template_ws, loop_blocks)
+    add_stage_time(stats, "loop_scan", stage_start)
+
+    merged = _MergedRanges(template_merges)
+    output_row = 0
+
+    def write_row(template_row: int, scope: dict, render_value, columns=None):
+        nonlocal output_row
+        output_row += 1
+
+        cells = []
+        next_col = 1
+        for col_idx, value, style, is_merged in rows.get(template_row, ()):
+            if columns is not None and col_idx not in columns:
+                continue
+            while next_col < col_idx:
+                cells.append(None)
+                next_col += 1
+            cell = WriteOnlyCell(ws)
+            if not is_merged:
+                cell.value = render_cell_value(
+                    compiled, template_row, col_idx, value, scope, render_value
+                )[0]
+            if style is not None:
+                cell._style = copy(style)
+            cells.append(cell)
+            next_col += 1
+
+        # 行高在写出该行时生效，写出后立即移除，避免随行数增长
+        dim = row_dims.get(template_row)
+        if dim is not None:
+            row_dim = copy(dim)
+            row_dim.index = output_row
+            ws.row_dimensions[output_row] = row_dim
+        ws.append(cells)
+        ws.row_dimensions.pop(output_row, None)
+        merged.add_row(output_row, template_row)
+
+    # 循环块之外的行计入scalar_render，项目展开的行计入loop_expand
+    try:
+        row_mapping = []  # (模板起始行, 模板结束行, 行偏移量)，用于平移固定合并区域
+        template_row = 1
+        for block in loop_blocks:
+            offset = output_row + 1 - template_row
+            row_mapping.append((template_row, block["start_row"] - 1, offset))
+            with timed(stats, "scalar_render"):
+                for row_idx in range(template_row, block["start_row"]):
+                    write_row(row_idx, context, render_scalar_value)
+
+            columns = range(block["first_col"], block["last_col"] + 1)
+            project_list = context.get(block["list_name"]) or []
+            count = 0
+            with timed(stats, "loop_expand"):
+                for project_item in project_list:
+                    check_deadline()
+                    for row_idx, scope in expand_item_rows(
+                        block, project_item, context
+                    ):
+                        write_row(row_idx, scope, render_loop_value, columns)
+                    count += 1
+            logger.log(
+                DETAIL,
+                "[流式渲染器] 循环块 %s.%s: 写出%d个项目",
+                block["list_name"],
+                block["loop_var"],
+                count,
+            )
+            template_row = block["end_row"] + 1
+
+        offset = output_row + 1 - template_row
+        row_mapping.append((template_row, template_max_row, offset))
+        with timed(stats, "scalar_render"):
+            for row_idx in range(template_row, template_max_row + 1):
+                write_row(row_idx, context, render_scalar_value)
+    except BaseException:
+        _discard_worksheet(ws)
+        raise
+    stage_start = time.perf_counter()
+
+    def map_row(row_idx: int) -> int:
+        """将模板中循环块之外的行号映射为输出行号"""
+        row_offset = 0
+        for first, last, segment_offset in row_mapping:
+            if row_idx < first:
+                break
+            row_offset = segment_offset
+        return row_idx + row_offset
+
+    for min_row, max_row, min_col, max_col in fixed_merges:
+        merged.fixed.append(
+            f"{get_column_letter(min_col)}{map_row(min_row)}:"
+            f"{get_column_letter(max_col)}{map_row(max_row)}"
+        )
+
+    if template_ws.print_title_rows:
+        title_rows = template_ws._print_rows
+        ws.print_title_rows = (
+            f"{map_row(title_rows.min_row)}:{map_row(title_rows.max_row)}"
+        )
+    if template_ws._print_area.ranges:
+        ws.print_area = [
+            f"{get_column_letter(area.min_col)}{map_row(area.min_row)}:"
+            f"{get_column_letter(area.max_col)}{map_row(area.max_row)}"
+            for area in template_ws._print_area.ranges
+        ]
+
+    ws._get_writer()
+    _stream_merged_cells(ws, merged)
+    save_workbook(wb, output, template_path, compresslevel)
+    add_stage_time(stats, "save", stage_start)
+
+    elapsed_time = time.time() - start_time
+    logger.log(
+        DETAIL,
+        "[流式渲染器] 模板渲染完成，共写出%d行，耗时%.2f秒",
+        output_row,
+        elapsed_time,
+    )
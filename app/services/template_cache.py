@@ -0,0 +1,433 @@
+# app/services/template_cache.py
+import hashlib
+import io
+import logging
+import os
+import pickle
+import re
+import threading
+import math
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import openpyxl
+from jinja2 import BaseLoader, Environment, Template, TemplateSyntaxError
+from openpyxl.styles.numbers import is_date_format
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 正则表达式，用于匹配Jinja2的for循环的开始和结束
+FOR_START_PATTERN = re.compile(r"{%\s*for\s+(\w+)\s+in\s+(\w+(?:\.\w+)*)\s*%}")
+FOR_END_PATTERN = re.compile(r"{%\s*endfor\s*%}")
+# 按出现顺序同时匹配for与endfor，用于单次扫描配对循环块
+LOOP_TAG_PATTERN = re.compile(f"{FOR_START_PATTERN.pattern}|{FOR_END_PATTERN.pattern}")
+# 整个表达式只是一个变量或一层属性访问，如 {{ notice_no }}、{{ project.money }}
+SIMPLE_PLACEHOLDER_PATTERN = re.compile(
+    r"\{\{\s*([A-Za-z_]\w*)(?:\.([A-Za-z_]\w*))?\s*\}\}"
+)
+
+# 单元格数字格式的分类：text（文本格式@）、date（日期格式）或 general（其余格式）
+VALUE_KIND_TEXT = "text"
+VALUE_KIND_DATE = "date"
+VALUE_KIND_GENERAL = "general"
+
+# 进程内共享的Jinja2环境，编译结果缓存在各模板条目中
+jinja_env = Environment(loader=BaseLoader())
+
+
+def strip_loop_tags(value: str) -> str:
+    """去掉单元格中的for/endfor标记，只保留需要渲染的表达式"""
+    clean_value = FOR_START_PATTERN.sub("", value).strip()
+    return FOR_END_PATTERN.sub("", clean_value).strip()
+
+
+@dataclass(frozen=True)
+class TaggedCell:
+    """标签索引中的一个单元格：包含变量或循环标记"""
+
+    row: int
+    column: int
+    value: str
+    has_placeholder: bool
+    has_loop_tag: bool
+    value_kind: str = VALUE_KIND_GENERAL
+
+
+def value_kind(number_format: str) -> str:
+    """按单元格的数字格式判断写入值的方式"""
+    if number_format == "@":
+        return VALUE_KIND_TEXT
+    if is_date_format(number_format):
+        return VALUE_KIND_DATE
+    return VALUE_KIND_GENERAL
+
+
+def _parse_date(value: str):
+    """解析ISO格式的日期或日期时间字符串，无法解析时返回None"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed.date() if len(value) == 10 else parsed
+
+
+@dataclass(frozen=True)
+class FieldBinding:
+    """
+    简单变量单元格的直接取值器，不经过Jinja渲染：取值规则与Jinja相同
+    （变量不存在时为空），结果按单元格的数字格式写为原生类型——
+    数字保持数字，日期格式单元格中的日期字符串转换为日期，文本格式单元格一律写为字符串。
+    值为None时单元格为空。
+    """
+
+    name: str
+    attr: Optional[str]
+    kind: str
+
+    def value(self, scope: dict):
+        value = scope.get(self.name)
+        if self.attr is not None and value is not None:
+            if isinstance(value, dict):
+                value = value.get(self.attr)
+            else:
+                value = getattr(value, self.attr, None)
+
+        if value is None or isinstance(value, str):
+            if self.kind == VALUE_KIND_DATE and value:
+                return _parse_date(value) or value
+            return value
+        if self.kind == VALUE_KIND_TEXT:
+            return str(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value if math.isfinite(value) else str(value)
+        if isinstance(value, (date, datetime)) and self.kind == VALUE_KIND_DATE:
+            return value
+        return str(value)
+
+
+@dataclass
+class TagIndex:
+    """
+    模板标签索引：按行优先顺序记录所有含 {{、{% for 或 {% endfor %} 的单元格，
+    以及配对后的循环块。顶层循环块按文档顺序排列，嵌套循环块挂在父块的children下。
+    """
+
+    cells: List[TaggedCell] = field(default_factory=list)
+    loop_blocks: List[dict] = field(default_factory=list)
+
+    @property
+    def placeholders(self) -> List[TaggedCell]:
+        """所有包含变量的单元格"""
+        return [cell for cell in self.cells if cell.has_placeholder]
+
+    @property
+    def scalar_cells(self) -> List[TaggedCell]:
+        """
+        循环块所在行之外、只含变量不含语句标签的单元格，即渲染时需要以整个上下文
+        替换的普通变量。循环块所在的行在展开时整行重写，其中的单元格不在此列。
+        """
+        loop_rows = [(b["start_row"], b["end_row"]) for b in self.loop_blocks]
+        return [
+            cell
+            for cell in self.cells
+            if cell.has_placeholder
+            and "{%" not in cell.value
+            and not any(start <= cell.row <= end for start, end in loop_rows)
+        ]
+
+
+@dataclass
+class CompiledTemplate:
+    """
+    预编译的Excel模板：模板文件内容、工作簿快照、循环块布局以及已编译的Jinja2模板对象。
+    """
+
+    path: str
+    mtime_ns: int
+    size: int
+    sha256: str
+    content: bytes
+    snapshot: bytes
+    tag_index: TagIndex
+    templates: Dict[str, Optional[Template]] = field(default_factory=dict)
+    # (行号, 列号) -> 直接取值器，只覆盖整个单元格为简单变量的单元格
+    bindings: Dict[Tuple[int, int], FieldBinding] = field(default_factory=dict)
+
+    @property
+    def loop_blocks(self) -> List[dict]:
+        """顶层循环块，按文档顺序排列"""
+        return self.tag_index.loop_blocks
+
+    @property
+    def version(self) -> str:
+        """模板文件版本，即文件内容的哈希值"""
+        return self.sha256
+
+    def load_workbook(self) -> openpyxl.Workbook:
+        """从快照还原出一个可独立修改的工作簿副本"""
+        return pickle.loads(self.snapshot)
+
+    def get_template(self, source: str) -> Optional[Template]:
+        """
+        获取单元格表达式对应的已编译模板，语法错误时返回None。
+        """
+        try:
+            return self.templates[source]
+        except KeyError:
+            pass
+
+        try:
+            template = jinja_env.from_string(source)
+        except TemplateSyntaxError:
+            template = None
+        self.templates[source] = template
+        return template
+
+
+def build_tag_index(ws) -> TagIndex:
+    """
+    单次正向扫描工作表中已存在的单元格，建立标签索引，并用栈配对循环块。
+    """
+    index = TagIndex()
+    stack = []
+
+    for row_idx, col_idx in sorted(ws._cells):
+        value = ws._cells[row_idx, col_idx].value
+        if not isinstance(value, str) or "{" not in value:
+            continue
+
+        has_placeholder = "{{" in value
+        has_loop_tag = False
+
+        for match in LOOP_TAG_PATTERN.finditer(value):
+            has_loop_tag = True
+            loop_var, list_name = match.group(1), match.group(2)
+            if loop_var:
+                stack.append((row_idx, col_idx, loop_var, list_name))
+                continue
+
+            if not stack:
+                logger.warning(
+                    "[模板缓存] 单元格(%d, %d)中的endfor没有匹配的for，已忽略",
+                    row_idx,
+                    col_idx,
+                )
+                continue
+
+            start_row, start_col, start_var, start_list = stack.pop()
+            block = {
+                "start_row": start_row,
+                "end_row": row_idx,
+                "start_col": start_col,
+                "end_col": col_idx,
+                "loop_var": start_var,
+                "list_name": start_list,
+                "depth": len(stack),
+                "children": [],
+            }
+            # 内层循环先于外层闭合，闭合外层时收回其范围内的子块
+            siblings = index.loop_blocks
+            while siblings and siblings[-1]["depth"] > block["depth"]:
+                block["children"].insert(0, siblings.pop())
+            # 循环块覆盖的列范围包含所有嵌套子块
+            block["first_col"] = min(
+                [start_col, col_idx] + [c["first_col"] for c in block["children"]]
+            )
+            block["last_col"] = max(
+                [start_col, col_idx] + [c["last_col"] for c in block["children"]]
+            )
+            siblings.append(block)
+            logger.info(
+                "[模板缓存] 发现循环块: %s.%s (行%d-%d, 列%d-%d, 层级%d)",
+                start_list,
+                start_var,
+                start_row,
+                row_idx,
+                start_col,
+                col_idx,
+                block["depth"],
+            )
+
+        if has_placeholder or has_loop_tag:
+            index.cells.append(
+                TaggedCell(
+                    row_idx,
+                    col_idx,
+                    value,
+                    has_placeholder,
+                    has_loop_tag,
+                    value_kind(ws._cells[row_idx, col_idx].number_format),
+                )
+            )
+
+    for row_idx, col_idx, loop_var, list_name in stack:
+        logger.warning(
+            "[模板缓存] 单元格(%d, %d)中的循环 %s.%s 未闭合，已忽略",
+            row_idx,
+            col_idx,
+            list_name,
+            loop_var,
+        )
+
+    logger.info(
+        "[模板缓存] 标签索引建立完成，共%d个标记单元格，%d个顶层循环块",
+        len(index.cells),
+        len(index.loop_blocks),
+    )
+    return index
+
+
+def _compile_cells(index: TagIndex, compiled: CompiledTemplate) -> None:
+    """
+    预编译标签索引中所有包含变量的单元格；整个单元格为简单变量的，
+    另外生成直接取值器，渲染时不再经过Jinja。
+    """
+    loop_rows = set()
+    for block in index.loop_blocks:
+        loop_rows.update(range(block["start_row"], block["end_row"] + 1))
+
+    for cell in index.placeholders:
+        if cell.has_loop_tag or "{%" in cell.value:
+            source = strip_loop_tags(cell.value)
+            if not source:
+                continue
+            compiled.get_template(source)
+            # 循环块之外带语句标签的单元格按原样保留，不生成取值器
+            if cell.row not in loop_rows:
+                continue
+        else:
+            source = cell.value
+            compiled.get_template(source)
+
+        match = SIMPLE_PLACEHOLDER_PATTERN.fullmatch(source)
+        # 字面量（true、none等）、全局函数以及与dict方法同名的属性在Jinja中另有含义，交给Jinja处理
+        if (
+            match
+            and match.group(1).lower() not in ("true", "false", "none")
+            and match.group(1) not in jinja_env.globals
+            and not hasattr(dict, match.group(2) or "")
+        ):
+            compiled.bindings[cell.row, cell.column] = FieldBinding(
+                match.group(1), match.group(2), cell.value_kind
+            )
+
+
+def _compile_template(
+    template_path: str, stat: os.stat_result, content: bytes, sha256: str
+) -> CompiledTemplate:
+    """解析模板文件并生成预编译条目"""
+    start_time = time.time()
+
+    wb = openpyxl.load_workbook(io.BytesIO(content))
+    ws = wb.active
+    logger.info(
+        "[模板缓存] 模板文件加载成功: %s，工作表: %s，尺寸: %d行 x %d列",
+        template_path,
+        ws.title,
+        ws.max_row,
+        ws.max_column,
+    )
+
+    tag_index = build_tag_index(ws)
+    compiled = CompiledTemplate(
+        path=template_path,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        sha256=sha256,
+        content=content,
+        snapshot=pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL),
+        tag_index=tag_index,
+    )
+    _compile_cells(tag_index, compiled)
+
+    elapsed_time = time.time() - start_time
+    logger.info(
+        "[模板缓存] 模板编译完成: %s，编译了%d个表达式，"
+        "其中%d个单元格直接取值，耗时%.3f秒",
+        template_path,
+        len(compiled.templates),
+        len(compiled.bindings),
+        elapsed_time,
+    )
+    return compiled
+
+
+@dataclass
+class _TemplateVersion:
+    """未编译模板的版本记录"""
+
+    mtime_ns: int
+    size: int
+    sha256: str
+
+
+_cache: Dict[str, CompiledTemplate] = {}
+_cache_lock = threading.Lock()
+_versions: Dict[str, _TemplateVersion] = {}
+
+
+def get_compiled_template(template_path: str) -> CompiledTemplate:
+    """
+    获取模板的预编译条目。文件的修改时间或内容哈希变化时自动重新编译。
+    """
+    key = os.path.abspath(template_path)
+    stat = os.stat(key)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+        if (
+            cached is not None
+            and cached.mtime_ns == stat.st_mtime_ns
+            and cached.size == stat.st_size
+        ):
+            return cached
+
+        with open(key, "rb") as f:
+            content = f.read()
+        sha256 = hashlib.sha256(content).hexdigest()
+
+        if cached is not None and cached.sha256 == sha256:
+            # 仅修改时间变化，内容未变，沿用已编译的条目
+            cached.mtime_ns = stat.st_mtime_ns
+            cached.size = stat.st_size
+            return cached
+
+        if cached is not None:
+            logger.info("[模板缓存] 模板文件已变化，重新编译: %s", template_path)
+
+        compiled = _compile_template(template_path, stat, content, sha256)
+        _cache[key] = compiled
+        return compiled
+
+
+def get_template_version(template_path: str) -> str:
+    """
+    获取模板文件版本（内容哈希）而不编译模板。
+    优先沿用已编译条目的版本，文件未变化时不重复计算哈希。
+    """
+    key = os.path.abspath(template_path)
+    stat = os.stat(key)
+
+    with _cache_lock:
+        for entry in (_cache.get(key), _versions.get(key)):
+            if (
+                entry is not None
+                and entry.mtime_ns == stat.st_mtime_ns
+                and entry.size == stat.st_size
+            ):
+                return entry.sha256
+
+        with open(key, "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        _versions[key] = _TemplateVersion(stat.st_mtime_ns, stat.st_size, sha256)
+        return sha256
+
+
+def clear_template_cache() -> None:
+    """清空进程内的模板缓存"""
+    with _cache_lock:
+        _cache.clear()
+        _versions.clear()
@@ -0,0 +1,1086 @@
+# app/services/xml_patch_renderer.py
+import hashlib
+import io
+import logging
+import marshal
+import pickle
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections.abc import Sized
+from copy import copy
+from dataclasses import dataclass, field, replace
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape, unescape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, to_excel
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+from app.config import (
+    OUTPUT_CHUNK_SIZE,
+    OUTPUT_SPOOL_MAX_SIZE,
+    RERENDER_MIN_PROJECTS,
+)
+from app.services.excel_renderer import (
+    expand_item_rows,
+    resolve_loop_list,
+    render_loop_value,
+    render_scalar_value,
+)
+from app.logging_config import DETAIL
+from app.services.metrics import RenderStats, add_stage_time, timed
+from app.services.render_deadline import check_deadline
+from app.services.render_fingerprints import (
+    CompressedChunk,
+    LoopUnit,
+    RenderFingerprint,
+    fingerprint_store,
+    make_fingerprint_key,
+)
+from app.services.template_cache import (
+    CompiledTemplate,
+    FieldBinding,
+    get_compiled_template,
+)
+from app.services.zip_writer import (
+    ZipEntry,
+    ZipWriter,
+    compress_chunk,
+    compress_entry,
+    crc32_combine,
+    get_static_entry,
+    make_entry,
+    open_output_zip,
+    resolve_compresslevel,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 工作表XML中需要改写的部分
+_DIMENSION_PATTERN = re.compile(r'<dimension ref="([^"]*)"\s*/>')
+_SHEET_DATA_PATTERN = re.compile(r"<sheetData\s*/>|<sheetData>(.*?)</sheetData>", re.S)
+_MERGE_CELLS_PATTERN = re.compile(r"<mergeCells\b[^>]*>(.*?)</mergeCells>", re.S)
+_MERGE_CELL_PATTERN = re.compile(r'<mergeCell ref="([^"]+)"\s*/>')
+_ROW_PATTERN = re.compile(r"<row\b([^>]*?)(?:/>|>(.*?)</row>)", re.S)
+_CELL_PATTERN = re.compile(r"<c\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+_ATTR_PATTERN = re.compile(r'\s+([\w:]+)="([^"]*)"')
+_CELL_REF_PATTERN = re.compile(r"([A-Z]+)(\d+)$")
+_DATE1904_PATTERN = re.compile(r'<workbookPr\b[^>]*\bdate1904="(?:1|true)"')
+
+# 引用了行号、行插入后需要同步平移的元素，模板中出现时不使用本引擎
+_ROW_DEPENDENT_PATTERN = re.compile(
+    r"<(conditionalFormatting|dataValidations|hyperlinks|rowBreaks|autoFilter"
+    r"|tableParts|drawing|legacyDrawing)\b"
+)
+# 共享公式与数组公式带有区域引用，同样无法直接复制
+_RANGE_FORMULA_PATTERN = re.compile(r"<f\b[^>]*\bref=")
+_WORKSHEET_PART_PATTERN = re.compile(r"xl/worksheets/[^/]+\.xml$")
+
+# 本地文件头：固定30字节，文件名与扩展字段长度位于最后4字节
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_LOCAL_HEADER_SIZE = 30
+_ENCRYPTED_FLAG = 0x01
+
+# 工作表XML每累积这么多行编码写出一次
+_FLUSH_ROWS = 512
+
+# 增量渲染时项目行XML中行号的占位符，单元格内容中不允许出现该字符
+_ROW_PLACEHOLDER = "\x00"
+_ROW_PLACEHOLDER_BYTES = _ROW_PLACEHOLDER.encode("ascii")
+# 增量渲染时工作表XML按分块独立压缩：在摘要满足该掩码的项目之后结束分块（平均每64个项目），
+# 分块边界由项目内容决定，修改个别项目不会改变其余分块的划分
+_CHUNK_BOUNDARY_MASK = 0x3F
+# 单个分块（未压缩）的最大字节数
+_CHUNK_MAX_BYTES = 1024 * 1024
+
+
+class PatchNotSupportedError(Exception):
+    """模板包含本引擎无法处理的结构"""
+
+
+@dataclass
+class TemplateCell:
+    """
+    模板中的一个单元格：保留原样写出时的XML片段，
+    以及写入渲染结果时沿用的属性（去掉了r与t）。
+    """
+
+    column: int
+    letter: str
+    raw_tail: str
+    attrs: str
+    value: Optional[str] = None
+    binding: Optional[FieldBinding] = None
+
+
+@dataclass
+class PatchPlan:
+    """
+    模板压缩包的改写方案：除工作表外的部分内容不变，按输出的压缩级别缓存压缩结果，
+    工作表XML拆分为表头、行模板、合并区域与表尾。
+    """
+
+    entries: List[ZipEntry]
+    sheet_name: str
+    head_before_dimension: str
+    head_after_dimension: str
+    tail_before_merges: str
+    tail_after_merges: str
+    rows: Dict[int, Tuple[str, List[TemplateCell]]]
+    max_row: int
+    min_col: int
+    max_col: int
+    template_merges: Dict[int, list] = field(default_factory=dict)
+    fixed_merges: List[tuple] = field(default_factory=list)
+    # 日期写为序列号时使用的纪元，取决于工作簿的date1904设置
+    epoch: object = CALENDAR_WINDOWS_1900
+    # 工作表以外各部件解压后的内容
+    static_parts: Dict[str, bytes] = field(default_factory=dict)
+    # 循环块内各行复制合并区域时使用的 (格式串, 最大跨行数)，参数为起始行号起的各行号
+    merge_formats: Dict[int, tuple] = field(default_factory=dict)
+
+
+def _read_entries(content: bytes) -> List[ZipEntry]:
+    """读取压缩包的全部条目，保留各条目未解压的压缩数据"""
+    entries = []
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        for info in zf.infolist():
+            if info.flag_bits & _ENCRYPTED_FLAG:
+                raise PatchNotSupportedError(f"条目已加密: {info.filename}")
+            offset = info.header_offset
+            header = content[offset : offset + _LOCAL_HEADER_SIZE]
+            if header[:4] != _LOCAL_HEADER_SIGNATURE:
+                raise PatchNotSupportedError(f"本地文件头无效: {info.filename}")
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            start = offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+            entries.append(ZipEntry(info, content[start : start + info.compress_size]))
+    return entries
+
+
+def _split_attrs(attrs: str, exclude: tuple) -> str:
+    """去掉指定属性，其余属性原样保留"""
+    return "".join(
+        f' {name}="{value}"'
+        for name, value in _ATTR_PATTERN.findall(attrs)
+        if name not in exclude
+    )
+
+
+def _parse_rows(
+    sheet_data: str, values: dict, bindings: dict
+) -> Dict[int, Tuple[str, list]]:
+    """将sheetData拆分为按行号索引的 (行属性, 单元格列表)"""
+    rows = {}
+    for row_match in _ROW_PATTERN.finditer(sheet_data):
+        row_attrs = dict(_ATTR_PATTERN.findall(row_match.group(1)))
+        if "r" not in row_attrs:
+            raise PatchNotSupportedError("行缺少行号属性")
+        row_idx = int(row_attrs["r"])
+
+        cells = []
+        for cell_match in _CELL_PATTERN.finditer(row_match.group(2) or ""):
+            attrs, inner = cell_match.group(1), cell_match.group(2)
+            ref = dict(_ATTR_PATTERN.findall(attrs)).get("r", "")
+            ref_match = _CELL_REF_PATTERN.match(ref)
+            if ref_match is None:
+                raise PatchNotSupportedError(f"单元格引用无效: {ref!r}")
+            letter = ref_match.group(1)
+            column = range_boundaries(f"{letter}1")[0]
+
+            raw_attrs = _split_attrs(attrs, ("r",))
+            raw_tail = (
+                f'"{raw_attrs}/>' if inner is None else f'"{raw_attrs}>{inner}</c>'
+            )
+            cells.append(
+                TemplateCell(
+                    column=column,
+                    letter=letter,
+                    raw_tail=raw_tail,
+                    attrs=_split_attrs(attrs, ("r", "t")),
+                    value=values.get((row_idx, column)),
+                    binding=bindings.get((row_idx, column)),
+                )
+            )
+        rows[row_idx] = (_split_attrs(row_match.group(1), ("r",)), cells)
+    return rows
+
+
+def _parse_merges(merge_refs: list, loop_blocks: list) -> tuple:
+    """
+    将模板的合并区域分为两类：位于循环块内、需要随生成行复制的，以及其余固定区域。
+    """
+    block_rows = set()
+    for block in loop_blocks:
+        block_rows.update(range(block["start_row"], block["end_row"] + 1))
+
+    template_merges = {}
+    fixed = []
+    for ref in merge_refs:
+        min_col, min_row, max_col, max_row = range_boundaries(ref)
+        if min_row in block_rows and max_row in block_rows:
+            template_merges.setdefault(min_row, []).append(
+                (min_col, max_col, max_row - min_row)
+            )
+        else:
+            fixed.append((min_row, max_row, min_col, max_col))
+    return template_merges, fixed
+
+
+def _merge_formats(template_merges: Dict[int, list]) -> Dict[int, tuple]:
+    """预先生成循环块内各行合并区域的XML格式串，避免逐个区域拼接列字母"""
+    formats = {}
+    for row, merges in template_merges.items():
+        merge_format = "".join(
+            f'<mergeCell ref="{get_column_letter(min_col)}{{0}}:'
+            f'{get_column_letter(max_col)}{{{row_span}}}"/>'
+            for min_col, max_col, row_span in merges
+        )
+        formats[row] = (merge_format, max(row_span for _, _, row_span in merges))
+    return formats
+
+
+def build_patch_plan(compiled: CompiledTemplate) -> PatchPlan:
+    """解析模板压缩包，生成改写方案。模板结构不受支持时抛出PatchNotSupportedError"""
+    entries = _read_entries(compiled.content)
+    names = {entry.info.filename: entry for entry in entries}
+
+    sheet_names = [name for name in names if _WORKSHEET_PART_PATTERN.match(name)]
+    if len(sheet_names) != 1:
+        raise PatchNotSupportedError(f"仅支持单工作表模板，实际为{len(sheet_names)}个")
+    sheet_name = sheet_names[0]
+
+    with zipfile.ZipFile(io.BytesIO(compiled.content)) as zf:
+        sheet_xml = zf.read(sheet_name).decode("utf-8")
+        workbook_xml = zf.read("xl/workbook.xml").decode("utf-8")
+        static_parts = {name: zf.read(name) for name in names if name != sheet_name}
+
+    if "<definedNames" in workbook_xml:
+        raise PatchNotSupportedError("工作簿包含定义名称（如打印区域）")
+    dependent = _ROW_DEPENDENT_PATTERN.search(sheet_xml)
+    if dependent:
+        raise PatchNotSupportedError(f"工作表包含{dependent.group(1)}")
+    if _RANGE_FORMULA_PATTERN.search(sheet_xml):
+        raise PatchNotSupportedError("工作表包含共享公式或数组公式")
+
+    sheet_data = _SHEET_DATA_PATTERN.search(sheet_xml)
+    dimension = (
+        _DIMENSION_PATTERN.search(sheet_xml, 0, sheet_data.start())
+        if sheet_data
+        else None
+    )
+    if sheet_data is None or dimension is None:
+        raise PatchNotSupportedError("未找到sheetData或dimension元素")
+
+    values = {(cell.row, cell.column): cell.value for cell in compiled.tag_index.cells}
+    rows = _parse_rows(sheet_data.group(1) or "", values, compiled.bindings)
+    min_col, _, max_col, _ = range_boundaries(dimension.group(1))
+
+    tail = sheet_xml[sheet_data.end() :]
+    merge_cells = _MERGE_CELLS_PATTERN.search(tail)
+    merge_refs = (
+        _MERGE_CELL_PATTERN.findall(merge_cells.group(1)) if merge_cells else []
+    )
+    template_merges, fixed_merges = _parse_merges(merge_refs, compiled.loop_blocks)
+
+    return PatchPlan(
+        entries=entries,
+        sheet_name=sheet_name,
+        head_before_dimension=sheet_xml[: dimension.start()],
+        head_after_dimension=sheet_xml[dimension.end() : sheet_data.start()],
+        tail_before_merges=tail[: merge_cells.start()] if merge_cells else "",
+        tail_after_merges=tail[merge_cells.end() :] if merge_cells else tail,
+        rows=rows,
+        max_row=max(rows, default=0),
+        min_col=min_col,
+        max_col=max_col,
+        template_merges=template_merges,
+        fixed_merges=fixed_merges,
+        epoch=(
+            CALENDAR_MAC_1904
+            if _DATE1904_PATTERN.search(workbook_xml)
+            else CALENDAR_WINDOWS_1900
+        ),
+        static_parts=static_parts,
+        merge_formats=_merge_formats(template_merges),
+    )
+
+
+_plans: Dict[str, tuple] = {}
+_plans_lock = threading.Lock()
+
+
+def get_patch_plan(compiled: CompiledTemplate) -> Optional[PatchPlan]:
+    """
+    获取模板的改写方案，按模板版本缓存。模板不受支持时返回None。
+    """
+    with _plans_lock:
+        cached = _plans.get(compiled.path)
+        if cached is not None and cached[0] == compiled.version:
+            return cached[1]
+
+        try:
+            plan = build_patch_plan(compiled)
+        except PatchNotSupportedError as e:
+            logger.info("[XML改写渲染器] 模板不支持直接改写: %s - %s", compiled.path, e)
+            plan = None
+        else:
+            # 内容不变的部件在加载模板时按默认压缩级别压缩好
+            for entry in plan.entries:
+                if entry.info.filename != plan.sheet_name:
+                    _static_entry(compiled.path, plan, entry, resolve_compresslevel())
+        _plans[compiled.path] = (compiled.version, plan)
+        return plan
+
+
+def supports_patch(template_path: str) -> bool:
+    """模板能否使用XML改写引擎渲染"""
+    return get_patch_plan(get_compiled_template(template_path)) is not None
+
+
+def _cell_xml(
+    ref: str, cell: TemplateCell, value, rendered: bool, epoch=CALENDAR_WINDOWS_1900
+) -> str:
+    """
+    生成单元格XML：未渲染的单元格原样输出，数字与日期写为数值，
+    其余渲染结果写为内联字符串。
+    """
+    if value is cell.value and not rendered:
+        return f'<c r="{ref}{cell.raw_tail}'
+    if value is None or value == "":
+        return f'<c r="{ref}"{cell.attrs}/>'
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{cell.attrs} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{cell.attrs}><v>{value!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}"{cell.attrs}><v>{to_excel(value, epoch)!r}</v></c>'
+
+    value = str(value)
+    if ILLEGAL_CHARACTERS_RE.search(value):
+        raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+    if value.startswith("=") and len(value) > 1:
+        # 与openpyxl一致：以=开头的字符串按公式写出
+        return f'<c r="{ref}"{cell.attrs}><f>{escape(value[1:])}</f><v></v></c>'
+    space = ' xml:space="preserve"' if value.strip() != value else ""
+    return f'<c r="{ref}"{cell.attrs} t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+
+
+def _row_xml(
+    plan: PatchPlan,
+    compiled,
+    output_row: int,
+    template_row: int,
+    scope,
+    render_value,
+    columns=None,
+) -> str:
+    """生成一行的XML"""
+    row_attrs, cells = plan.rows[template_row]
+    parts = [f'<row r="{output_row}"{row_attrs}>']
+    for cell in cells:
+        if columns is not None and cell.column not in columns:
+            continue
+        ref = f"{cell.letter}{output_row}"
+        if cell.binding is not None:
+            value = cell.binding.value(scope)
+            parts.append(_cell_xml(ref, cell, value, True, plan.epoch))
+        elif cell.value is None:
+            parts.append(f'<c r="{ref}{cell.raw_tail}')
+        else:
+            value, rendered = render_value(compiled, cell.value, scope)
+            parts.append(_cell_xml(ref, cell, value, rendered, plan.epoch))
+    parts.append("</row>")
+    return "".join(parts)
+
+
+def _count_rows(plan: PatchPlan, loop_blocks: list, context: dict) -> int:
+    """预先计算输出的总行数，dimension元素位于sheetData之前"""
+    total = plan.max_row
+    for block in loop_blocks:
+        total -= block["end_row"] - block["start_row"] + 1
+        for item in context.get(block["list_name"]) or []:
+            total += sum(1 for _ in expand_item_rows(block, item, context))
+    return total
+
+
+def _static_entry(
+    template_path: str, plan: PatchPlan, entry: ZipEntry, level: int
+) -> ZipEntry:
+    """模板中内容不变的部件按输出压缩级别压缩好的条目"""
+    return get_static_entry(
+        template_path, entry.info, plan.static_parts[entry.info.filename], level
+    )
+
+
+def _sheet_head(plan: PatchPlan, total_rows: int) -> bytes:
+    """工作表XML中sheetData之前的部分，dimension按输出的总行数改写"""
+    first_col = get_column_letter(plan.min_col)
+    last_col = get_column_letter(plan.max_col)
+    dimension = f'<dimension ref="{first_col}1:{last_col}{max(total_rows, 1)}"/>'
+    return (plan.head_before_dimension + dimension + plan.head_after_dimension).encode(
+        "utf-8"
+    )
+
+
+def _write_sheet(
+    zf: ZipWriter,
+    plan: PatchPlan,
+    compiled,
+    context: dict,
+    stats: Optional[RenderStats] = None,
+) -> int:
+    """逐行生成工作表XML并压缩写出，返回输出的行数"""
+    loop_blocks = compiled.loop_blocks
+    if all(
+        isinstance(context.get(block["list_name"]) or [], Sized)
+        for block in loop_blocks
+    ):
+        with zf.open(plan.sheet_name) as sheet:
+            sheet.write(_sheet_head(plan, _count_rows(plan, loop_blocks, context)))
+            return _write_sheet_body(sheet, plan, compiled, context, stats)
+
+    # 项目以迭代器逐行传入时无法预先计算总行数，sheetData先写入临时缓冲区
+    with tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_MAX_SIZE) as body:
+        row_count = _write_sheet_body(body, plan, compiled, context, stats)
+        body.seek(0)
+        with zf.open(plan.sheet_name) as sheet:
+            sheet.write(_sheet_head(plan, row_count))
+            shutil.copyfileobj(body, sheet, OUTPUT_CHUNK_SIZE)
+    return row_count
+
+
+def _write_sheet_body(
+    sheet, plan: PatchPlan, compiled, context: dict, stats: Optional[RenderStats]
+) -> int:
+    """
+    逐行生成sheetData及其后的部分写入sheet，返回输出的行数。
+    循环块之外的行计入scalar_render，项目展开的行计入loop_expand。
+    """
+    loop_blocks = compiled.loop_blocks
+    pending = ["<sheetData>"]
+    output_row = 0
+    generated_merges = []
+
+    def write_row(template_row: int, scope: dict, render_value, columns=None):
+        nonlocal output_row
+        output_row += 1
+        if template_row not in plan.rows:
+            return
+        pending.append(
+            _row_xml(
+                plan,
+                compiled,
+                output_row,
+                template_row,
+                scope,
+                render_value,
+                columns,
+            )
+        )
+        if template_row in plan.template_merges:
+            generated_merges.append((output_row, template_row))
+        if len(pending) >= _FLUSH_ROWS:
+            sheet.write("".join(pending).encode("utf-8"))
+            pending.clear()
+
+    row_mapping = []  # (模板起始行, 模板结束行, 行偏移量)，用于平移固定合并区域
+    template_row = 1
+    for block in loop_blocks:
+        row_mapping.append(
+            (template_row, block["start_row"] - 1, output_row + 1 - template_row)
+        )
+        with timed(stats, "scalar_render"):
+            for row_idx in range(template_row, block["start_row"]):
+                write_row(row_idx, context, render_scalar_value)
+
+        columns = range(block["first_col"], block["last_col"] + 1)
+        count = 0
+        with timed(stats, "loop_expand"):
+            for project_item in context.get(block["list_name"]) or []:
+                check_deadline()
+                for row_idx, scope in expand_item_rows(block, project_item, context):
+                    write_row(row_idx, scope, render_loop_value, columns)
+                count += 1
+        logger.log(
+            DETAIL,
+            "[XML改写渲染器] 循环块 %s.%s: 写出%d个项目",
+            block["list_name"],
+            block["loop_var"],
+            count,
+        )
+        template_row = block["end_row"] + 1
+
+    row_mapping.append((template_row, plan.max_row, output_row + 1 - template_row))
+    with timed(stats, "scalar_render"):
+        for row_idx in range(template_row, plan.max_row + 1):
+            write_row(row_idx, context, render_scalar_value)
+
+    pending.append(_sheet_tail(plan, row_mapping, generated_merges))
+    sheet.write("".join(pending).encode("utf-8"))
+    return output_row
+
+
+def _sheet_tail(plan: PatchPlan, row_mapping: list, generated_merges: list) -> str:
+    """
+    sheetData结束标记及其后的部分：固定合并区域按row_mapping平移，
+    循环块内的合并区域按generated_merges中的 (输出行号, 模板行号) 复制。
+    """
+
+    def map_row(row_idx: int) -> int:
+        """将模板中循环块之外的行号映射为输出行号"""
+        row_offset = 0
+        for first, last, segment_offset in row_mapping:
+            if row_idx < first:
+                break
+            row_offset = segment_offset
+        return row_idx + row_offset
+
+    parts = ["</sheetData>", plan.tail_before_merges]
+    merge_count = len(plan.fixed_merges) + sum(
+        len(plan.template_merges[row]) for _, row in generated_merges
+    )
+    if merge_count:
+        parts.append(f'<mergeCells count="{merge_count}">')
+        for min_row, max_row, min_col, max_col in plan.fixed_merges:
+            parts.append(
+                f'<mergeCell ref="{get_column_letter(min_col)}{map_row(min_row)}:'
+                f'{get_column_letter(max_col)}{map_row(max_row)}"/>'
+            )
+        for merged_row, template_merge_row in generated_merges:
+            merge_format, max_span = plan.merge_formats[template_merge_row]
+            parts.append(
+                merge_format.format(*range(merged_row, merged_row + max_span + 1))
+            )
+        parts.append("</mergeCells>")
+    parts.append(plan.tail_after_merges)
+    return "".join(parts)
+
+
+def _child_list_names(block: dict) -> List[str]:
+    """循环块中各层嵌套循环的列表名"""
+    names = []
+    for child in block["children"]:
+        names.append(child["list_name"])
+        names.extend(_child_list_names(child))
+    return names
+
+
+def _item_digest(block_index: int, item, outer_lists: tuple) -> bytes:
+    """
+    项目的摘要：循环块中的单元格只能引用项目本身与嵌套循环的列表，
+    因此all_money等循环块之外的变量变化时，项目渲染好的行仍可复用。
+    """
+    value = (block_index, item, outer_lists)
+    try:
+        # marshal比pickle快，版本2不按对象标识生成引用，相同内容得到相同结果
+        payload = marshal.dumps(value, 2)
+    except ValueError:
+        # 日期等marshal不支持的类型
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def _render_unit(
+    plan: PatchPlan, compiled, block: dict, item, context: dict, columns
+) -> LoopUnit:
+    """渲染循环块中的一个项目，行号写为占位符，可放在任意位置"""
+    rows = []
+    merges = []
+    row_count = 0
+    size = 0
+    for template_row, scope in expand_item_rows(block, item, context):
+        row_count += 1
+        if template_row not in plan.rows:
+            continue
+        row_xml = _row_xml(
+            plan,
+            compiled,
+            _ROW_PLACEHOLDER,
+            template_row,
+            scope,
+            render_loop_value,
+            columns,
+        ).encode("utf-8")
+        rows.append((row_count, row_xml))
+        size += len(row_xml)
+        if template_row in plan.template_merges:
+            merges.append((row_count, template_row))
+    return LoopUnit(row_count, tuple(rows), tuple(merges), size)
+
+
+def _unit_xml(unit: LoopUnit, base_row: int) -> bytes:
+    """将项目渲染好的行放在base_row之后，占位符替换为实际行号"""
+    return b"".join(
+        fragment.replace(_ROW_PLACEHOLDER_BYTES, b"%d" % (base_row + offset))
+        for offset, fragment in unit.rows
+    )
+
+
+def _use_incremental(compiled, context: dict) -> bool:
+    """通知带有编号且项目数达到RERENDER_MIN_PROJECTS时使用增量渲染"""
+    if not fingerprint_store.enabled or not context.get("notice_no"):
+        return False
+    lists = [context.get(block["list_name"]) or [] for block in compiled.loop_blocks]
+    if not all(isinstance(items, Sized) for items in lists):
+        return False
+    return sum(len(items) for items in lists) >= RERENDER_MIN_PROJECTS
+
+
+def _write_sheet_incremental(
+    zf: ZipWriter,
+    plan: PatchPlan,
+    compiled,
+    context: dict,
+    template_path: str,
+    level: int,
+    stats: Optional[RenderStats] = None,
+) -> int:
+    """
+    增量生成工作表XML并写出，返回输出的行数。
+    与同一通知上次渲染的指纹比较：摘要未变化的项目复用渲染好的行，
+    起始行号与内容都未变化的分块复用压缩数据；循环块之外的行（含all_money等汇总值）
+    每次重新渲染。模板版本变化时按完整渲染处理。渲染后保存本次的指纹。
+    """
+    notice_no = str(context["notice_no"])
+    key = make_fingerprint_key(template_path, notice_no)
+    previous = fingerprint_store.get(key)
+    if previous is not None and previous.template_version != compiled.version:
+        logger.info("[XML改写渲染器] 模板已更新，完整渲染通知: %s", notice_no)
+        previous = None
+    previous_units = previous.units if previous is not None else {}
+    previous_chunks = (
+        previous.chunks
+        if previous is not None and previous.compresslevel == level
+        else {}
+    )
+
+    # 工作表XML拆分为片段 (摘要, 内容, 片段之前的行数)：循环块之外的行直接生成XML，
+    # 项目按摘要复用上次渲染好的行，新增或修改的项目重新渲染
+    loop_blocks = compiled.loop_blocks
+    units: Dict[bytes, LoopUnit] = {}
+    segments = []
+    fixed = ["<sheetData>"]
+    output_row = 0
+    generated_merges = []
+    row_mapping = []
+    item_count = 0
+    rendered = 0
+
+    def add_fixed_rows(first: int, last: int):
+        nonlocal output_row
+        with timed(stats, "scalar_render"):
+            for row_idx in range(first, last + 1):
+                output_row += 1
+                if row_idx in plan.rows:
+                    fixed.append(
+                        _row_xml(
+                            plan,
+                            compiled,
+                            output_row,
+                            row_idx,
+                            context,
+                            render_scalar_value,
+                        )
+                    )
+
+    def close_fixed():
+        data = "".join(fixed).encode("utf-8")
+        segments.append((hashlib.blake2b(data, digest_size=16).digest(), data, None))
+        fixed.clear()
+
+    template_row = 1
+    for block_index, block in enumerate(loop_blocks):
+        row_mapping.append(
+            (template_row, block["start_row"] - 1, output_row + 1 - template_row)
+        )
+        add_fixed_rows(template_row, block["start_row"] - 1)
+        close_fixed()
+
+        columns = range(block["first_col"], block["last_col"] + 1)
+        # 项目自身属性中的列表（如 item.children）已包含在项目的摘要中，在上下文中找不到
+        outer_lists = tuple(
+            resolve_loop_list(name, context) for name in _child_list_names(block)
+        )
+        with timed(stats, "loop_expand"):
+            for item in context.get(block["list_name"]) or []:
+                check_deadline()
+                digest = _item_digest(block_index, item, outer_lists)
+                unit = units.get(digest)
+                if unit is None:
+                    unit = previous_units.get(digest)
+                    if unit is None:
+                        unit = _render_unit(
+                            plan, compiled, block, item, context, columns
+                        )
+                        rendered += 1
+                    units[digest] = unit
+                segments.append((digest, unit, output_row))
+                for offset, template_merge_row in unit.merges:
+                    generated_merges.append((output_row + offset, template_merge_row))
+                output_row += unit.row_count
+                item_count += 1
+        template_row = block["end_row"] + 1
+
+    row_mapping.append((template_row, plan.max_row, output_row + 1 - template_row))
+    add_fixed_rows(template_row, plan.max_row)
+    fixed.append(_sheet_tail(plan, row_mapping, generated_merges))
+    close_fixed()
+
+    # dimension取决于总行数，在所有项目就位后加到第一个片段之前
+    _, data, _ = segments[0]
+    data = _sheet_head(plan, output_row) + data
+    segments[0] = (hashlib.blake2b(data, digest_size=16).digest(), data, None)
+
+    # 片段按内容决定的边界合并为分块，各分块独立压缩；
+    # 起始行号与所含片段都未变化的分块直接复用上次的压缩数据与校验值
+    raws = []
+    chunks: Dict[bytes, CompressedChunk] = {}
+    chunk_segments = []
+    chunk_hash = None
+    chunk_size = 0
+    crc = 0
+    file_size = 0
+    reused = 0
+
+    def close_chunk(final: bool):
+        nonlocal chunk_hash, chunk_size, crc, file_size, reused
+        if final:
+            chunk_hash.update(b"final")
+        chunk_key = chunk_hash.digest()
+        chunk = previous_chunks.get(chunk_key)
+        if chunk is None:
+            data = b"".join(
+                content if base_row is None else _unit_xml(content, base_row)
+                for content, base_row in chunk_segments
+            )
+            chunk = CompressedChunk(
+                compress_chunk(data, level, final), zlib.crc32(data), len(data)
+            )
+            crc = zlib.crc32(data, crc)
+        else:
+            # 复用的分块没有原始内容，由分块的校验值合并得到整体的校验值
+            crc = crc32_combine(crc, chunk.crc, chunk.file_size)
+            reused += 1
+        raws.append(chunk.raw)
+        chunks[chunk_key] = chunk
+        file_size += chunk.file_size
+        chunk_segments.clear()
+        chunk_hash = None
+        chunk_size = 0
+
+    last = len(segments) - 1
+    for index, (digest, content, base_row) in enumerate(segments):
+        is_unit = base_row is not None
+        if not is_unit and chunk_segments:
+            close_chunk(False)
+        if chunk_hash is None:
+            chunk_hash = hashlib.blake2b(b"%d" % (base_row or 0), digest_size=16)
+        chunk_hash.update(digest)
+        chunk_segments.append((content, base_row))
+        chunk_size += content.size if is_unit else len(content)
+        if index == last:
+            close_chunk(True)
+        elif (
+            not is_unit
+            or digest[0] & _CHUNK_BOUNDARY_MASK == 0
+            or chunk_size >= _CHUNK_MAX_BYTES
+        ):
+            close_chunk(False)
+
+    # 条目的时间与权限与完整渲染时ZipFile.open写出的相同，输出不因是否增量渲染而不同
+    info = zipfile.ZipInfo(plan.sheet_name)
+    info.external_attr = 0o600 << 16
+    zf.write_raw(make_entry(info, b"".join(raws), file_size, crc, level))
+
+    size = sum(unit.size for unit in units.values())
+    size += sum(len(chunk.raw) for chunk in chunks.values())
+    fingerprint_store.put(
+        key, RenderFingerprint(compiled.version, level, units, chunks, size)
+    )
+    logger.log(
+        DETAIL,
+        "[XML改写渲染器] 增量渲染通知 %s: 重新渲染%d/%d个项目，复用%d/%d个压缩分块",
+        notice_no,
+        rendered,
+        item_count,
+        reused,
+        len(raws),
+    )
+    return output_row
+
+
+def _rows_stage_time(stats: Optional[RenderStats]) -> float:
+    """已计入scalar_render与loop_expand的时间，从外层按时间段累计的save中扣除"""
+    if stats is None:
+        return 0.0
+    return stats.stages.get("scalar_render", 0.0) + stats.stages.get("loop_expand", 0.0)
+
+
+def render_excel_template_patch(
+    template_path: str,
+    context: dict,
+    output,
+    stats: Optional[RenderStats] = None,
+    compresslevel: Optional[int] = None,
+) -> None:
+    """
+    XML改写渲染引擎：直接在模板压缩包上工作，只重新生成工作表XML，
+    样式、主题、共享字符串等其余部分使用按压缩级别缓存的压缩数据写入output。
+    """
+    start_time = time.time()
+    logger.log(DETAIL, "[XML改写渲染器] 开始渲染模板: %s", template_path)
+
+    stage_start = time.perf_counter()
+    compiled = get_compiled_template(template_path)
+    stage_start = add_stage_time(stats, "template_load", stage_start)
+    plan = get_patch_plan(compiled)
+    if plan is None:
+        raise PatchNotSupportedError(f"模板不支持直接改写: {template_path}")
+    stage_start = add_stage_time(stats, "loop_scan", stage_start)
+
+    # 工作表中的行在生成时分别计入scalar_render与loop_expand，
+    # 其余时间（工作表的压缩、其余条目的复制与目录写出）计入save
+    level = resolve_compresslevel(compresslevel)
+    with open_output_zip(output, level) as zf:
+        for entry in plan.entries:
+            if entry.info.filename == plan.sheet_name:
+                rows_time = _rows_stage_time(stats)
+                if _use_incremental(compiled, context):
+                    row_count = _write_sheet_incremental(
+                        zf, plan, compiled, context, template_path, level, stats
+                    )
+                else:
+                    row_count = _write_sheet(zf, plan, compiled, context, stats)
+                stage_start += _rows_stage_time(stats) - rows_time
+            else:
+                zf.write_raw(_static_entry(template_path, plan, entry, level))
+    add_stage_time(stats, "save", stage_start)
+
+    elapsed_time = time.time() - start_time
+    logger.log(
+        DETAIL,
+        "[XML改写渲染器] 模板渲染完成，共写出%d行，耗时%.2f秒",
+        row_count,
+        elapsed_time,
+    )
+
+
+# 多工作表拆分时改写的工作簿部件
+_WORKBOOK_PART = "xl/workbook.xml"
+_WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+_CONTENT_TYPES_PART = "[Content_Types].xml"
+_APP_PROPS_PART = "docProps/app.xml"
+_SHEET_ELEMENT_PATTERN = re.compile(r"<sheet\b[^>]*/>")
+_TAB_SELECTED_PATTERN = re.compile(r'\s+tabSelected="(?:1|true)"')
+_HEADING_COUNT_PATTERN = re.compile(r"(<HeadingPairs>.*?<vt:i4>)\d+(</vt:i4>)", re.S)
+_TITLES_PATTERN = re.compile(r"<TitlesOfParts>.*?</TitlesOfParts>", re.S)
+_WORKSHEET_RELATIONSHIP = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"
+)
+_WORKSHEET_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+)
+# Excel工作表名称的最大长度
+_MAX_SHEET_NAME = 31
+
+
+def plan_sheet_partitions(
+    template_path: str, context: dict, max_projects: int, max_rows: int
+) -> Optional[Tuple[str, List[int]]]:
+    """
+    计算项目列表拆分到多个工作表的方案，返回 (列表名, 每个工作表的项目数量)。
+    每个工作表的项目数不超过max_projects（0为不限制），总行数不超过max_rows。
+    不需要拆分，或模板不是XML改写引擎支持的单循环块模板时返回None。
+    """
+    compiled = get_compiled_template(template_path)
+    plan = get_patch_plan(compiled)
+    if plan is None or len(compiled.loop_blocks) != 1:
+        return None
+
+    block = compiled.loop_blocks[0]
+    projects = context.get(block["list_name"]) or []
+    block_rows = block["end_row"] - block["start_row"] + 1
+    per_sheet = (max_rows - (plan.max_row - block_rows)) // block_rows
+    if max_projects > 0:
+        per_sheet = min(per_sheet, max_projects)
+    per_sheet = max(per_sheet, 1)
+    if len(projects) <= per_sheet:
+        return None
+
+    sizes = [per_sheet] * (len(projects) // per_sheet)
+    if len(projects) % per_sheet:
+        sizes.append(len(projects) % per_sheet)
+    return block["list_name"], sizes
+
+
+def render_sheet_entry(
+    template_path: str,
+    context: dict,
+    selected: bool,
+    compresslevel: Optional[int] = None,
+) -> Tuple[ZipEntry, RenderStats]:
+    """
+    渲染拆分后的一个工作表，返回压缩好的工作表条目与渲染统计，
+    由write_partitioned_workbook合并。只有selected的工作表保持选中状态。
+    """
+    stats = RenderStats(engine="patch")
+    stage_start = time.perf_counter()
+    compiled = get_compiled_template(template_path)
+    stage_start = add_stage_time(stats, "template_load", stage_start)
+    plan = get_patch_plan(compiled)
+    if plan is None:
+        raise PatchNotSupportedError(f"模板不支持直接改写: {template_path}")
+    if not selected:
+        plan = replace(
+            plan,
+            head_after_dimension=_TAB_SELECTED_PATTERN.sub(
+                "", plan.head_after_dimension
+            ),
+        )
+    stage_start = add_stage_time(stats, "loop_scan", stage_start)
+
+    buffer = io.BytesIO()
+    with open_output_zip(buffer, compresslevel) as zf:
+        _write_sheet(zf, plan, compiled, context, stats)
+    add_stage_time(stats, "save", stage_start + _rows_stage_time(stats))
+    return _read_entries(buffer.getvalue())[0], stats
+
+
+def _sheet_names(base: str, count: int) -> List[str]:
+    """生成各工作表的名称：第一个沿用模板名称，其余依次为“名称 (2)”等"""
+    names = [escape(base)]
+    for index in range(2, count + 1):
+        suffix = f" ({index})"
+        names.append(escape(base[: _MAX_SHEET_NAME - len(suffix)] + suffix))
+    return names
+
+
+def _rewrite_workbook_parts(
+    plan: PatchPlan, parts: Dict[str, str], sheet_paths: List[str]
+) -> Dict[str, str]:
+    """改写工作簿、关系、内容类型与文档属性部件，登记新增的工作表"""
+    workbook = parts[_WORKBOOK_PART]
+    sheet_element = _SHEET_ELEMENT_PATTERN.search(workbook)
+    attrs = dict(_ATTR_PATTERN.findall(sheet_element.group(0)))
+    base_name = unescape(attrs["name"])
+    names = _sheet_names(base_name, len(sheet_paths))
+    first_id = max(int(value) for value in re.findall(r'sheetId="(\d+)"', workbook))
+
+    sheets, relationships, overrides = [sheet_element.group(0)], [], []
+    for index, path in enumerate(sheet_paths[1:], start=1):
+        rel_id = f"rIdPartSheet{index + 1}"
+        sheet_attrs = {
+            **attrs,
+            "name": names[index],
+            "sheetId": str(first_id + index),
+            "r:id": rel_id,
+        }
+        sheets.append(
+            "<sheet"
+            + "".join(f' {name}="{value}"' for name, value in sheet_attrs.items())
+            + "/>"
+        )
+        relationships.append(
+            f'<Relationship Id="{rel_id}" Type="{_WORKSHEET_RELATIONSHIP}" '
+            f'Target="{path[len("xl/") :]}"/>'
+        )
+        overrides.append(
+            f'<Override PartName="/{path}" ContentType="{_WORKSHEET_CONTENT_TYPE}"/>'
+        )
+
+    rewritten = {
+        _WORKBOOK_PART: workbook[: sheet_element.start()]
+        + "".join(sheets)
+        + workbook[sheet_element.end() :],
+        _WORKBOOK_RELS_PART: parts[_WORKBOOK_RELS_PART].replace(
+            "</Relationships>", "".join(relationships) + "</Relationships>"
+        ),
+        _CONTENT_TYPES_PART: parts[_CONTENT_TYPES_PART].replace(
+            "</Types>", "".join(overrides) + "</Types>"
+        ),
+    }
+    app_props = parts.get(_APP_PROPS_PART)
+    if app_props is not None:
+        titles = "".join(f"<vt:lpstr>{name}</vt:lpstr>" for name in names)
+        app_props = _HEADING_COUNT_PATTERN.sub(
+            rf"\g<1>{len(names)}\g<2>", app_props, count=1
+        )
+        app_props = _TITLES_PATTERN.sub(
+            f'<TitlesOfParts><vt:vector size="{len(names)}" baseType="lpstr">'
+            f"{titles}</vt:vector></TitlesOfParts>",
+            app_props,
+        )
+        rewritten[_APP_PROPS_PART] = app_props
+    return rewritten
+
+
+def write_partitioned_workbook(
+    template_path: str,
+    sheets: List[ZipEntry],
+    output,
+    compresslevel: Optional[int] = None,
+) -> None:
+    """
+    将render_sheet_entry渲染的各工作表合并为一个工作簿写入output：
+    工作表条目原样复制，工作簿中登记新增的工作表，其余部件使用缓存的压缩数据。
+    """
+    compiled = get_compiled_template(template_path)
+    plan = get_patch_plan(compiled)
+    names = {entry.info.filename for entry in plan.entries}
+
+    sheet_paths = [plan.sheet_name]
+    number = 1
+    while len(sheet_paths) < len(sheets):
+        number += 1
+        path = f"xl/worksheets/sheet{number}.xml"
+        if path not in names:
+            sheet_paths.append(path)
+
+    with zipfile.ZipFile(io.BytesIO(compiled.content)) as template_zip:
+        parts = {
+            name: template_zip.read(name).decode("utf-8")
+            for name in (
+                _WORKBOOK_PART,
+                _WORKBOOK_RELS_PART,
+                _CONTENT_TYPES_PART,
+                _APP_PROPS_PART,
+            )
+            if name in names
+        }
+    rewritten = _rewrite_workbook_parts(plan, parts, sheet_paths)
+
+    # 工作表自身的关系（如打印设置）为每个工作表复制一份
+    sheet_dir, sheet_file = plan.sheet_name.rsplit("/", 1)
+    sheet_rels = f"{sheet_dir}/_rels/{sheet_file}.rels"
+
+    level = resolve_compresslevel(compresslevel)
+    with open_output_zip(output, level) as zf:
+        for entry in plan.entries:
+            filename = entry.info.filename
+            if filename == plan.sheet_name:
+                for path, sheet in zip(sheet_paths, sheets):
+                    sheet.info.filename = path
+                    zf.write_raw(sheet)
+            elif filename == sheet_rels:
+                static = _static_entry(template_path, plan, entry, level)
+                for path in sheet_paths:
+                    rels = copy(static.info)
+                    rels.filename = f"{sheet_dir}/_rels/{path.rsplit('/', 1)[1]}.rels"
+                    zf.write_raw(ZipEntry(rels, static.raw))
+            elif filename in rewritten:
+                zf.write_raw(
+                    compress_entry(
+                        entry.info, rewritten[filename].encode("utf-8"), level
+                    ),
+                )
+            else:
+                zf.write_raw(_static_entry(template_path, plan, entry, level))
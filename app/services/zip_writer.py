@@ -0,0 +1,414 @@
+# app/services/zip_writer.py
+import datetime
+import re
+import shutil
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from copy import copy
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from openpyxl.writer.excel import ExcelWriter
+
+from app.config import OUTPUT_CHUNK_SIZE, OUTPUT_COMPRESSLEVEL
+
+# 本地文件头中的数据描述符标志：原样复制的条目把大小与校验值写在文件头中
+_DATA_DESCRIPTOR_FLAG = 0x08
+# 文件名使用UTF-8编码的标志
+_UTF8_FLAG = 0x800
+# 本地文件头、中央目录文件头与中央目录结束记录（APPNOTE.TXT 4.3.7、4.3.12、4.3.16）
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+_END_RECORD_SIGNATURE = b"PK\x05\x06"
+# 解压所需的版本2.0（deflate），创建系统为Unix（与ZipFile在Linux上写出的相同）
+_ZIP_VERSION = 20
+_VERSION_MADE_BY = (3 << 8) | _ZIP_VERSION
+# 不使用ZIP64时条目大小、偏移量与条目数的上限
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP32_MAX_ENTRIES = 0xFFFF
+
+# 每次渲染内容都不同的部件：工作表、共享字符串与带有保存时间的文档属性
+_DYNAMIC_PART_PATTERN = re.compile(
+    r"xl/worksheets/[^/]+\.xml$|xl/sharedStrings\.xml$|docProps/core\.xml$"
+)
+
+
+@dataclass
+class ZipEntry:
+    """压缩包中的一项：目录信息与未解压的压缩数据"""
+
+    info: zipfile.ZipInfo
+    raw: bytes
+
+
+def resolve_compresslevel(level: Optional[int] = None) -> int:
+    """未指定压缩级别时使用服务配置的OUTPUT_COMPRESSLEVEL"""
+    return OUTPUT_COMPRESSLEVEL if level is None else level
+
+
+def compression_args(level: int) -> Tuple[int, Optional[int]]:
+    """压缩级别对应的 (压缩方式, 压缩级别)：0为不压缩直接存储，1-9为deflate"""
+    if level <= 0:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, min(level, 9)
+
+
+def _dos_datetime(date_time: tuple) -> Tuple[int, int]:
+    """条目时间 (年, 月, 日, 时, 分, 秒) 对应的MS-DOS格式 (时间, 日期)"""
+    year, month, day, hour, minute, second = date_time
+    dos_time = (hour << 11) | (minute << 5) | (second // 2)
+    dos_date = ((year - 1980) << 9) | (month << 5) | day
+    return dos_time, dos_date
+
+
+def _encode_filename(info: zipfile.ZipInfo) -> Tuple[bytes, int]:
+    """条目名称的编码与对应的标志位：ASCII以外的名称使用UTF-8"""
+    flag_bits = info.flag_bits & ~(_DATA_DESCRIPTOR_FLAG | _UTF8_FLAG)
+    try:
+        return info.filename.encode("ascii"), flag_bits
+    except UnicodeEncodeError:
+        return info.filename.encode("utf-8"), flag_bits | _UTF8_FLAG
+
+
+class ZipWriter:
+    """
+    只写的输出压缩包：本地文件头、中央目录与目录结束记录由本类按ZIP格式写出，
+    不依赖zipfile.ZipFile的内部状态。条目可以是已压缩好的数据（write_raw，
+    原样复制模板部件与缓存的压缩结果），也可以边生成边压缩（open）。
+    不写出ZIP64记录，输出须支持seek（流式条目写完后回填本地文件头）。
+    """
+
+    def __init__(self, fp, level: Optional[int] = None):
+        self.fp = fp
+        self.level = resolve_compresslevel(level)
+        self._entries: list = []
+        self._offset = fp.tell()
+        self._writing = False
+        self._closed = False
+
+    def _write_local_header(self, info: zipfile.ZipInfo, name: bytes, flags: int):
+        dos_time, dos_date = _dos_datetime(info.date_time)
+        self.fp.write(
+            _LOCAL_HEADER.pack(
+                _LOCAL_HEADER_SIGNATURE,
+                _ZIP_VERSION,
+                flags,
+                info.compress_type,
+                dos_time,
+                dos_date,
+                info.CRC,
+                info.compress_size,
+                info.file_size,
+                len(name),
+                0,
+            )
+        )
+        self.fp.write(name)
+
+    def _check_limits(self, info: zipfile.ZipInfo) -> None:
+        if max(info.file_size, info.compress_size, info.header_offset) > _ZIP32_LIMIT:
+            raise zipfile.LargeZipFile(f"条目超过4GB，不支持ZIP64: {info.filename}")
+        if len(self._entries) >= _ZIP32_MAX_ENTRIES:
+            raise zipfile.LargeZipFile("条目数量超过65535，不支持ZIP64")
+
+    def write_raw(self, entry: ZipEntry) -> None:
+        """将条目的压缩数据原样写入，不解压也不重新压缩"""
+        if self._writing:
+            raise ValueError("上一个条目尚未写完")
+        info = copy(entry.info)
+        # 原条目的数据描述符不随数据复制，大小与校验值写在本地文件头中
+        name, info.flag_bits = _encode_filename(info)
+        info.header_offset = self._offset
+        self._check_limits(info)
+        self._write_local_header(info, name, info.flag_bits)
+        self.fp.write(entry.raw)
+        self._offset += _LOCAL_HEADER.size + len(name) + len(entry.raw)
+        self._entries.append((info, name))
+
+    def open(self, name: str) -> "_EntryWriter":
+        """
+        打开一个边写入边压缩的条目，时间与权限与zipfile.ZipFile.open写出的相同。
+        关闭后大小与校验值回填到本地文件头中。
+        """
+        if self._writing:
+            raise ValueError("上一个条目尚未写完")
+        info = zipfile.ZipInfo(name)
+        info.external_attr = 0o600 << 16
+        info.compress_type = compression_args(self.level)[0]
+        # 大小与校验值在条目写完后回填
+        info.CRC = info.compress_size = info.file_size = 0
+        info.header_offset = self._offset
+        encoded, info.flag_bits = _encode_filename(info)
+        self._write_local_header(info, encoded, info.flag_bits)
+        self._writing = True
+        return _EntryWriter(self, info, encoded)
+
+    def _finish_entry(self, info: zipfile.ZipInfo, name: bytes) -> None:
+        """流式条目写完：回填本地文件头中的大小与校验值"""
+        self._writing = False
+        self._check_limits(info)
+        end = self._offset + _LOCAL_HEADER.size + len(name) + info.compress_size
+        self.fp.seek(info.header_offset)
+        self._write_local_header(info, name, info.flag_bits)
+        self.fp.seek(end)
+        self._offset = end
+        self._entries.append((info, name))
+
+    def namelist(self) -> list:
+        """已写入的条目名称"""
+        return [info.filename for info, _ in self._entries]
+
+    def close(self) -> None:
+        """写出中央目录与目录结束记录，不关闭fp"""
+        if self._closed:
+            return
+        self._closed = True
+        directory_offset = self._offset
+        for info, name in self._entries:
+            dos_time, dos_date = _dos_datetime(info.date_time)
+            self.fp.write(
+                _CENTRAL_HEADER.pack(
+                    _CENTRAL_HEADER_SIGNATURE,
+                    _VERSION_MADE_BY,
+                    _ZIP_VERSION,
+                    info.flag_bits,
+                    info.compress_type,
+                    dos_time,
+                    dos_date,
+                    info.CRC,
+                    info.compress_size,
+                    info.file_size,
+                    len(name),
+                    0,
+                    0,
+                    0,
+                    0,
+                    info.external_attr,
+                    info.header_offset,
+                )
+            )
+            self.fp.write(name)
+            self._offset += _CENTRAL_HEADER.size + len(name)
+        directory_size = self._offset - directory_offset
+        if directory_offset > _ZIP32_LIMIT:
+            raise zipfile.LargeZipFile("压缩包超过4GB，不支持ZIP64")
+        self.fp.write(
+            _END_RECORD.pack(
+                _END_RECORD_SIGNATURE,
+                0,
+                0,
+                len(self._entries),
+                len(self._entries),
+                directory_size,
+                directory_offset,
+                0,
+            )
+        )
+        self._offset += _END_RECORD.size
+        self.fp.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 出错时输出不再使用，不写出中央目录
+        if exc_type is None:
+            self.close()
+
+
+class _EntryWriter:
+    """ZipWriter.open返回的条目：写入的内容按压缩级别压缩后直接写出到输出"""
+
+    def __init__(self, writer: ZipWriter, info: zipfile.ZipInfo, name: bytes):
+        self._writer = writer
+        self._info = info
+        self._name = name
+        self._crc = 0
+        self._file_size = 0
+        self._compress_size = 0
+        self._compressor = None
+        compression, compresslevel = compression_args(writer.level)
+        if compression == zipfile.ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        self.closed = False
+
+    def _write_out(self, data: bytes) -> None:
+        if data:
+            self._writer.fp.write(data)
+            self._compress_size += len(data)
+
+    def write(self, data) -> int:
+        self._crc = zlib.crc32(data, self._crc)
+        self._file_size += len(data)
+        if self._compressor is not None:
+            self._write_out(self._compressor.compress(data))
+        else:
+            self._write_out(bytes(data))
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._compressor is not None:
+            self._write_out(self._compressor.flush())
+        self._info.CRC = self._crc
+        self._info.file_size = self._file_size
+        self._info.compress_size = self._compress_size
+        self._writer._finish_entry(self._info, self._name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+def open_output_zip(output, level: Optional[int] = None) -> ZipWriter:
+    """以指定压缩级别创建输出压缩包"""
+    return ZipWriter(output, level)
+
+
+def make_entry(
+    info: zipfile.ZipInfo, raw: bytes, file_size: int, crc: int, level: int
+) -> ZipEntry:
+    """由已按指定压缩级别压缩好的数据及其原始大小、校验值构造条目"""
+    zinfo = copy(info)
+    zinfo.compress_type = compression_args(level)[0]
+    zinfo.flag_bits &= ~_DATA_DESCRIPTOR_FLAG
+    zinfo.file_size = file_size
+    zinfo.CRC = crc
+    zinfo.compress_size = len(raw)
+    return ZipEntry(zinfo, raw)
+
+
+def compress_chunk(data: bytes, level: int, final: bool = True) -> bytes:
+    """
+    按指定压缩级别独立压缩一段数据。非最后一段以同步刷新结束，
+    各段的压缩数据依次拼接即为整体的压缩数据，内容不变的段可以直接复用。
+    """
+    compression, compresslevel = compression_args(level)
+    if compression != zipfile.ZIP_DEFLATED:
+        return data
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+    )
+
+
+# CRC-32多项式（反射形式），用于合并分段计算的校验值
+_CRC32_POLY = 0xEDB88320
+
+
+def _crc32_multiply(a: int, b: int) -> int:
+    """模CRC-32多项式的乘法，与zlib的multmodp相同"""
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if a & (m - 1) == 0:
+                return p
+        m >>= 1
+        b = (b >> 1) ^ _CRC32_POLY if b & 1 else b >> 1
+
+
+# x^(2^k) 模多项式的值
+_CRC32_X2N = [1 << 30]
+for _ in range(31):
+    _CRC32_X2N.append(_crc32_multiply(_CRC32_X2N[-1], _CRC32_X2N[-1]))
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    由两段数据各自的CRC-32与第二段的长度计算拼接后的CRC-32（zlib的crc32_combine），
+    复用压缩数据的分段无需再次读取原始内容。
+    """
+    p = 1 << 31
+    k = 3
+    while length2:
+        if length2 & 1:
+            p = _crc32_multiply(_CRC32_X2N[k & 31], p)
+        length2 >>= 1
+        k += 1
+    return _crc32_multiply(p, crc1) ^ crc2
+
+
+def compress_entry(info: zipfile.ZipInfo, data: bytes, level: int) -> ZipEntry:
+    """按指定压缩级别压缩条目内容，返回可由ZipWriter.write_raw直接写出的条目"""
+    return make_entry(
+        info, compress_chunk(data, level), len(data), zlib.crc32(data), level
+    )
+
+
+# 内容不变的部件按 (模板, 部件名, 压缩级别) 缓存压缩结果：(原始内容, 压缩好的条目)
+_static_entries: Dict[tuple, Tuple[bytes, ZipEntry]] = {}
+_static_entries_lock = threading.Lock()
+
+
+def get_static_entry(
+    template_path: str, info: zipfile.ZipInfo, data: bytes, level: int
+) -> ZipEntry:
+    """
+    获取部件压缩好的条目，同一模板的部件在每个压缩级别下只压缩一次。
+    内容与缓存的不一致时（模板已更新）重新压缩并替换缓存。
+    """
+    key = (template_path, info.filename, level)
+    with _static_entries_lock:
+        cached = _static_entries.get(key)
+    if cached is not None and (cached[0] is data or cached[0] == data):
+        return cached[1]
+
+    entry = compress_entry(info, data, level)
+    with _static_entries_lock:
+        _static_entries[key] = (data, entry)
+    return entry
+
+
+class OutputZipFile(ZipWriter):
+    """
+    openpyxl保存工作簿时使用的输出压缩包，提供ExcelWriter所用的writestr与write：
+    样式、主题、关系等内容不变的部件使用按模板缓存的压缩结果直接写入，
+    只有工作表等每次不同的部件重新压缩。
+    """
+
+    def __init__(self, file, template_path: str, level: Optional[int] = None):
+        super().__init__(file, level)
+        self.template_path = template_path
+
+    def writestr(self, arcname: str, data) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        # 时间与权限与zipfile.ZipFile.writestr写出的相同
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.external_attr = 0o600 << 16
+        if _DYNAMIC_PART_PATTERN.match(arcname):
+            self.write_raw(compress_entry(info, data, self.level))
+        else:
+            self.write_raw(get_static_entry(self.template_path, info, data, self.level))
+
+    def write(self, filename: str, arcname: str) -> None:
+        """写入write_only工作表写出到临时文件的XML"""
+        with open(filename, "rb") as src, self.open(arcname) as dst:
+            shutil.copyfileobj(src, dst, OUTPUT_CHUNK_SIZE)
+
+
+def save_workbook(wb, output, template_path: str, level: Optional[int] = None):
+    """
+    与openpyxl的Workbook.save相同，输出压缩包使用指定的压缩级别，
+    内容不变的部件按模板缓存压缩结果。
+    """
+    if wb.write_only and not wb.worksheets:
+        wb.create_sheet()
+    archive = OutputZipFile(output, template_path, level)
+    wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(
+        tzinfo=None
+    )
+    ExcelWriter(wb, archive).save()
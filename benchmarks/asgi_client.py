@@ -0,0 +1,57 @@
+# benchmarks/asgi_client.py
+import asyncio
+from typing import Dict, Tuple
+
+
+async def post_json(app, path: str, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    在进程内直接调用ASGI应用发送一次JSON POST请求，不经过网络与HTTP客户端库，
+    返回 (状态码, 响应头, 响应体)。
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"benchmark"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("benchmark", 80),
+    }
+    request_sent = False
+    # 响应结束前客户端不会断开，请求体发送完毕后receive一直等待
+    never = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await never.wait()
+        return {"type": "http.disconnect"}
+
+    status = 0
+    headers: Dict[str, str] = {}
+    chunks = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers.update(
+                (key.decode("latin-1"), value.decode("latin-1"))
+                for key, value in message.get("headers", ())
+            )
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, headers, b"".join(chunks)
@@ -0,0 +1,86 @@
+# benchmarks/http_client.py
+import asyncio
+from typing import Dict, Optional, Tuple
+
+
+class HTTPConnection:
+    """
+    到被测服务的一个HTTP/1.1长连接，由压测中的一个并发用户独占使用。
+    只实现压测需要的部分：按Content-Length或分块编码读取完整响应，不依赖HTTP客户端库。
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        content_type: str = "application/json",
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """发送一次请求，返回 (状态码, 响应头, 响应体)。连接出错时关闭连接并抛出异常"""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        )
+        try:
+            self._writer.write(head.encode("latin-1") + body)
+            await self._writer.drain()
+            status, headers, content = await self._read_response()
+        except BaseException:
+            await self.close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, headers, content
+
+    async def _read_response(self) -> Tuple[int, Dict[str, str], bytes]:
+        head = await self._reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size_line = await self._reader.readuntil(b"\r\n")
+                size = int(size_line.split(b";", 1)[0], 16)
+                if size == 0:
+                    # 跳过可能存在的trailer，直到空行
+                    while await self._reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+            return status, headers, b"".join(chunks)
+
+        if "content-length" in headers:
+            content = await self._reader.readexactly(int(headers["content-length"]))
+            return status, headers, content
+
+        content = await self._reader.read()
+        headers["connection"] = "close"
+        return status, headers, content
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            writer, self._reader, self._writer = self._writer, None, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
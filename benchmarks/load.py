@@ -0,0 +1,626 @@
+# benchmarks/load.py
+"""
+并发压力测试：在本机以与Dockerfile相同的方式启动多工作进程的uvicorn服务（或连接已运行的服务），
+按项目数量与并发数逐级加压，对 TEMPLATE_MAP 中的全部模板轮流发送 /render 请求。
+每一级记录吞吐量、延迟分位数（p50/p95/p99）与错误率，并定时采样各工作进程
+（含其渲染进程）的常驻内存，结果写入JSON并可与基线对比。
+
+在项目根目录执行：
+    python -m benchmarks.load
+    python -m benchmarks.load --sizes 10,1000 --concurrency 1,8,32 --duration 20
+    python -m benchmarks.load --workers 2 --env RENDER_ENGINE=openpyxl
+    python -m benchmarks.load --url http://127.0.0.1:8000 --pid 12345
+    python -m benchmarks.load --save-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.api.endpoints.notice import TEMPLATE_MAP
+from benchmarks.http_client import HTTPConnection
+from benchmarks.payloads import DEFAULT_SEED, make_render_request
+
+RESULT_FORMAT_VERSION = 1
+DEFAULT_SIZES = "10,100,1000"
+DEFAULT_CONCURRENCY = "1,4,16"
+DEFAULT_BASELINE = os.path.join("benchmarks", "load_baseline.json")
+RESULTS_DIR = os.path.join("benchmarks", "results")
+RENDER_PATH = "/api/v1/notices/render"
+READY_PATH = "/ready"
+# 启动服务时的默认配置：关闭结果缓存，相同的合成数据每次都真正渲染
+SERVER_ENV_DEFAULTS = {"OUTPUT_CACHE_TTL": "0"}
+# 延迟差异小于该值（毫秒）时不判定为退化，避免低负载下的计时抖动
+MIN_LATENCY_DELTA_MS = 10.0
+# 错误率上升超过该值时判定为退化
+MAX_ERROR_RATE_DELTA = 0.01
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _process_table() -> Dict[int, Tuple[int, int]]:
+    """读取/proc中所有进程的 (父进程号, 常驻内存字节数)，不支持/proc的平台返回空表"""
+    table = {}
+    try:
+        names = os.listdir("/proc")
+    except OSError:
+        return table
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read()
+            with open(f"/proc/{name}/statm", "rb") as f:
+                statm = f.read()
+        except OSError:
+            continue
+        # 进程名可能包含空格与括号，父进程号从最后一个右括号之后读取
+        ppid = int(stat.rsplit(b")", 1)[1].split()[1])
+        table[int(name)] = (ppid, int(statm.split()[1]) * _PAGE_SIZE)
+    return table
+
+
+def _is_spawned_worker(pid: int) -> bool:
+    """uvicorn --workers 以multiprocessing的spawn方式启动工作进程"""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"spawn_main" in f.read()
+    except OSError:
+        return False
+
+
+class RSSSampler:
+    """
+    定时采样服务进程树的常驻内存。每个工作进程的内存包括其渲染池等子进程，
+    工作进程按进程号排序依次记为 worker-1、worker-2……，便于不同次运行的结果对比。
+    单进程运行（没有spawn出的工作进程）时主进程即为唯一的工作进程。
+    """
+
+    def __init__(self, master_pid: int):
+        self.master_pid = master_pid
+        self.samples: List[dict] = []
+        self._start = time.perf_counter()
+
+    def sample(self, stage: Optional[int]) -> Optional[dict]:
+        table = _process_table()
+        if self.master_pid not in table:
+            return None
+        children: Dict[int, List[int]] = {}
+        for pid, (ppid, _) in table.items():
+            children.setdefault(ppid, []).append(pid)
+
+        def tree_rss(pid: int) -> int:
+            return table[pid][1] + sum(
+                tree_rss(child) for child in children.get(pid, ())
+            )
+
+        workers = [
+            pid for pid in children.get(self.master_pid, ()) if _is_spawned_worker(pid)
+        ] or [self.master_pid]
+        record = {
+            "t": round(time.perf_counter() - self._start, 2),
+            "stage": stage,
+            "total": tree_rss(self.master_pid),
+            "workers": {
+                f"worker-{index}": tree_rss(pid)
+                for index, pid in enumerate(sorted(workers), start=1)
+            },
+        }
+        self.samples.append(record)
+        return record
+
+    async def run(self, interval: float, current_stage) -> None:
+        while True:
+            self.sample(current_stage())
+            await asyncio.sleep(interval)
+
+    def stage_peak(self, stage: int) -> Optional[dict]:
+        """某一级压测期间的内存峰值：进程树总量与各工作进程各自的最大值"""
+        samples = [item for item in self.samples if item["stage"] == stage]
+        if not samples:
+            return None
+        workers: Dict[str, int] = {}
+        for item in samples:
+            for label, rss in item["workers"].items():
+                workers[label] = max(workers.get(label, 0), rss)
+        return {
+            "total_bytes": max(item["total"] for item in samples),
+            "workers": workers,
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, env: Dict[str, str], log_path: str):
+    """以与Dockerfile相同的命令启动uvicorn，输出写入log_path"""
+    log = open(log_path, "wb")
+    try:
+        return subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+            ],
+            env={**os.environ, **SERVER_ENV_DEFAULTS, **env},
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    finally:
+        log.close()
+
+
+def stop_server(process: subprocess.Popen, timeout: float = 30) -> None:
+    """先请求uvicorn正常退出，超时后强制结束"""
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def wait_ready(
+    host: str, port: int, timeout: float, process: Optional[subprocess.Popen]
+) -> None:
+    """轮询 /ready 直到服务就绪（所有模板已预热）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"服务启动失败，退出码 {process.returncode}")
+        connection = HTTPConnection(host, port)
+        try:
+            status, _, _ = await connection.request("GET", READY_PATH)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            await connection.close()
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"服务在{timeout}秒内未就绪")
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    """最近秩法计算分位数"""
+    index = max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def _latency_summary(latencies: List[float]) -> Optional[dict]:
+    """成功请求的延迟分布（毫秒）"""
+    if not latencies:
+        return None
+    values = sorted(seconds * 1000 for seconds in latencies)
+    return {
+        "p50": round(_percentile(values, 50), 1),
+        "p95": round(_percentile(values, 95), 1),
+        "p99": round(_percentile(values, 99), 1),
+        "max": round(values[-1], 1),
+        "mean": round(sum(values) / len(values), 1),
+    }
+
+
+async def run_stage(
+    host: str,
+    port: int,
+    bodies: List[Tuple[str, bytes]],
+    concurrency: int,
+    duration: float,
+    timeout: float,
+) -> dict:
+    """
+    以concurrency个并发用户持续发送请求duration秒，每个用户使用独立的长连接，
+    收到响应后立即发送下一个请求，各用户从不同模板开始轮流发送。
+    截止时已发出的请求等待其完成并计入本级结果。
+    """
+    records = []
+    deadline = time.perf_counter() + duration
+
+    async def user(offset: int) -> None:
+        connection = HTTPConnection(host, port)
+        sent = offset
+        try:
+            while time.perf_counter() < deadline:
+                template_type, body = bodies[sent % len(bodies)]
+                sent += 1
+                start = time.perf_counter()
+                try:
+                    status, _, content = await asyncio.wait_for(
+                        connection.request("POST", RENDER_PATH, body), timeout
+                    )
+                    outcome, size = str(status), len(content)
+                except (
+                    OSError,
+                    asyncio.IncompleteReadError,
+                    asyncio.TimeoutError,
+                ) as e:
+                    outcome, size = type(e).__name__, 0
+                records.append(
+                    (template_type, time.perf_counter() - start, outcome, size)
+                )
+        finally:
+            await connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(offset) for offset in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    outcomes: Dict[str, int] = {}
+    for _, _, outcome, _ in records:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    succeeded = [item for item in records if item[2] == "200"]
+    errors = len(records) - len(succeeded)
+
+    templates = {}
+    for template_type, _ in bodies:
+        items = [item for item in records if item[0] == template_type]
+        ok = [item[1] for item in items if item[2] == "200"]
+        templates[template_type] = {
+            "requests": len(items),
+            "errors": len(items) - len(ok),
+            "latency_ms": _latency_summary(ok),
+        }
+
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests": len(records),
+        "errors": errors,
+        "error_rate": round(errors / len(records), 4) if records else 0.0,
+        "throughput_rps": round(len(succeeded) / elapsed, 2) if elapsed else 0.0,
+        "output_bytes_per_second": round(
+            sum(item[3] for item in succeeded) / elapsed if elapsed else 0.0
+        ),
+        "latency_ms": _latency_summary([item[1] for item in succeeded]),
+        "status": dict(sorted(outcomes.items())),
+        "templates": templates,
+    }
+
+
+def _format_bytes(value: Optional[int]) -> str:
+    if value is None:
+        return "-"
+    return f"{value / 1024 / 1024:.1f}MiB"
+
+
+def _print_stage(stage: dict) -> None:
+    latency = stage["latency_ms"] or {}
+    rss = stage.get("rss") or {}
+    print(
+        f"  {stage['projects']:>6}项 并发{stage['concurrency']:>4}  "
+        f"{stage['requests']:>6}次  {stage['throughput_rps']:8.2f}次/秒  "
+        f"p50 {latency.get('p50', 0):8.1f}ms  p95 {latency.get('p95', 0):8.1f}ms  "
+        f"p99 {latency.get('p99', 0):8.1f}ms  错误率 {stage['error_rate']:6.1%}  "
+        f"内存峰值 {_format_bytes(rss.get('total_bytes')):>9}"
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def _metadata(args, url: str) -> dict:
+    return {
+        "format": RESULT_FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "duration": args.duration,
+        "templates": args.templates,
+        "server": {
+            "url": url,
+            "started": args.url is None,
+            "workers": args.workers if args.url is None else None,
+            "env": {**SERVER_ENV_DEFAULTS, **args.env} if args.url is None else None,
+        },
+    }
+
+
+async def run_load(
+    args, host: str, port: int, master_pid: Optional[int]
+) -> Tuple[List[dict], List[dict]]:
+    """逐级加压：项目数量由小到大，每个数量下并发数由低到高"""
+    bodies_by_size = {
+        size: [
+            (
+                template_type,
+                json.dumps(
+                    make_render_request(template_type, size, args.seed),
+                    ensure_ascii=False,
+                ).encode("utf-8"),
+            )
+            for template_type in args.templates
+        ]
+        for size in args.sizes
+    }
+
+    # 每个模板先发送一次请求，连接建立等一次性开销不计入结果
+    connection = HTTPConnection(host, port)
+    try:
+        for _, body in bodies_by_size[min(args.sizes)]:
+            await connection.request("POST", RENDER_PATH, body)
+    finally:
+        await connection.close()
+
+    current = {"stage": None}
+    sampler = None
+    sampler_task = None
+    if master_pid is not None:
+        sampler = RSSSampler(master_pid)
+        if sampler.sample(None) is None:
+            print(f"  无法读取进程 {master_pid} 的内存信息，跳过内存采样")
+            sampler = None
+        else:
+            sampler_task = asyncio.create_task(
+                sampler.run(args.sample_interval, lambda: current["stage"])
+            )
+
+    stages = []
+    try:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                current["stage"] = len(stages)
+                stage = {
+                    "projects": size,
+                    **await run_stage(
+                        host,
+                        port,
+                        bodies_by_size[size],
+                        concurrency,
+                        args.duration,
+                        args.timeout,
+                    ),
+                }
+                if sampler is not None:
+                    sampler.sample(current["stage"])
+                    stage["rss"] = sampler.stage_peak(current["stage"])
+                _print_stage(stage)
+                stages.append(stage)
+    finally:
+        if sampler_task is not None:
+            sampler_task.cancel()
+    return stages, (sampler.samples if sampler is not None else [])
+
+
+def _stage_key(stage: dict) -> tuple:
+    return (stage["projects"], stage["concurrency"])
+
+
+def compare(stages: List[dict], baseline: dict, threshold: float) -> List[str]:
+    """
+    与基线逐级对比吞吐量、p95延迟、错误率与内存峰值：
+    吞吐量低于基线 1/(1 + threshold)、p95延迟或内存峰值超过基线 (1 + threshold) 倍、
+    错误率上升超过1个百分点的记为退化。只对比双方都有的级别，返回退化项的描述。
+    """
+    baseline_stages = {_stage_key(item): item for item in baseline["stages"]}
+    regressions = []
+    print(f"\n=== 与基线对比（阈值 {threshold:.0%}）===")
+    for stage in stages:
+        base = baseline_stages.get(_stage_key(stage))
+        if base is None:
+            continue
+        label = f"{stage['projects']}项/并发{stage['concurrency']}"
+        problems = []
+        line = f"  {label:<16}"
+
+        if stage["throughput_rps"] and base["throughput_rps"]:
+            ratio = stage["throughput_rps"] / base["throughput_rps"]
+            line += f"  吞吐 {ratio:6.2f}x"
+            if ratio < 1 / (1 + threshold):
+                problems.append(
+                    f"吞吐 {base['throughput_rps']:.2f} -> "
+                    f"{stage['throughput_rps']:.2f}次/秒"
+                )
+
+        if stage["latency_ms"] and base["latency_ms"]:
+            current_p95, base_p95 = (
+                stage["latency_ms"]["p95"],
+                base["latency_ms"]["p95"],
+            )
+            ratio = current_p95 / base_p95 if base_p95 else 1.0
+            line += f"  p95 {ratio:6.2f}x"
+            if ratio > 1 + threshold and current_p95 - base_p95 > MIN_LATENCY_DELTA_MS:
+                problems.append(f"p95 {base_p95:.1f}ms -> {current_p95:.1f}ms")
+
+        if stage["error_rate"] - base["error_rate"] > MAX_ERROR_RATE_DELTA:
+            problems.append(
+                f"错误率 {base['error_rate']:.1%} -> {stage['error_rate']:.1%}"
+            )
+
+        current_rss = (stage.get("rss") or {}).get("total_bytes")
+        base_rss = (base.get("rss") or {}).get("total_bytes")
+        if current_rss and base_rss:
+            ratio = current_rss / base_rss
+            line += f"  内存 {ratio:6.2f}x"
+            if ratio > 1 + threshold:
+                problems.append(
+                    f"内存峰值 {_format_bytes(base_rss)} -> {_format_bytes(current_rss)}"
+                )
+
+        if problems:
+            line += "  退化"
+            regressions.append(f"{label}: {', '.join(problems)}")
+        print(line)
+    return regressions
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Excel渲染服务并发压力测试")
+    parser.add_argument(
+        "--sizes", default=DEFAULT_SIZES, help=f"项目数量列表，默认 {DEFAULT_SIZES}"
+    )
+    parser.add_argument(
+        "--concurrency",
+        default=DEFAULT_CONCURRENCY,
+        help=f"逐级加压的并发数列表，默认 {DEFAULT_CONCURRENCY}",
+    )
+    parser.add_argument(
+        "--templates",
+        default=",".join(TEMPLATE_MAP),
+        help="轮流请求的模板类型列表，默认全部模板",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="每一级持续的秒数，默认10"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="启动服务的uvicorn工作进程数，默认4（与Dockerfile一致）",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="启动服务时额外设置的环境变量，可重复指定；默认关闭结果缓存（OUTPUT_CACHE_TTL=0）",
+    )
+    parser.add_argument(
+        "--url", help="压测已运行的服务（如 http://127.0.0.1:8000），不再启动服务"
+    )
+    parser.add_argument(
+        "--pid", type=int, help="配合--url使用：服务主进程号，用于采样内存"
+    )
+    parser.add_argument(
+        "--sample-interval", type=float, default=0.5, help="内存采样间隔（秒），默认0.5"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300.0, help="单个请求的超时时间（秒），默认300"
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=120.0,
+        help="等待服务就绪的最长时间（秒），默认120",
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="随机种子")
+    parser.add_argument("--output", help="结果文件路径，默认写入 benchmarks/results/")
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help=f"对比的基线文件，默认 {DEFAULT_BASELINE}（不存在时跳过对比）",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="将本次结果保存为基线"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="判定退化的比例，默认0.2"
+    )
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(size) for size in _split(args.sizes)]
+    args.concurrency = [int(value) for value in _split(args.concurrency)]
+    args.templates = _split(args.templates)
+    for template_type in args.templates:
+        if template_type not in TEMPLATE_MAP:
+            parser.error(f"未知的模板类型: {template_type}")
+    if not args.sizes or not args.concurrency or not args.templates:
+        parser.error("项目数量、并发数与模板类型至少各指定一个")
+    if min(args.concurrency) < 1 or args.workers < 1:
+        parser.error("并发数与工作进程数至少为1")
+    env = {}
+    for item in args.env:
+        key, sep, value = item.partition("=")
+        if not sep or not key:
+            parser.error(f"环境变量格式应为KEY=VALUE: {item}")
+        env[key] = value
+    args.env = env
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    timestamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{timestamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    process = None
+    if args.url is not None:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+        master_pid = args.pid
+    else:
+        host, port = "127.0.0.1", _free_port()
+        log_path = os.path.splitext(output)[0] + ".server.log"
+        process = start_server(args.workers, port, args.env, log_path)
+        master_pid = process.pid
+        print(f"已启动服务: {args.workers}个工作进程，端口{port}，日志 {log_path}")
+    url = f"http://{host}:{port}"
+
+    print(
+        f"压力测试: 项目数量 {args.sizes}，并发数 {args.concurrency}，"
+        f"模板 {args.templates}，每级 {args.duration:g} 秒"
+    )
+    try:
+        asyncio.run(wait_ready(host, port, args.startup_timeout, process))
+        stages, samples = asyncio.run(run_load(args, host, port, master_pid))
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    report = {
+        "metadata": _metadata(args, url),
+        "stages": stages,
+        "rss_samples": samples,
+    }
+    paths = [output] + ([args.baseline] if args.save_baseline else [])
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {path}")
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(stages, baseline, args.threshold)
+    if regressions:
+        print("\n发现性能退化:")
+        for item in regressions:
+            print(f"  {item}")
+        return 1
+    print("\n未发现性能退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
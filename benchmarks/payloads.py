@@ -0,0 +1,75 @@
+# benchmarks/payloads.py
+import random
+
+# 固定随机种子，保证每次运行生成的负载完全一致
+DEFAULT_SEED = 20241117
+
+_SURNAMES = "张王李赵刘陈杨黄周吴徐孙胡朱高林何郭马罗"
+_GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平"
+_DEPARTMENTS = [
+    "计算机科学与技术学院",
+    "机械工程学院",
+    "材料科学与工程学院",
+    "经济管理学院",
+    "生命科学学院",
+    "马克思主义学院",
+]
+_SOURCES = [
+    "国家自然科学基金委员会",
+    "省科技厅",
+    "市科技局",
+    "某某科技有限公司",
+    "某某研究院",
+]
+_BANKS = ["中国工商银行", "中国建设银行", "中国银行", "招商银行"]
+
+
+def _person(rng: random.Random) -> str:
+    return rng.choice(_SURNAMES) + "".join(rng.choices(_GIVEN_NAMES, k=2))
+
+
+def make_project(rng: random.Random, index: int) -> dict:
+    """生成一个ProjectInfo字典，所有字段均有值"""
+    money = round(rng.uniform(1_000, 500_000), 2)
+    leader = _person(rng)
+    return {
+        "project_code": f"BM{index:06d}",
+        "project_name": f"{rng.choice(_DEPARTMENTS)}基准测试项目{index}",
+        "leader": leader,
+        "department": rng.choice(_DEPARTMENTS),
+        "source": rng.choice(_SOURCES),
+        "close_time": f"{rng.randint(2025, 2030)}-12-31",
+        "money": money,
+        "system_money": round(money * 0.05, 2),
+        "public_consumption": round(money * 0.02, 2),
+        "bank_name": leader,
+        "open_bank": rng.choice(_BANKS) + "某某支行",
+        "bank_num": "".join(rng.choices("0123456789", k=19)),
+        "number": "".join(rng.choices("0123456789", k=17)) + rng.choice("0123456789X"),
+    }
+
+
+def make_notice(project_count: int, seed: int = DEFAULT_SEED) -> dict:
+    """生成含指定数量项目的NoticeData字典，总经费与各项目经费之和一致"""
+    rng = random.Random(seed)
+    projects = [make_project(rng, index) for index in range(project_count)]
+    return {
+        "notice_no": f"BENCH{project_count:06d}",
+        "date": "2024-11-17",
+        "all_money": round(sum(project["money"] for project in projects), 2),
+        "signing_officer": _person(rng),
+        "deputy1_dean": _person(rng),
+        "top_leader": _person(rng),
+        "finance_officer": _person(rng),
+        "deputy2_dean": _person(rng),
+        "research_handler": _person(rng),
+        "finance_handler": _person(rng),
+        "projects": projects,
+    }
+
+
+def make_render_request(
+    template_type: str, project_count: int, seed: int = DEFAULT_SEED
+) -> dict:
+    """生成 /render 接口的请求体"""
+    return {"template_type": template_type, "data": make_notice(project_count, seed)}
@@ -0,0 +1,393 @@
+# benchmarks/run.py
+"""
+渲染性能基准测试：按模板类型与项目数量生成固定的合成数据，
+分别直接调用渲染函数（direct）和在进程内调用FastAPI应用（app），
+记录耗时、tracemalloc内存峰值与输出文件大小，结果写入JSON并可与基线对比。
+
+在项目根目录执行：
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 1,100,1000 --templates 横向 --modes direct
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --baseline benchmarks/baseline.json --threshold 0.2
+"""
+
+import os
+
+# 运行配置需在导入应用模块之前确定：关闭结果缓存使重复请求都真正渲染，
+# 渲染在线程池中执行使tracemalloc能统计到渲染过程，不写指标快照文件
+os.environ.setdefault("OUTPUT_CACHE_TTL", "0")
+os.environ.setdefault("RENDER_EXECUTOR", "thread")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("METRICS_DIR", "")
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import io  # noqa: E402
+import json  # noqa: E402
+import platform  # noqa: E402
+import statistics  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+from datetime import datetime  # noqa: E402
+from typing import Callable, List, Optional  # noqa: E402
+
+from app.api.endpoints.notice import TEMPLATE_DIR, TEMPLATE_MAP  # noqa: E402
+from app.config import (  # noqa: E402
+    RENDER_ENGINE,
+    RENDER_EXECUTOR,
+    RENDER_POOL_SIZE,
+)
+from app.main import app  # noqa: E402
+from app.models.notice import validate_render_request  # noqa: E402
+from app.services.excel_renderer import render_excel_template  # noqa: E402
+from app.services.streaming_renderer import (  # noqa: E402
+    render_excel_template_streaming,
+)
+from app.services.xml_patch_renderer import (  # noqa: E402
+    render_excel_template_patch,
+    supports_patch,
+)
+from app.services.zip_writer import save_workbook  # noqa: E402
+from benchmarks.asgi_client import post_json  # noqa: E402
+from benchmarks.payloads import DEFAULT_SEED, make_render_request  # noqa: E402
+
+RESULT_FORMAT_VERSION = 1
+DEFAULT_SIZES = "1,10,100,1000,10000,50000"
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+RESULTS_DIR = os.path.join("benchmarks", "results")
+RENDER_PATH = "/api/v1/notices/render"
+# 耗时差异小于该值（秒）时不判定为退化，避免小数据量下的计时抖动
+MIN_WALL_DELTA = 0.01
+
+
+def _render_openpyxl(template_path: str, context: dict) -> int:
+    wb = render_excel_template(template_path, context)
+    buffer = io.BytesIO()
+    save_workbook(wb, buffer, template_path)
+    return buffer.tell()
+
+
+def _render_with(render: Callable) -> Callable[[str, dict], int]:
+    def run(template_path: str, context: dict) -> int:
+        buffer = io.BytesIO()
+        render(template_path, context, buffer)
+        return buffer.tell()
+
+    return run
+
+
+DIRECT_ENGINES = {
+    "openpyxl": _render_openpyxl,
+    "streaming": _render_with(render_excel_template_streaming),
+    "patch": _render_with(render_excel_template_patch),
+}
+
+
+def _measure(run: Callable[[], int], repeat: int, warmup: int, memory: bool) -> dict:
+    """
+    预热后重复执行run，记录耗时的中位数与最小值。
+    内存峰值单独执行一次统计，避免tracemalloc的开销计入耗时。
+    """
+    output_bytes = 0
+    for _ in range(warmup):
+        output_bytes = run()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output_bytes = run()
+        timings.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "wall_seconds": round(statistics.median(timings), 6),
+        "wall_seconds_min": round(min(timings), 6),
+        "peak_memory_bytes": peak,
+        "output_bytes": output_bytes,
+        "repeat": repeat,
+    }
+
+
+def _bench_direct(args, template_type: str, size: int) -> List[dict]:
+    template_path = os.path.join(TEMPLATE_DIR, TEMPLATE_MAP[template_type])
+    request = make_render_request(template_type, size, args.seed)
+    context = validate_render_request(request)["data"]
+
+    results = []
+    for engine in args.engines:
+        if engine == "patch" and not supports_patch(template_path):
+            print(f"  跳过 direct/{engine}/{template_type}: 模板不支持XML改写")
+            continue
+        render = DIRECT_ENGINES[engine]
+        measured = _measure(
+            lambda: render(template_path, context),
+            args.repeat,
+            args.warmup,
+            args.memory,
+        )
+        results.append(_result("direct", engine, template_type, size, measured))
+    return results
+
+
+class _AppRunner:
+    """在一个持久的事件循环中运行FastAPI应用（含lifespan），供同步的计时代码逐个发送请求"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._lifespan = app.router.lifespan_context(app)
+
+    def __enter__(self):
+        self.loop.run_until_complete(self._lifespan.__aenter__())
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.loop.run_until_complete(self._lifespan.__aexit__(*exc_info))
+        finally:
+            self.loop.close()
+
+    def render(self, body: bytes) -> int:
+        status, _, content = self.loop.run_until_complete(
+            post_json(app, RENDER_PATH, body)
+        )
+        if status != 200:
+            detail = content[:200].decode("utf-8", "replace")
+            raise RuntimeError(f"渲染请求失败: {status} {detail}")
+        return len(content)
+
+
+def _bench_app(args, runner: _AppRunner, template_type: str, size: int) -> List[dict]:
+    # 请求体在计时前序列化，计时覆盖请求解析、校验、渲染与响应发送
+    body = json.dumps(
+        make_render_request(template_type, size, args.seed), ensure_ascii=False
+    ).encode("utf-8")
+    measured = _measure(
+        lambda: runner.render(body), args.repeat, args.warmup, args.memory
+    )
+    return [_result("app", RENDER_ENGINE, template_type, size, measured)]
+
+
+def _result(mode: str, engine: str, template_type: str, size: int, measured: dict):
+    return {
+        "mode": mode,
+        "engine": engine,
+        "template": template_type,
+        "projects": size,
+        **measured,
+    }
+
+
+def _result_key(result: dict) -> tuple:
+    return (result["mode"], result["engine"], result["template"], result["projects"])
+
+
+def _format_bytes(value: Optional[int]) -> str:
+    if value is None:
+        return "-"
+    if value >= 1024 * 1024:
+        return f"{value / 1024 / 1024:.1f}MiB"
+    return f"{value / 1024:.1f}KiB"
+
+
+def _print_result(result: dict) -> None:
+    print(
+        f"  {result['mode']:<6} {result['engine']:<9} {result['template']:<10} "
+        f"{result['projects']:>6}项  耗时 {result['wall_seconds']:.3f}s  "
+        f"内存峰值 {_format_bytes(result['peak_memory_bytes']):>9}  "
+        f"输出 {_format_bytes(result['output_bytes']):>9}"
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def _metadata(args) -> dict:
+    return {
+        "format": RESULT_FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "config": {
+            "RENDER_ENGINE": RENDER_ENGINE,
+            "RENDER_EXECUTOR": RENDER_EXECUTOR,
+            "RENDER_POOL_SIZE": RENDER_POOL_SIZE,
+        },
+    }
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> List[str]:
+    """
+    与基线逐项对比耗时中位数与内存峰值，超过基线 (1 + threshold) 倍的记为退化。
+    只对比双方都有的组合，返回退化项的描述。
+    """
+    baseline_results = {_result_key(item): item for item in baseline["results"]}
+    regressions = []
+    print(f"\n=== 与基线对比（阈值 {threshold:.0%}）===")
+    for result in results:
+        base = baseline_results.get(_result_key(result))
+        if base is None:
+            continue
+        label = "/".join(str(part) for part in _result_key(result))
+        wall_ratio = result["wall_seconds"] / base["wall_seconds"]
+        line = f"  {label:<40} 耗时 {wall_ratio:6.2f}x"
+        problems = []
+        if (
+            wall_ratio > 1 + threshold
+            and result["wall_seconds"] - base["wall_seconds"] > MIN_WALL_DELTA
+        ):
+            problems.append(
+                f"耗时 {base['wall_seconds']:.3f}s -> {result['wall_seconds']:.3f}s"
+            )
+
+        if result["peak_memory_bytes"] and base.get("peak_memory_bytes"):
+            memory_ratio = result["peak_memory_bytes"] / base["peak_memory_bytes"]
+            line += f"  内存 {memory_ratio:6.2f}x"
+            if memory_ratio > 1 + threshold:
+                problems.append(
+                    f"内存峰值 {_format_bytes(base['peak_memory_bytes'])} -> "
+                    f"{_format_bytes(result['peak_memory_bytes'])}"
+                )
+
+        if problems:
+            line += "  退化"
+            regressions.append(f"{label}: {', '.join(problems)}")
+        print(line)
+    return regressions
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Excel渲染性能基准测试")
+    parser.add_argument(
+        "--sizes", default=DEFAULT_SIZES, help=f"项目数量列表，默认 {DEFAULT_SIZES}"
+    )
+    parser.add_argument(
+        "--templates",
+        default=",".join(TEMPLATE_MAP),
+        help="模板类型列表，默认全部模板",
+    )
+    parser.add_argument(
+        "--modes", default="direct,app", help="测试方式：direct、app，默认两者都测"
+    )
+    parser.add_argument(
+        "--engines",
+        default="openpyxl",
+        help="direct方式使用的渲染引擎：openpyxl、streaming、patch，默认openpyxl；"
+        "app方式使用RENDER_ENGINE配置",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="每个组合的计时次数")
+    parser.add_argument("--warmup", type=int, default=1, help="计时前的预热次数")
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="不统计tracemalloc内存峰值（大数据量时可显著缩短运行时间）",
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="随机种子")
+    parser.add_argument("--output", help="结果文件路径，默认写入 benchmarks/results/")
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help=f"对比的基线文件，默认 {DEFAULT_BASELINE}（不存在时跳过对比）",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="将本次结果保存为基线"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="判定退化的比例，默认0.2"
+    )
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(size) for size in _split(args.sizes)]
+    args.templates = _split(args.templates)
+    args.modes = _split(args.modes)
+    args.engines = _split(args.engines)
+    for template_type in args.templates:
+        if template_type not in TEMPLATE_MAP:
+            parser.error(f"未知的模板类型: {template_type}")
+    for mode in args.modes:
+        if mode not in ("direct", "app"):
+            parser.error(f"未知的测试方式: {mode}")
+    for engine in args.engines:
+        if engine not in DIRECT_ENGINES:
+            parser.error(f"未知的渲染引擎: {engine}")
+    if args.repeat < 1:
+        parser.error("--repeat 至少为1")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    metadata = _metadata(args)
+    print(
+        f"基准测试: 项目数量 {args.sizes}，模板 {args.templates}，方式 {args.modes}，"
+        f"RENDER_ENGINE={RENDER_ENGINE}，RENDER_EXECUTOR={RENDER_EXECUTOR}"
+    )
+
+    results = []
+    if "direct" in args.modes:
+        for size in args.sizes:
+            for template_type in args.templates:
+                for result in _bench_direct(args, template_type, size):
+                    _print_result(result)
+                    results.append(result)
+    if "app" in args.modes:
+        with _AppRunner() as runner:
+            for size in args.sizes:
+                for template_type in args.templates:
+                    for result in _bench_app(args, runner, template_type, size):
+                        _print_result(result)
+                        results.append(result)
+
+    report = {"metadata": metadata, "results": results}
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    paths = [output] + ([args.baseline] if args.save_baseline else [])
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {path}")
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\n发现性能退化:")
+        for item in regressions:
+            print(f"  {item}")
+        return 1
+    print("\n未发现性能退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# tests/conftest.py
+import io
+import os
+import tempfile
+
+# 配置在导入app时读取，须在导入之前设置：渲染池使用线程（进程池的子进程会重新导入测试模块），
+# 指标与性能分析结果写入临时目录
+_TMP_DIR = tempfile.mkdtemp(prefix="excel-fund-tests-")
+os.environ["RENDER_EXECUTOR"] = "thread"
+os.environ["LOG_LEVEL"] = "WARNING"
+os.environ["METRICS_DIR"] = os.path.join(_TMP_DIR, "metrics")
+os.environ["PROFILE_DIR"] = os.path.join(_TMP_DIR, "profiles")
+os.environ["OUTPUT_CACHE_DIR"] = ""
+os.environ["RERENDER_CACHE_DIR"] = ""
+os.environ["JOB_DIR"] = ""
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.config import OUTPUT_SPOOL_MAX_SIZE, TEMPLATE_DIR, TEMPLATE_MAP  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.notice import validate_render_request  # noqa: E402
+from app.services.excel_renderer import (  # noqa: E402
+    render_excel_template,
+    save_workbook_to_buffer,
+)
+from app.services.output_cache import output_cache  # noqa: E402
+from app.services.streaming_renderer import render_excel_template_streaming  # noqa: E402
+from app.services.xml_patch_renderer import (  # noqa: E402
+    render_excel_template_patch,
+    supports_patch,
+)
+from benchmarks.payloads import make_render_request  # noqa: E402
+
+
+def template_path(template_type: str) -> str:
+    """模板类型对应的模板文件路径"""
+    return os.path.join(TEMPLATE_DIR, TEMPLATE_MAP[template_type])
+
+
+def make_context(template_type: str, project_count: int, seed: int = 1) -> dict:
+    """生成经过校验的渲染上下文，与渲染接口交给渲染引擎的数据相同"""
+    return validate_render_request(
+        make_render_request(template_type, project_count, seed)
+    )["data"]
+
+
+def render_with_engine(engine: str, template_type: str, context: dict) -> bytes:
+    """使用指定引擎渲染，返回输出文件的内容"""
+    path = template_path(template_type)
+    if engine == "openpyxl":
+        wb = render_excel_template(path, context)
+        with save_workbook_to_buffer(wb, OUTPUT_SPOOL_MAX_SIZE, path) as buffer:
+            return buffer.read()
+    render = (
+        render_excel_template_patch
+        if engine == "patch"
+        else render_excel_template_streaming
+    )
+    output = io.BytesIO()
+    render(path, context, output)
+    return output.getvalue()
+
+
+def skip_unsupported(engine: str, template_type: str) -> None:
+    """模板不支持XML改写时跳过patch引擎的测试"""
+    if engine == "patch" and not supports_patch(template_path(template_type)):
+        pytest.skip(f"模板不支持XML改写: {template_type}")
+
+
+@pytest.fixture
+def client():
+    """启动服务（预热、渲染池与任务队列）的测试客户端，渲染结果缓存为空"""
+    output_cache.clear()
+    with TestClient(app) as client:
+        yield client
+    output_cache.clear()
@@ -0,0 +1,134 @@
+# tests/test_admission.py
+"""内存准入：预算不足时按策略拒绝、改用内存占用更低的引擎或排队，渲染结束后归还预算"""
+
+import asyncio
+import logging
+
+import pytest
+
+from app.services.admission import (
+    AdmissionRejectedError,
+    MemoryAdmission,
+    estimate_candidates,
+    render_admission,
+)
+from benchmarks.payloads import make_render_request
+from conftest import make_context, template_path
+
+RENDER_URL = "/api/v1/notices/render"
+CANDIDATES = [("patch", 60), ("streaming", 20)]
+REQUEST = make_render_request("横向", 2000, seed=96)
+
+
+def test_admits_within_budget_and_releases():
+    admission = MemoryAdmission(100, "reject", 1)
+
+    async def main():
+        first = await admission.admit(CANDIDATES)
+        assert (first.engine, first.cost, first.result) == ("patch", 60, "admitted")
+        with pytest.raises(AdmissionRejectedError) as excinfo:
+            await admission.admit(CANDIDATES)
+        assert excinfo.value.retry_after >= 1
+        admission.release(first)
+        return await admission.admit(CANDIDATES)
+
+    assert asyncio.run(main()).result == "admitted"
+
+
+def test_degrade_uses_lower_memory_engine():
+    admission = MemoryAdmission(100, "degrade", 1)
+
+    async def main():
+        await admission.admit(CANDIDATES)
+        return await admission.admit(CANDIDATES)
+
+    degraded = asyncio.run(main())
+    assert (degraded.engine, degraded.cost, degraded.result) == (
+        "streaming",
+        20,
+        "degraded",
+    )
+    assert admission.reserved == 80
+
+
+def test_queue_admits_in_order_after_release():
+    admission = MemoryAdmission(100, "queue", 5)
+
+    async def main():
+        first = await admission.admit(CANDIDATES)
+        second = asyncio.create_task(admission.admit(CANDIDATES))
+        await asyncio.sleep(0)
+        assert admission.waiting == 1
+        admission.release(first)
+        return await second
+
+    assert asyncio.run(main()).result == "queued"
+    assert admission.waiting == 0
+
+
+def test_queue_times_out():
+    admission = MemoryAdmission(100, "queue", 0.05)
+
+    async def main():
+        await admission.admit(CANDIDATES)
+        with pytest.raises(AdmissionRejectedError):
+            await admission.admit(CANDIDATES)
+
+    asyncio.run(main())
+    assert admission.waiting == 0
+    assert admission.reserved == 60
+
+
+def test_oversized_render_runs_alone():
+    admission = MemoryAdmission(100, "reject", 1)
+
+    async def main():
+        return await admission.admit([("openpyxl", 500)])
+
+    assert asyncio.run(main()).result == "admitted"
+
+
+def test_estimates_decrease_along_candidates():
+    context = make_context("横向", 200)
+    candidates = estimate_candidates(template_path("横向"), context)
+    costs = [cost for _, cost in candidates]
+    assert costs == sorted(costs, reverse=True)
+
+
+@pytest.fixture
+def held_budget(monkeypatch):
+    """已有一次渲染占用部分预算，剩余预算容纳不下patch引擎，但容纳得下streaming引擎"""
+    (_, patch_cost), (_, streaming_cost) = estimate_candidates(
+        template_path("横向"), make_context("横向", 2000, seed=96)
+    )
+    held = patch_cost
+    monkeypatch.setattr(
+        render_admission, "budget", held + (patch_cost + streaming_cost) // 2
+    )
+    render_admission._reserve(held)
+    yield held
+    render_admission._unreserve(held)
+
+
+def render_summary(caplog, client, policy: str, monkeypatch):
+    monkeypatch.setattr(render_admission, "policy", policy)
+    caplog.set_level(logging.INFO, logger="app.api.endpoints.notice")
+    response = client.post(RENDER_URL, json=REQUEST)
+    (summary,) = [r.summary for r in caplog.records if hasattr(r, "summary")]
+    return response, summary
+
+
+def test_render_is_rejected_over_budget(monkeypatch, caplog, client, held_budget):
+    response, summary = render_summary(caplog, client, "reject", monkeypatch)
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert summary["admission"] == "rejected"
+
+
+def test_render_degrades_over_budget(monkeypatch, caplog, client, held_budget):
+    response, summary = render_summary(caplog, client, "degrade", monkeypatch)
+    assert response.status_code == 200
+    assert summary["admission"] == "degraded"
+    assert summary["engine"] == "streaming"
+    # 渲染结束后归还预留的内存
+    assert render_admission.reserved == held_budget
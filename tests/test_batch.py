@@ -0,0 +1,75 @@
+# tests/test_batch.py
+"""批量渲染：zip中的Excel文件与逐项报告，单项失败不影响其他通知单"""
+
+import io
+import json
+import zipfile
+
+import openpyxl
+
+from app.api.endpoints import notice
+from benchmarks.payloads import make_render_request
+
+BATCH_URL = "/api/v1/notices/render/batch"
+
+
+def read_batch(response) -> tuple:
+    """批量渲染结果zip中的逐项报告与各Excel文件的内容"""
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.testzip() is None
+        report = json.loads(zf.read(notice.BATCH_REPORT_NAME))
+        files = {
+            name: zf.read(name)
+            for name in zf.namelist()
+            if name != notice.BATCH_REPORT_NAME
+        }
+    return report, files
+
+
+def test_batch_zip_contains_results_and_report(client):
+    requests = [
+        make_render_request("横向", 5, seed=31),
+        {"template_type": "横向", "data": {"notice_no": "BAD"}},
+        make_render_request("纵向", 8, seed=32),
+    ]
+
+    response = client.post(BATCH_URL, json=requests)
+    assert response.status_code == 200
+    assert response.headers["X-Batch-Succeeded"] == "2"
+    assert response.headers["X-Batch-Failed"] == "1"
+
+    report, files = read_batch(response)
+    assert [item["status"] for item in report] == ["ok", "invalid", "ok"]
+    assert sorted(files) == sorted(report[i]["filename"] for i in (0, 2))
+    wb = openpyxl.load_workbook(io.BytesIO(files[report[2]["filename"]]))
+    values = [v for row in wb.active.iter_rows(values_only=True) for v in row]
+    assert requests[2]["data"]["projects"][0]["project_code"] in values
+
+
+def test_unexpected_item_error_is_reported(monkeypatch, client):
+    render_output = notice._render_output
+
+    async def failing_render_output(template_path, context, *args, **kwargs):
+        if context["notice_no"] == "FAIL":
+            raise RuntimeError("模拟的渲染错误")
+        return await render_output(template_path, context, *args, **kwargs)
+
+    monkeypatch.setattr(notice, "_render_output", failing_render_output)
+    failing = make_render_request("横向", 3, seed=33)
+    failing["data"]["notice_no"] = "FAIL"
+    requests = [failing, make_render_request("横向", 3, seed=34)]
+
+    response = client.post(BATCH_URL, json=requests)
+    assert response.status_code == 200
+    report, files = read_batch(response)
+    assert report[0]["status"] == "failed"
+    assert "模拟的渲染错误" in report[0]["error"]
+    assert report[1]["status"] == "ok"
+    assert list(files) == [report[1]["filename"]]
+
+
+def test_batch_size_is_limited(monkeypatch, client):
+    monkeypatch.setattr(notice, "BATCH_MAX_ITEMS", 2)
+    requests = [make_render_request("横向", 1, seed=35 + i) for i in range(3)]
+
+    assert client.post(BATCH_URL, json=requests).status_code == 413
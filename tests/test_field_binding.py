@@ -0,0 +1,29 @@
+# tests/test_field_binding.py
+"""简单占位符直接绑定字段：数值与日期字段写为Excel原生类型"""
+
+import io
+
+import openpyxl
+import pytest
+
+from app.config import TEMPLATE_MAP
+from conftest import make_context, render_with_engine, skip_unsupported
+
+
+def sheet_values(content: bytes) -> list:
+    wb = openpyxl.load_workbook(io.BytesIO(content))
+    return [value for row in wb.active.iter_rows(values_only=True) for value in row]
+
+
+@pytest.mark.parametrize("template_type", list(TEMPLATE_MAP))
+@pytest.mark.parametrize("engine", ["openpyxl", "patch", "streaming"])
+def test_numeric_fields_written_as_numbers(engine, template_type):
+    skip_unsupported(engine, template_type)
+    context = make_context(template_type, 5, seed=7)
+
+    values = sheet_values(render_with_engine(engine, template_type, context))
+
+    for project in context["projects"]:
+        assert project["money"] in values
+        assert str(project["money"]) not in values
+    assert context["all_money"] in values
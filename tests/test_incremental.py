@@ -0,0 +1,150 @@
+# tests/test_incremental.py
+"""增量渲染的输出与完整渲染相同"""
+
+import copy
+import io
+import pickle
+import zipfile
+
+import pytest
+
+from app.config import TEMPLATE_MAP
+from app.services import xml_patch_renderer
+from app.services.render_fingerprints import (
+    fingerprint_from_json,
+    fingerprint_store,
+    fingerprint_to_json,
+    make_fingerprint_key,
+)
+from app.services.xml_patch_renderer import render_excel_template_patch, supports_patch
+from conftest import make_context, template_path
+
+PATCH_TEMPLATES = [
+    template_type
+    for template_type in TEMPLATE_MAP
+    if supports_patch(template_path(template_type))
+]
+
+
+@pytest.fixture(autouse=True)
+def incremental(monkeypatch):
+    """所有通知都使用增量渲染，指纹不受其他测试影响"""
+    monkeypatch.setattr(xml_patch_renderer, "RERENDER_MIN_PROJECTS", 1)
+    fingerprint_store.clear()
+    yield
+    fingerprint_store.clear()
+
+
+def render(template_type: str, context: dict, compresslevel: int) -> bytes:
+    output = io.BytesIO()
+    render_excel_template_patch(
+        template_path(template_type), context, output, compresslevel=compresslevel
+    )
+    return output.getvalue()
+
+
+def render_full(monkeypatch, template_type: str, context: dict, compresslevel: int):
+    """关闭渲染指纹后的完整渲染"""
+    with monkeypatch.context() as patch:
+        patch.setattr(fingerprint_store, "ttl", 0)
+        return render(template_type, context, compresslevel)
+
+
+def entries(content: bytes) -> list:
+    """压缩包中各条目的属性与解压后的内容"""
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        assert zf.testzip() is None
+        return [
+            (info.filename, info.date_time, info.external_attr, zf.read(info))
+            for info in zf.infolist()
+        ]
+
+
+def edits(context: dict) -> list:
+    """对通知的一系列修改，每一步在上一步的基础上进行"""
+    modified = copy.deepcopy(context)
+    modified["projects"][5]["project_name"] += "（变更）"
+    modified["projects"][-3]["money"] += 100
+    inserted = copy.deepcopy(modified)
+    inserted["projects"].insert(10, copy.deepcopy(inserted["projects"][0]))
+    deleted = copy.deepcopy(inserted)
+    del deleted["projects"][2]
+    del deleted["projects"][-1]
+    totals = copy.deepcopy(deleted)
+    totals["all_money"] += 1
+    return [
+        ("unchanged", context),
+        ("modify", modified),
+        ("insert", inserted),
+        ("delete", deleted),
+        ("totals", totals),
+    ]
+
+
+@pytest.mark.parametrize("template_type", PATCH_TEMPLATES)
+def test_stored_incremental_render_is_byte_identical(monkeypatch, template_type):
+    context = make_context(template_type, 300, seed=3)
+    render(template_type, context, 0)
+
+    for _, edited in edits(context):
+        incremental = render(template_type, edited, 0)
+        assert incremental == render_full(monkeypatch, template_type, edited, 0)
+
+
+@pytest.mark.parametrize("template_type", PATCH_TEMPLATES)
+@pytest.mark.parametrize("compresslevel", [1, 6])
+def test_compressed_incremental_render_matches_full(
+    monkeypatch, template_type, compresslevel
+):
+    context = make_context(template_type, 300, seed=5)
+    render(template_type, context, compresslevel)
+
+    for _, edited in edits(context):
+        incremental = render(template_type, edited, compresslevel)
+        full = render_full(monkeypatch, template_type, edited, compresslevel)
+        assert entries(incremental) == entries(full)
+
+
+def test_fingerprint_json_round_trip():
+    context = make_context("横向", 50, seed=9)
+    render("横向", context, 6)
+    key = make_fingerprint_key(template_path("横向"), str(context["notice_no"]))
+    fingerprint = fingerprint_store.get(key)
+
+    assert fingerprint is not None
+    assert fingerprint_from_json(fingerprint_to_json(fingerprint)) == fingerprint
+
+
+def test_disk_fingerprints_shared_between_processes(monkeypatch, tmp_path):
+    monkeypatch.setattr(fingerprint_store, "disk_dir", str(tmp_path))
+    monkeypatch.setattr(fingerprint_store, "disk_max_size", 64 * 1024 * 1024)
+    context = make_context("横向", 50, seed=10)
+    render("横向", context, 6)
+    # 其他进程只能从磁盘层读到指纹
+    fingerprint_store.clear()
+
+    edited = copy.deepcopy(context)
+    edited["projects"][1]["project_name"] += "（变更）"
+    incremental = render("横向", edited, 6)
+    assert entries(incremental) == entries(render_full(monkeypatch, "横向", edited, 6))
+
+
+def test_untrusted_fingerprint_file_is_not_executed(monkeypatch, tmp_path):
+    monkeypatch.setattr(fingerprint_store, "disk_dir", str(tmp_path))
+    context = make_context("横向", 50, seed=11)
+    key = make_fingerprint_key(template_path("横向"), str(context["notice_no"]))
+    marker = tmp_path / "executed"
+
+    class Payload:
+        def __reduce__(self):
+            return (open, (str(marker), "w"))
+
+    with open(tmp_path / f"{key}{fingerprint_store.disk_suffix}", "wb") as f:
+        f.write(pickle.dumps(Payload()))
+
+    assert fingerprint_store.get(key) is None
+    assert not marker.exists()
+    # 无法读取的指纹按完整渲染处理
+    assert entries(render("横向", context, 6)) == entries(
+        render_full(monkeypatch, "横向", context, 6)
+    )
@@ -0,0 +1,65 @@
+# tests/test_logging.py
+"""日志：请求摘要、逐项目日志的抽样，日志消息按%格式延迟格式化"""
+
+import ast
+import json
+import logging
+import pathlib
+
+import pytest
+
+from app import logging_config
+from app.logging_config import log_summary, sampled_indices
+from benchmarks.payloads import make_render_request
+
+RENDER_URL = "/api/v1/notices/render"
+APP_DIR = pathlib.Path(__file__).parent.parent / "app"
+LOG_METHODS = {"debug", "info", "warning", "error", "exception", "critical", "log"}
+
+
+def summaries(caplog) -> list:
+    return [record.summary for record in caplog.records if hasattr(record, "summary")]
+
+
+def test_log_summary_is_structured(caplog):
+    logger = logging.getLogger("tests.summary")
+    caplog.set_level(logging.INFO, logger="tests.summary")
+    log_summary(logger, request_id="r1", status=200, size=10)
+
+    (record,) = caplog.records
+    assert record.summary == {"request_id": "r1", "status": 200, "size": 10}
+    assert json.loads(record.getMessage().split(" ", 1)[1]) == record.summary
+
+
+@pytest.mark.parametrize(
+    "rate, expected", [(1.0, [0, 1, 2, 3, 4]), (0.5, [0, 2, 4]), (0, [])]
+)
+def test_project_logs_are_sampled(monkeypatch, rate, expected):
+    monkeypatch.setattr(logging_config, "LOG_PROJECT_SAMPLE_RATE", rate)
+    assert list(sampled_indices(5)) == expected
+
+
+def test_each_request_logs_one_summary(caplog, client):
+    caplog.set_level(logging.INFO, logger="app.api.endpoints.notice")
+    response = client.post(RENDER_URL, json=make_render_request("横向", 3, seed=51))
+    assert response.status_code == 200
+
+    (summary,) = summaries(caplog)
+    assert summary["status"] == 200
+    assert summary["template_type"] == "横向"
+
+
+def test_log_messages_are_not_formatted_eagerly():
+    """日志消息不使用f-string，参数在日志级别启用时才格式化"""
+    eager = []
+    for path in APP_DIR.rglob("*.py"):
+        for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+            if (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr in LOG_METHODS
+                and "log" in ast.unparse(node.func.value).lower()
+                and any(isinstance(arg, ast.JoinedStr) for arg in node.args[:2])
+            ):
+                eager.append(f"{path.name}:{node.lineno}")
+    assert eager == []
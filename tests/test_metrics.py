@@ -0,0 +1,59 @@
+# tests/test_metrics.py
+"""渲染阶段耗时：各引擎记录相同的阶段，各阶段不重复计时"""
+
+import io
+import time
+
+import pytest
+
+from app.services import xml_patch_renderer
+from app.services.excel_renderer import render_excel_template
+from app.services.metrics import RenderStats
+from app.services.render_fingerprints import fingerprint_store
+from app.services.streaming_renderer import render_excel_template_streaming
+from app.services.xml_patch_renderer import render_excel_template_patch
+from conftest import make_context, skip_unsupported, template_path
+
+RENDER_STAGES = {"template_load", "loop_scan", "loop_expand", "scalar_render"}
+
+
+def render_stats(engine: str, context: dict) -> tuple:
+    """渲染并返回 (各阶段耗时, 总耗时)"""
+    path = template_path("横向")
+    stats = RenderStats(engine=engine)
+    started = time.perf_counter()
+    if engine == "openpyxl":
+        render_excel_template(path, context, stats=stats)
+    else:
+        render = (
+            render_excel_template_patch
+            if engine == "patch"
+            else render_excel_template_streaming
+        )
+        render(path, context, io.BytesIO(), stats=stats)
+    return stats.stages, time.perf_counter() - started
+
+
+@pytest.mark.parametrize("engine", ["openpyxl", "streaming", "patch"])
+def test_engines_record_render_stages(engine):
+    skip_unsupported(engine, "横向")
+    stages, elapsed = render_stats(engine, make_context("横向", 20))
+
+    # openpyxl引擎的序列化在渲染池中计时
+    expected = RENDER_STAGES if engine == "openpyxl" else RENDER_STAGES | {"save"}
+    assert set(stages) == expected
+    assert sum(stages.values()) <= elapsed
+
+
+def test_incremental_patch_records_render_stages(monkeypatch):
+    skip_unsupported("patch", "横向")
+    monkeypatch.setattr(xml_patch_renderer, "RERENDER_MIN_PROJECTS", 1)
+    fingerprint_store.clear()
+    try:
+        context = make_context("横向", 20, seed=61)
+        for _ in range(2):
+            stages, elapsed = render_stats("patch", context)
+            assert set(stages) == RENDER_STAGES | {"save"}
+            assert sum(stages.values()) <= elapsed
+    finally:
+        fingerprint_store.clear()
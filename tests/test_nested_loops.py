@@ -0,0 +1,117 @@
+# tests/test_nested_loops.py
+"""嵌套循环：内层循环的列表可以是外层项目的属性（如 item.children）"""
+
+import io
+import zipfile
+
+import openpyxl
+import pytest
+
+from app.services.admission import estimate_render_memory
+from app.services.excel_renderer import render_excel_template, save_workbook_to_buffer
+from app.services.streaming_renderer import render_excel_template_streaming
+from app.services.xml_patch_renderer import (
+    render_excel_template_patch,
+    supports_patch,
+)
+
+CONTEXT = {
+    "notice_no": "N001",
+    "all_money": 6,
+    "projects": [
+        {
+            "project_code": "P1",
+            "project_name": "甲",
+            "children": [{"name": "c1", "money": 1}, {"name": "c2", "money": 2}],
+        },
+        {"project_code": "P2", "project_name": "乙", "children": []},
+        {
+            "project_code": "P3",
+            "project_name": "丙",
+            "children": [{"name": "c3", "money": 3}],
+        },
+    ],
+}
+
+EXPECTED_ROWS = [
+    ("通知 N001", None),
+    ("P1", "甲"),
+    ("c1", 1),
+    ("c2", 2),
+    ("小计", "甲"),
+    ("P2", "乙"),
+    ("小计", "乙"),
+    ("P3", "丙"),
+    ("c3", 3),
+    ("小计", "丙"),
+    ("合计", 6),
+]
+
+
+@pytest.fixture(scope="module")
+def nested_template(tmp_path_factory) -> str:
+    """每个项目一行，其下每个子项一行，最后是该项目的小计行"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["通知 {{ notice_no }}"])
+    ws.append(
+        ["{% for item in projects %}{{ item.project_code }}", "{{ item.project_name }}"]
+    )
+    ws.append(
+        [
+            "{% for child in item.children %}{{ child.name }}",
+            "{{ child.money }}{% endfor %}",
+        ]
+    )
+    ws.append(["小计", "{{ item.project_name }}{% endfor %}"])
+    ws.append(["合计", "{{ all_money }}"])
+    content = io.BytesIO()
+    wb.save(content)
+
+    # openpyxl总是写出空的definedNames，XML改写引擎不支持带定义名称的工作簿
+    path = str(tmp_path_factory.mktemp("templates") / "nested.xlsx")
+    with zipfile.ZipFile(content) as src, zipfile.ZipFile(path, "w") as dst:
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename == "xl/workbook.xml":
+                data = data.replace(b"<definedNames />", b"")
+            dst.writestr(info, data)
+    return path
+
+
+def render(engine: str, template_path: str) -> bytes:
+    if engine == "openpyxl":
+        wb = render_excel_template(template_path, CONTEXT)
+        with save_workbook_to_buffer(wb, 1024 * 1024, template_path) as buffer:
+            return buffer.read()
+    output = io.BytesIO()
+    if engine == "patch":
+        assert supports_patch(template_path)
+        render_excel_template_patch(template_path, CONTEXT, output)
+    else:
+        render_excel_template_streaming(template_path, CONTEXT, output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("engine", ["openpyxl", "streaming", "patch"])
+def test_inner_loop_over_item_attribute(nested_template, engine):
+    wb = openpyxl.load_workbook(io.BytesIO(render(engine, nested_template)))
+    rows = [tuple(row[:2]) for row in wb.active.iter_rows(values_only=True) if any(row)]
+    assert rows == EXPECTED_ROWS
+
+
+def test_admission_counts_rows_of_item_attribute_lists(nested_template):
+    empty = {**CONTEXT, "projects": []}
+    # 3个项目各2行（项目行与小计行），加上3个子项各1行
+    cells = estimate_render_memory(
+        nested_template, CONTEXT, "streaming"
+    ) - estimate_render_memory(nested_template, empty, "streaming")
+    per_row = (
+        estimate_render_memory(
+            nested_template,
+            {**CONTEXT, "projects": CONTEXT["projects"][1:2]},
+            "streaming",
+        )
+        - estimate_render_memory(nested_template, empty, "streaming")
+    ) / 2
+    assert cells == pytest.approx(9 * per_row, rel=0.01)
@@ -0,0 +1,58 @@
+# tests/test_output_cache.py
+"""渲染结果缓存与条件请求：缓存命中、ETag与304"""
+
+from benchmarks.payloads import make_render_request
+
+RENDER_URL = "/api/v1/notices/render"
+
+
+def test_render_cache_hit_and_not_modified(client):
+    request = make_render_request("横向", 20, seed=11)
+
+    first = client.post(RENDER_URL, json=request)
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    second = client.post(RENDER_URL, json=request)
+    assert second.status_code == 200
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.headers["ETag"] == etag
+    assert second.content == first.content
+
+    for if_none_match in (etag, etag[2:], f'"other", {etag}', "*"):
+        response = client.post(
+            RENDER_URL, json=request, headers={"If-None-Match": if_none_match}
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+
+def test_render_cache_key_covers_data_and_compression(client):
+    request = make_render_request("横向", 20, seed=12)
+    etag = client.post(RENDER_URL, json=request).headers["ETag"]
+
+    stored = client.post(RENDER_URL, params={"compresslevel": 0}, json=request)
+    assert stored.headers["X-Cache"] == "MISS"
+    assert stored.headers["ETag"] != etag
+
+    request["data"]["projects"][0]["project_name"] += "（变更）"
+    changed = client.post(RENDER_URL, json=request, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["X-Cache"] == "MISS"
+    assert changed.headers["ETag"] != etag
+
+
+def test_wildcard_matches_only_cached_output(client):
+    request = make_render_request("纵向", 5, seed=14)
+
+    first = client.post(RENDER_URL, json=request, headers={"If-None-Match": "*"})
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    assert first.content
+
+    cached = client.post(RENDER_URL, json=request, headers={"If-None-Match": "*"})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == first.headers["ETag"]
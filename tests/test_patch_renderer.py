@@ -0,0 +1,57 @@
+# tests/test_patch_renderer.py
+"""XML改写与流式引擎对同一通知的输出与openpyxl引擎一致：单元格值、合并区域与打印区域"""
+
+import io
+import zipfile
+
+import openpyxl
+import pytest
+
+from app.config import TEMPLATE_MAP
+from conftest import make_context, render_with_engine, skip_unsupported, template_path
+
+
+def workbook_summary(content: bytes) -> dict:
+    """工作表名称 -> (单元格值, 合并区域, 打印区域, 打印标题行)"""
+    wb = openpyxl.load_workbook(io.BytesIO(content))
+    return {
+        ws.title: (
+            [list(row) for row in ws.iter_rows(values_only=True)],
+            sorted(str(merged) for merged in ws.merged_cells.ranges),
+            ws.print_area,
+            ws.print_title_rows,
+        )
+        for ws in wb.worksheets
+    }
+
+
+@pytest.mark.parametrize("template_type", list(TEMPLATE_MAP))
+@pytest.mark.parametrize("engine", ["patch", "streaming"])
+@pytest.mark.parametrize("project_count", [0, 1, 40])
+def test_engine_matches_openpyxl(engine, template_type, project_count):
+    skip_unsupported(engine, template_type)
+    context = make_context(template_type, project_count, seed=project_count)
+
+    expected = workbook_summary(render_with_engine("openpyxl", template_type, context))
+    actual = workbook_summary(render_with_engine(engine, template_type, context))
+
+    assert actual.keys() == expected.keys()
+    for title, (values, merges, print_area, print_titles) in expected.items():
+        actual_values, actual_merges, actual_area, actual_titles = actual[title]
+        assert actual_values == values
+        assert actual_merges == merges
+        assert actual_area == print_area
+        assert actual_titles == print_titles
+
+
+@pytest.mark.parametrize("template_type", list(TEMPLATE_MAP))
+def test_untouched_parts_copied_unchanged(template_type):
+    skip_unsupported("patch", template_type)
+    content = render_with_engine("patch", template_type, make_context(template_type, 5))
+
+    with zipfile.ZipFile(template_path(template_type)) as template:
+        with zipfile.ZipFile(io.BytesIO(content)) as output:
+            assert output.namelist() == template.namelist()
+            for name in template.namelist():
+                if not name.startswith("xl/worksheets/sheet"):
+                    assert output.read(name) == template.read(name), name
@@ -0,0 +1,64 @@
+# tests/test_profiling.py
+"""性能分析：令牌校验、频率限制，线程渲染池下在单独的渲染进程中执行"""
+
+import os
+from collections import deque
+
+import pytest
+
+from app.services import profiling, render_pool
+from app.services.profiling import profile_limiter
+from benchmarks.payloads import make_render_request
+
+RENDER_URL = "/api/v1/notices/render?profile=true"
+TOKEN = "test-profile-token"
+
+
+@pytest.fixture
+def profile_token(monkeypatch):
+    """配置性能分析令牌，限流器的计数不受其他测试影响"""
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", TOKEN)
+    monkeypatch.setattr(profile_limiter, "_started", deque())
+    return TOKEN
+
+
+def render(client, token=None):
+    headers = {"X-Profile-Token": token} if token is not None else {}
+    return client.post(
+        RENDER_URL, json=make_render_request("横向", 3, seed=81), headers=headers
+    )
+
+
+@pytest.mark.parametrize("token", [None, "wrong-token"])
+def test_profiling_requires_token(client, profile_token, token):
+    assert render(client, token).status_code == 403
+
+
+def test_profiling_is_disabled_without_configured_token(client):
+    assert render(client, "").status_code == 403
+
+
+def test_profiling_is_rate_limited(monkeypatch, client, profile_token):
+    monkeypatch.setattr(profile_limiter, "limit", 1)
+    assert render(client, profile_token).status_code == 200
+
+    response = render(client, profile_token)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_thread_pool_profiles_in_separate_process(client, profile_token):
+    response = render(client, profile_token)
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Peak-Memory"]) > 0
+
+    # tracemalloc跟踪整个进程，分析在单独的渲染进程中执行
+    assert isinstance(render_pool.get_executor(), render_pool.ThreadPoolExecutor)
+    (pid,) = render_pool.render_worker_pids()
+    assert pid != os.getpid()
+
+    summary = client.get(
+        f"/api/v1/profiles/{response.headers['X-Profile-Id']}",
+        headers={"X-Profile-Token": profile_token},
+    ).json()
+    assert summary["peak_memory"] == int(response.headers["X-Profile-Peak-Memory"])
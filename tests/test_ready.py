@@ -0,0 +1,44 @@
+# tests/test_ready.py
+"""就绪检查：启动时预热所有模板，预热完成且渲染池可用时就绪，模板缺失时启动失败"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.api.endpoints import notice
+from app.main import app
+from app.services.render_pool import TemplateWarmupError
+
+
+def test_ready_after_warmup(client):
+    response = client.get("/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert set(body["templates"]) == set(notice.TEMPLATE_MAP)
+    for report in body["templates"].values():
+        assert report["engine"] in ("openpyxl", "patch", "streaming")
+        assert report["size"] > 0
+    assert body["memory"]["processes"][0]["role"] == "service"
+
+
+def test_not_ready_outside_lifespan():
+    # 不进入with时不执行启动与关闭过程
+    response = TestClient(app).get("/ready")
+    assert response.status_code == 503
+    assert response.json() == {"status": "not_ready"}
+
+
+def test_not_ready_when_render_pool_is_broken(monkeypatch, client):
+    monkeypatch.setattr(main, "executor_broken", lambda: True)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json() == {"status": "render_pool_broken"}
+
+
+def test_startup_fails_on_missing_template(monkeypatch):
+    monkeypatch.setitem(notice.TEMPLATE_MAP, "缺失模板", "missing.xlsx")
+    with pytest.raises(TemplateWarmupError, match="缺失模板"):
+        with TestClient(app):
+            pass
+    assert TestClient(app).get("/ready").status_code == 503
@@ -0,0 +1,149 @@
+# tests/test_render_jobs.py
+"""异步渲染任务：提交、查询、下载、队列已满时的背压与任务存储"""
+
+import asyncio
+import io
+import time
+
+import openpyxl
+import pytest
+
+from app.services import render_jobs
+from app.services.render_jobs import (
+    JOB_SUCCEEDED,
+    FileJobStore,
+    JobQueue,
+    MemoryJobStore,
+    RenderJob,
+    job_queue,
+)
+from benchmarks.payloads import make_render_request
+
+JOBS_URL = "/api/v1/notices/jobs"
+
+
+def wait_finished(client, status_url: str, timeout: float = 30) -> dict:
+    """轮询任务状态直到完成"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(status_url).json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"任务超过{timeout}秒未完成: {status_url}")
+
+
+def test_job_submit_poll_and_download(client):
+    request = make_render_request("纵向", 10, seed=21)
+
+    submitted = client.post(JOBS_URL, params={"priority": "high"}, json=request)
+    assert submitted.status_code == 202
+    body = submitted.json()
+    assert submitted.headers["Location"] == body["status_url"]
+    assert body["priority"] == "high"
+
+    job = wait_finished(client, body["status_url"])
+    assert job["status"] == JOB_SUCCEEDED
+
+    download = client.get(body["download_url"])
+    assert download.status_code == 200
+    assert (
+        int(download.headers["Content-Length"]) == job["size"] == len(download.content)
+    )
+    wb = openpyxl.load_workbook(io.BytesIO(download.content))
+    values = [v for row in wb.active.iter_rows(values_only=True) for v in row]
+    assert request["data"]["projects"][0]["project_code"] in values
+
+
+def test_unknown_job_returns_404(client):
+    assert client.get(f"{JOBS_URL}/{'0' * 32}").status_code == 404
+    assert client.get(f"{JOBS_URL}/not-a-job-id/download").status_code == 404
+
+
+def test_job_queue_full_returns_429(monkeypatch, client):
+    async def blocked_run(self, job, template_path, context):
+        # 工作者取出的任务一直运行，之后提交的任务留在队列中
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(JobQueue, "_run", blocked_run)
+    monkeypatch.setattr(job_queue, "max_depth", 1)
+    # 以新的配置重新启动任务队列
+    client.portal.call(job_queue.stop)
+    client.portal.call(job_queue.start)
+
+    request = make_render_request("横向", 3, seed=13)
+    statuses = []
+    # 工作者各执行一个任务、队列中等待一个任务后，再提交的任务一定被拒绝
+    for _ in range(job_queue.workers + 2):
+        response = client.post(JOBS_URL, json=request)
+        statuses.append(response.status_code)
+        if response.status_code == 429:
+            break
+
+    assert statuses[0] == 202
+    assert statuses[-1] == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def finished_job(job_id: str) -> RenderJob:
+    return RenderJob(
+        job_id=job_id,
+        template_type="横向",
+        notice_no="N1",
+        filename="n1.xlsx",
+        project_count=1,
+        priority="normal",
+        status=JOB_SUCCEEDED,
+        finished_at=time.time(),
+    )
+
+
+def test_memory_store_caps_artifact_bytes():
+    store = MemoryJobStore(max_size=10)
+    for job_id in ("a", "b", "c"):
+        store.save(finished_job(job_id))
+        store.save_artifact(job_id, io.BytesIO(b"x" * 4))
+
+    # 最早完成的结果被删除，任务状态保留
+    assert store.open_artifact("a") is None
+    assert store.get("a") is not None
+    assert store.open_artifact("b").read() == b"x" * 4
+    assert store.open_artifact("c").read() == b"x" * 4
+
+    with pytest.raises(ValueError):
+        store.save_artifact("d", io.BytesIO(b"x" * 11))
+    assert store.evict(time.time()) == 3
+    store.save_artifact("e", io.BytesIO(b"x" * 10))
+    assert store.open_artifact("e").read() == b"x" * 10
+
+
+def test_multiple_workers_share_file_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(render_jobs, "JOB_DIR", "")
+    monkeypatch.setattr(render_jobs, "JOB_SHARED_DIR", str(tmp_path))
+    assert isinstance(render_jobs._default_store(), MemoryJobStore)
+
+    # uvicorn --workers 的工作进程由主进程启动
+    monkeypatch.setattr(render_jobs.multiprocessing, "parent_process", lambda: object())
+    store = render_jobs._default_store()
+    assert isinstance(store, FileJobStore)
+    assert store.directory == str(tmp_path)
+
+
+def test_artifact_is_saved_off_event_loop(monkeypatch, client):
+    save_artifact = MemoryJobStore.save_artifact
+    on_event_loop = []
+
+    def recording_save_artifact(self, job_id, buffer):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return save_artifact(self, job_id, buffer)
+
+    monkeypatch.setattr(MemoryJobStore, "save_artifact", recording_save_artifact)
+    body = client.post(JOBS_URL, json=make_render_request("横向", 3, seed=41)).json()
+
+    assert wait_finished(client, body["status_url"])["status"] == JOB_SUCCEEDED
+    # 渲染结果可能已溢出到临时文件，不在事件循环中读取
+    assert on_event_loop == [False]
@@ -0,0 +1,103 @@
+# tests/test_render_pool.py
+"""渲染池任务的超时与取消：已在运行的任务在截止时间或取消后中止，让出渲染池"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from openpyxl.worksheet._writer import ALL_TEMP_FILES
+
+from app.services.render_deadline import (
+    RenderCancelledError,
+    RenderTimeoutError,
+    check_deadline,
+    render_deadline,
+)
+from app.services.render_pool import run_in_pool
+from conftest import make_context, render_with_engine, skip_unsupported
+
+
+def busy_render(finished: list, duration: float = 5.0) -> str:
+    """模拟项目很多的渲染：每个项目之间检查截止时间"""
+    try:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            check_deadline()
+            time.sleep(0.01)
+        return "done"
+    except BaseException as e:
+        finished.append(e)
+        raise
+
+
+def test_check_deadline_outside_pool_is_noop():
+    check_deadline()
+
+
+@pytest.mark.parametrize("engine", ["openpyxl", "streaming", "patch"])
+def test_engines_stop_after_deadline(engine):
+    skip_unsupported(engine, "横向")
+    context = make_context("横向", 50)
+    temp_files = list(ALL_TEMP_FILES)
+    with render_deadline(time.time() - 1):
+        with pytest.raises(RenderTimeoutError):
+            render_with_engine(engine, "横向", context)
+    # 中止的流式渲染删除已写出行的临时文件
+    assert ALL_TEMP_FILES == temp_files
+
+
+def test_timeout_aborts_running_job():
+    finished = []
+    done = threading.Event()
+
+    async def main(executor):
+        with pytest.raises(RenderTimeoutError):
+            await run_in_pool(
+                busy_render,
+                finished,
+                timeout=0.2,
+                executor=executor,
+                on_done=done.set,
+            )
+        # 任务在截止时间后的下一次检查时中止，渲染池中的工作者随即空闲
+        started = time.monotonic()
+        result = await run_in_pool(busy_render, [], 0.05, executor=executor)
+        return result, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        result, elapsed = asyncio.run(main(executor))
+
+    assert result == "done"
+    assert elapsed < 1
+    assert done.is_set()
+    assert isinstance(finished[0], RenderTimeoutError)
+
+
+def test_disconnect_cancels_running_thread_job():
+    finished = []
+    done = threading.Event()
+
+    async def disconnected() -> bool:
+        return True
+
+    async def main(executor):
+        with pytest.raises(RenderCancelledError):
+            await run_in_pool(
+                busy_render,
+                finished,
+                timeout=30,
+                is_disconnected=disconnected,
+                executor=executor,
+                on_done=done.set,
+            )
+        await asyncio.get_running_loop().run_in_executor(None, done.wait, 5)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        started = time.monotonic()
+        asyncio.run(main(executor))
+
+    assert time.monotonic() - started < 5
+    assert done.is_set()
+    assert isinstance(finished[0], RenderCancelledError)
@@ -0,0 +1,40 @@
+# tests/test_request_decoding.py
+"""请求解码：直接校验为字典的结果与RenderRequest模型的model_dump()相同"""
+
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from app.models.notice import NoticeData, RenderRequest, decode_render_request
+from benchmarks.payloads import make_render_request
+
+RENDER_URL = "/api/v1/notices/render"
+
+
+def test_decoded_request_matches_model_dump():
+    request = make_render_request("纵向", 5, seed=71)
+    # 缺省字段补为None，数值字符串按模型的类型转换
+    del request["data"]["signing_officer"]
+    del request["data"]["projects"][0]["leader"]
+    request["data"]["projects"][1]["money"] = "12.5"
+
+    decoded = decode_render_request(json.dumps(request).encode("utf-8"))
+    assert decoded == RenderRequest.model_validate(request).model_dump()
+    assert list(decoded["data"]) == list(NoticeData.model_fields)
+
+
+@pytest.mark.parametrize("field", ["notice_no", "date"])
+def test_required_notice_fields(field):
+    request = make_render_request("横向", 1, seed=72)
+    del request["data"][field]
+    with pytest.raises(ValidationError):
+        decode_render_request(json.dumps(request).encode("utf-8"))
+
+
+def test_invalid_request_is_rejected(client):
+    request = make_render_request("横向", 1, seed=73)
+    request["data"]["projects"][0]["money"] = "不是数字"
+
+    response = client.post(RENDER_URL, json=request)
+    assert response.status_code == 422
@@ -0,0 +1,72 @@
+# tests/test_sheet_partitions.py
+"""拆分为多个工作表：按项目数量与行数上限拆分，各工作表依次包含项目列表的一段"""
+
+import io
+
+import openpyxl
+import pytest
+
+from app.services import render_pool
+from app.services.xml_patch_renderer import plan_sheet_partitions
+from benchmarks.payloads import make_render_request
+from conftest import make_context, skip_unsupported, template_path
+
+RENDER_URL = "/api/v1/notices/render"
+
+
+@pytest.mark.parametrize(
+    "projects, max_projects, max_rows, expected",
+    [
+        (10, 4, 1048576, [4, 4, 2]),
+        (8, 4, 1048576, [4, 4]),
+        (4, 4, 1048576, None),
+        (10, 0, 1048576, None),
+    ],
+)
+def test_partitions_by_project_count(projects, max_projects, max_rows, expected):
+    skip_unsupported("patch", "横向")
+    context = make_context("横向", projects)
+    partitions = plan_sheet_partitions(
+        template_path("横向"), context, max_projects, max_rows
+    )
+    if expected is None:
+        assert partitions is None
+    else:
+        assert partitions == ("projects", expected)
+
+
+def test_partitions_by_row_limit():
+    skip_unsupported("patch", "横向")
+    path = template_path("横向")
+    context = make_context("横向", 10)
+    # 行数上限只够容纳模板的固定行与3个项目的行（循环块为1行）
+    fixed_rows = openpyxl.load_workbook(path).active.max_row - 1
+    _, sizes = plan_sheet_partitions(path, context, 0, fixed_rows + 3)
+    assert sizes == [3, 3, 3, 1]
+
+
+def test_render_splits_projects_across_sheets(monkeypatch, client):
+    skip_unsupported("patch", "横向")
+    monkeypatch.setattr(render_pool, "SHEET_MAX_PROJECTS", 4)
+    request = make_render_request("横向", 10, seed=95)
+
+    response = client.post(RENDER_URL, json=request)
+    assert response.status_code == 200
+    wb = openpyxl.load_workbook(io.BytesIO(response.content))
+    base = wb.worksheets[0].title
+    assert wb.sheetnames == [base, f"{base} (2)", f"{base} (3)"]
+    # 只有第一个工作表保持选中状态
+    assert [bool(ws.sheet_view.tabSelected) for ws in wb.worksheets] == [
+        True,
+        False,
+        False,
+    ]
+
+    codes = [project["project_code"] for project in request["data"]["projects"]]
+    sheet_codes = []
+    for ws in wb.worksheets:
+        values = {v for row in ws.iter_rows(values_only=True) for v in row}
+        sheet_codes.append([code for code in codes if code in values])
+        # 表头与表尾在每个工作表中完整保留
+        assert any(request["data"]["notice_no"] in str(v) for v in values)
+    assert sheet_codes == [codes[0:4], codes[4:8], codes[8:10]]
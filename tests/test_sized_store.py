@@ -0,0 +1,75 @@
+# tests/test_sized_store.py
+"""渲染结果缓存与渲染指纹共用的两层存储：LRU淘汰、过期、磁盘层与损坏文件"""
+
+import os
+import time
+
+import pytest
+
+from app.services.output_cache import OutputCache
+from app.services.sized_store import SizedStore
+
+
+def test_subclass_must_define_hooks():
+    class Incomplete(SizedStore):
+        def _size_of(self, value) -> int:
+            return len(value)
+
+    with pytest.raises(TypeError):
+        Incomplete(1024, 60)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = OutputCache(max_size=10, ttl=60, max_item_size=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+
+
+def test_oversized_items_and_expired_entries_are_not_returned(monkeypatch):
+    cache = OutputCache(max_size=100, ttl=60, max_item_size=4)
+    cache.put("big", b"12345")
+    assert cache.get("big") is None
+
+    cache.put("small", b"1234")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("small") is None
+
+
+def test_disk_tier_survives_memory_clear(tmp_path):
+    options = dict(
+        ttl=60, max_item_size=100, disk_dir=str(tmp_path), disk_max_size=1024
+    )
+    cache = OutputCache(max_size=100, **options)
+    cache.put("key", b"content")
+    cache.clear()
+
+    assert cache.get("key") == b"content"
+    # 另一个进程中的缓存实例读取同一目录
+    other = OutputCache(max_size=0, **options)
+    assert other.get("key") == b"content"
+
+
+def test_disk_tier_prunes_to_size_limit(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.services.sized_store.DISK_PRUNE_INTERVAL", 0)
+    cache = OutputCache(
+        max_size=0,
+        ttl=60,
+        max_item_size=100,
+        disk_dir=str(tmp_path),
+        disk_max_size=25,
+    )
+    for index in range(5):
+        cache.put(f"key{index}", b"x" * 10)
+        # 文件修改时间决定清理顺序
+        os.utime(tmp_path / f"key{index}.xlsx", (index, time.time() - 10 + index))
+
+    total = sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+    assert total <= 25
+    assert cache.get("key4") == b"x" * 10
@@ -0,0 +1,109 @@
+# tests/test_upload.py
+"""上传项目数据渲染：NDJSON与CSV上传的输出与JSON请求相同，格式错误与逐行校验失败"""
+
+import csv
+import io
+import json
+
+import openpyxl
+import pytest
+
+from app.models.notice import ProjectInfo
+from benchmarks.payloads import make_render_request
+
+RENDER_URL = "/api/v1/notices/render"
+UPLOAD_URL = "/api/v1/notices/render/upload"
+
+
+def cell_values(content: bytes) -> list:
+    wb = openpyxl.load_workbook(io.BytesIO(content))
+    return [row for row in wb.active.iter_rows(values_only=True)]
+
+
+def upload_fields(request: dict) -> dict:
+    notice = {key: value for key, value in request["data"].items() if key != "projects"}
+    return {
+        "template_type": request["template_type"],
+        "data": json.dumps(notice, ensure_ascii=False),
+    }
+
+
+def ndjson_file(projects: list) -> tuple:
+    content = "".join(json.dumps(p, ensure_ascii=False) + "\n" for p in projects)
+    return "projects.ndjson", content.encode("utf-8"), "application/x-ndjson"
+
+
+def csv_file(projects: list, encoding: str) -> tuple:
+    """表头使用字段说明（如“项目编码”）"""
+    names = list(ProjectInfo.model_fields)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(ProjectInfo.model_fields[name].description for name in names)
+    for project in projects:
+        writer.writerow(project.get(name, "") for name in names)
+    return (
+        "projects.csv",
+        output.getvalue().encode(encoding),
+        f"text/csv; charset={encoding}",
+    )
+
+
+@pytest.mark.parametrize("project_format", ["ndjson", "csv-utf-8", "csv-gbk"])
+def test_upload_matches_json_render(client, project_format):
+    request = make_render_request("横向", 12, seed=91)
+    projects = request["data"]["projects"]
+    if project_format == "ndjson":
+        projects_file = ndjson_file(projects)
+    else:
+        projects_file = csv_file(projects, project_format.split("-", 1)[1])
+
+    response = client.post(
+        UPLOAD_URL, data=upload_fields(request), files={"projects": projects_file}
+    )
+    assert response.status_code == 200
+    expected = client.post(RENDER_URL, json=request)
+    assert cell_values(response.content) == cell_values(expected.content)
+
+
+def test_invalid_project_row_reports_line(client):
+    request = make_render_request("横向", 3, seed=92)
+    projects = request["data"]["projects"]
+    projects[1]["money"] = "不是数字"
+
+    response = client.post(
+        UPLOAD_URL,
+        data=upload_fields(request),
+        files={"projects": ndjson_file(projects)},
+    )
+    assert response.status_code == 422
+    (error,) = response.json()["detail"]
+    assert error["loc"][:3] == ["body", "projects", 2]
+
+
+def test_fields_after_projects_are_rejected(client):
+    request = make_render_request("横向", 1, seed=93)
+    name, content, content_type = ndjson_file(request["data"]["projects"])
+    boundary = "test-boundary"
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="projects"; filename="{name}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode("utf-8") + content
+    for field, value in upload_fields(request).items():
+        body += (
+            f"\r\n--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"\r\n\r\n{value}'
+        ).encode("utf-8")
+    body += f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    response = client.post(
+        UPLOAD_URL,
+        content=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    assert response.status_code == 400
+
+
+def test_upload_requires_multipart(client):
+    response = client.post(UPLOAD_URL, json=make_render_request("横向", 1, seed=94))
+    assert response.status_code == 400
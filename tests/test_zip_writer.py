@@ -0,0 +1,71 @@
+# tests/test_zip_writer.py
+"""输出压缩包：原样复制与边写边压缩的条目可被标准的zipfile读取，条目属性与ZipFile写出的相同"""
+
+import io
+import zipfile
+
+import pytest
+
+from app.services.zip_writer import ZipWriter, compress_entry
+
+
+def read_entries(content: bytes) -> list:
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        assert zf.testzip() is None
+        return [
+            (info.filename, info.date_time, info.external_attr, zf.read(info))
+            for info in zf.infolist()
+        ]
+
+
+@pytest.mark.parametrize("level", [0, 1, 6])
+def test_raw_and_streamed_entries_round_trip(level):
+    info = zipfile.ZipInfo("xl/styles.xml", date_time=(2024, 5, 6, 7, 8, 10))
+    info.external_attr = 0o644 << 16
+    styles = b"<styleSheet/>" * 100
+    sheet = [b"<row>%d</row>" % index for index in range(5000)]
+
+    output = io.BytesIO()
+    with ZipWriter(output, level) as zf:
+        zf.write_raw(compress_entry(info, styles, level))
+        with zf.open("xl/worksheets/sheet1.xml") as entry:
+            for row in sheet:
+                entry.write(row)
+        zf.write_raw(compress_entry(zipfile.ZipInfo("工作表.xml"), b"<x/>", level))
+
+    assert zf.namelist() == ["xl/styles.xml", "xl/worksheets/sheet1.xml", "工作表.xml"]
+    assert read_entries(output.getvalue()) == [
+        ("xl/styles.xml", (2024, 5, 6, 7, 8, 10), 0o644 << 16, styles),
+        (
+            "xl/worksheets/sheet1.xml",
+            (1980, 1, 1, 0, 0, 0),
+            0o600 << 16,
+            b"".join(sheet),
+        ),
+        ("工作表.xml", (1980, 1, 1, 0, 0, 0), 0, b"<x/>"),
+    ]
+
+
+def test_streamed_entry_matches_zipfile_open():
+    data = b"<sheetData/>" * 1000
+    expected = io.BytesIO()
+    with zipfile.ZipFile(expected, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        with zf.open("sheet.xml", "w") as entry:
+            entry.write(data)
+
+    output = io.BytesIO()
+    with ZipWriter(output, 6) as zf:
+        with zf.open("sheet.xml") as entry:
+            entry.write(data)
+
+    assert read_entries(output.getvalue()) == read_entries(expected.getvalue())
+
+
+def test_entries_are_written_one_at_a_time():
+    with ZipWriter(io.BytesIO(), 6) as zf:
+        entry = zf.open("a.xml")
+        with pytest.raises(ValueError):
+            zf.open("b.xml")
+        with pytest.raises(ValueError):
+            zf.write_raw(compress_entry(zipfile.ZipInfo("c.xml"), b"", 6))
+        entry.close()